@@ -0,0 +1,390 @@
+"""
+Benchmarks for the ETL transforms on synthetic TIGER and census data.
+
+Nothing is downloaded: polygon layers shaped like the TIGER county, tract
+and block layers (same column names, nested FIPS codes, the partitioning and
+output format configured in settings.yaml) and census-like frames keyed on
+them are generated from a seed. For each scale these are timed:
+
+* `shp_to_esri_enclosed_json_input`: the in-memory Esri JSON conversion
+* `partition_geo_data`: the partitioned write of the layer, as configured
+* `prep_county_business_patterns_data`: CSV to Parquet of the census frame
+* `sql_create_from_dataframe`: DDL from the census frame
+
+plus `prep_zipcode_to_county_mapping` on a HUD-like crosswalk, with a cold
+and a warm source cache (needs openpyxl).
+
+Each result has the median and min seconds over `--runs`, rows/s, output
+bytes and MB/s, and the tracemalloc peak of one extra run (Python and numpy
+allocations; GEOS and Arrow memory isn't traced). Outputs go to a temporary
+project root, never to data/.
+
+`--fraction` scales the national feature counts (3234 counties, 85528
+tracts, 8.18M blocks); 1.0 is a full national rebuild.
+
+    python benchmarks/bench_etl.py --scales county tract --save
+    python benchmarks/bench_etl.py --compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+
+`--save` writes `benchmarks/results/<commit>.json`. `--compare` prints the
+change per transform and exits with 1 if any got slower than `--threshold`.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import Polygon
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from serverless import settings, tracing
+from serverless.pipeline.pipeline import sql_create_from_dataframe
+from serverless.pipeline.data.tiger import (
+    shp_to_esri_enclosed_json_input, partition_geo_data, prep_zipcode_to_county_mapping
+)
+from serverless.pipeline.data.census_businesspatterns import prep_county_business_patterns_data
+
+from bench_zip_county import synthetic_crosswalk
+
+
+RESULTS_DIR = Path(__file__).parent/'results'
+
+STATES = 56
+NATIONAL_COUNTIES = 3234
+NATIONAL_TRACTS = 85528
+
+# features nationally, vertices per polygon, census rows per feature
+SCALES = {
+    'county': {'features': NATIONAL_COUNTIES, 'vertices': 300, 'census_rows': 600},
+    'tract': {'features': NATIONAL_TRACTS, 'vertices': 60, 'census_rows': 1},
+    'block': {'features': 8180866, 'vertices': 10, 'census_rows': 1},
+}
+
+CENSUS_COUNTS = ['emp', 'qp1', 'ap', 'est', 'n<5', 'n5_9', 'n10_19', 'n20_49', 'n50_99',
+                 'n100_249', 'n250_499', 'n500_999', 'n1000']
+
+
+def _groups(n, groups):
+    """Contiguous group numbers: row i is in group i * groups // n."""
+    return np.arange(n) * groups // max(n, 1)
+
+
+def hierarchy(scale, n, fraction):
+    """Nested state, county, tract and block codes for `n` features of `scale`."""
+    counties = n if scale == 'county' else max(STATES, round(NATIONAL_COUNTIES * fraction))
+    county = _groups(n, counties)
+    codes = {
+        'state': pd.Series(county * STATES // counties).map('{:02d}'.format),
+        'county': pd.Series(county % 1000).map('{:03d}'.format),
+    }
+    if scale == 'tract':
+        codes['tract'] = pd.Series(np.arange(n) % 1000000).map('{:06d}'.format)
+    if scale == 'block':
+        tracts = max(counties, round(NATIONAL_TRACTS * fraction))
+        codes['tract'] = pd.Series(_groups(n, tracts) % 1000000).map('{:06d}'.format)
+        codes['block'] = pd.Series(np.arange(n) % 10000).map('{:04d}'.format)
+    return codes
+
+
+def synthetic_polygons(scale, fraction=0.02, seed=0):
+    """A GeoDataFrame shaped like the TIGER `scale` layer, in EPSG:4269."""
+    config = SCALES[scale]
+    n = max(1, round(config['features'] * fraction))
+    vertices = config['vertices']
+    rng = np.random.default_rng(seed)
+
+    # one jittered ring per grid cell over the continental US
+    columns_x = int(np.ceil(np.sqrt(n * 58 / 24)))
+    cell = min(58 / columns_x, 24 / int(np.ceil(n / columns_x)))
+    centers = np.column_stack([-125 + (np.arange(n) % columns_x + 0.5) * cell,
+                               25 + (np.arange(n) // columns_x + 0.5) * cell])
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = cell * 0.45 * (0.8 + 0.2 * rng.random((n, vertices)))
+    rings = centers[:, None, :] + radii[..., None] * np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+    geometry = [Polygon(ring) for ring in rings]
+
+    codes = hierarchy(scale, n, fraction)
+    suffix = '20' if scale == 'block' else ''
+    columns = {f'STATEFP{suffix}': codes['state'], f'COUNTYFP{suffix}': codes['county']}
+    geoid = codes['state'] + codes['county']
+    if 'tract' in codes:
+        columns[f'TRACTCE{suffix}'] = codes['tract']
+        geoid = geoid + codes['tract']
+    if 'block' in codes:
+        columns[f'BLOCKCE{suffix}'] = codes['block']
+        geoid = geoid + codes['block']
+    columns[f'GEOID{suffix}'] = geoid
+    columns[f'NAME{suffix}'] = 'Feature ' + pd.Series(np.arange(n)).astype(str)
+    columns[f'ALAND{suffix}'] = rng.integers(10**5, 10**10, n)
+    columns[f'AWATER{suffix}'] = rng.integers(0, 10**8, n)
+    columns[f'INTPTLAT{suffix}'] = pd.Series(centers[:, 1]).map('{:+011.7f}'.format)
+    columns[f'INTPTLON{suffix}'] = pd.Series(centers[:, 0]).map('{:+012.7f}'.format)
+    return gpd.GeoDataFrame(columns, geometry=geometry, crs=4269)
+
+
+def synthetic_census(gdf, scale, seed=0):
+    """A County Business Patterns-like frame with `census_rows` rows per feature."""
+    rng = np.random.default_rng(seed)
+    suffix = '20' if scale == 'block' else ''
+    keys = gdf[[c for c in gdf.columns if c.endswith(f'FP{suffix}') or c.endswith(f'CE{suffix}')]]
+    per_feature = SCALES[scale]['census_rows']
+    df = keys.loc[keys.index.repeat(per_feature)].reset_index(drop=True)
+    df.columns = ['fipstate', 'fipscty'] + [c.lower() for c in df.columns[2:]]
+    n = len(df)
+    naics = np.array(['------'] + [f'{i:02d}----' for i in range(11, 93)] + [f'{i:06d}' for i in range(111110, 111110 + 600)])
+    df['naics'] = naics[np.arange(n) % per_feature] if per_feature > 1 else '------'
+    for col in CENSUS_COUNTS:
+        df[col] = rng.integers(0, 5000, n)
+        if col in ('emp', 'qp1', 'ap'):
+            df[f'{col}_nf'] = rng.choice(['G', 'H', 'J'], n)
+    return df
+
+
+def measure(name, scale, rows, func, runs, size=None):
+    """Median/min seconds over `runs`, plus output size and tracemalloc peak of one more run."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = statistics.median(times)
+    output_bytes = size(result) if size else result
+    return {
+        'transform': name,
+        'scale': scale,
+        'rows': rows,
+        'seconds': seconds,
+        'min_seconds': min(times),
+        'rows_per_s': rows / seconds if seconds else None,
+        'output_bytes': output_bytes,
+        'mb_per_s': output_bytes / 1e6 / seconds if seconds else None,
+        'peak_traced_bytes': peak,
+        'process_peak_rss_bytes': tracing.peak_rss(),
+    }
+
+
+def _size(path):
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def bench_scale(scale, root, fraction, runs, transforms, seed):
+    print(f'BENCH: generating {scale} layer', file=sys.stderr)
+    gdf = synthetic_polygons(scale, fraction, seed)
+    census = synthetic_census(gdf, scale, seed)
+    layer = settings.etl.tiger.get(scale)
+    results = []
+
+    def run(name, func, rows, size=None):
+        if transforms and name not in transforms:
+            return
+        print(f'BENCH: {name} on {rows} {scale} rows', file=sys.stderr)
+        results.append(measure(name, scale, rows, func, runs, size))
+
+    run('shp_to_esri_enclosed_json_input', lambda: shp_to_esri_enclosed_json_input(gdf), len(gdf),
+        size=lambda result: len(json.dumps(result)))
+
+    processed_path = root/settings.data.processed_path/'bench'/scale
+    source = root/settings.data.interim_path/'bench'/f'{scale}.shp'
+
+    def partition():
+        shutil.rmtree(processed_path, ignore_errors=True)
+        entries = partition_geo_data(
+            source, layer.partition_by, processed_path, input_df=gdf,
+            output_format=layer.get('output_format', 'esri_json'),
+            compression=layer.get('compression', 'snappy'),
+            row_group_size=layer.get('row_group_size'),
+        )
+        return sum(e['bytes'] for e in entries)
+
+    run('partition_geo_data', partition, len(gdf))
+
+    csv_file = root/settings.data.raw_path/'bench'/f'{scale}_cbp.txt'
+    csv_file.parent.mkdir(parents=True, exist_ok=True)
+    census.to_csv(csv_file, index=False)
+    parquet_file = root/settings.data.processed_path/'bench'/f'{scale}_cbp.parquet'
+    run('prep_county_business_patterns_data',
+        lambda: prep_county_business_patterns_data(csv_file, parquet_file) or _size(parquet_file),
+        len(census))
+
+    run('sql_create_from_dataframe', lambda: sql_create_from_dataframe(census, f'bench_{scale}'), len(census),
+        size=lambda sql_text: len(sql_text.encode()))
+
+    return results
+
+
+def bench_crosswalk(root, rows, runs, seed):
+    """`prep_zipcode_to_county_mapping` with a cold and a warm source cache."""
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        print('BENCH: openpyxl is not installed, skipping prep_zipcode_to_county_mapping', file=sys.stderr)
+        return []
+
+    print(f'BENCH: prep_zipcode_to_county_mapping on {rows} rows', file=sys.stderr)
+    source = root/settings.data.raw_path/'bench'/'ZIP_COUNTY.xlsx'
+    source.parent.mkdir(parents=True, exist_ok=True)
+    synthetic_crosswalk(rows, seed).to_excel(source, index=False, engine='openpyxl')
+    outpath = root/settings.data.processed_path/'bench'/'mapping'
+    cache = root/settings.data.interim_path/'cache'
+
+    def prep(cold):
+        if cold:
+            shutil.rmtree(cache, ignore_errors=True)
+        shutil.rmtree(outpath, ignore_errors=True)
+        return sum(e['bytes'] for e in prep_zipcode_to_county_mapping(source, outpath, ['statefp']))
+
+    return [
+        measure('prep_zipcode_to_county_mapping', 'crosswalk_cold_cache', rows, lambda: prep(True), runs),
+        measure('prep_zipcode_to_county_mapping', 'crosswalk_warm_cache', rows, lambda: prep(False), runs),
+    ]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def environment():
+    import pyarrow
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'geopandas': gpd.__version__,
+        'shapely': shapely.__version__,
+        'pyarrow': pyarrow.__version__,
+    }
+
+
+def run_benchmarks(scales, fraction, runs, transforms=None, crosswalk_rows=54000, seed=0):
+    """Run every benchmark under a temporary project root; returns the results document."""
+    original_root = settings.root_path
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.root_path = Path(tmp)
+        try:
+            results = []
+            for scale in scales:
+                results.extend(bench_scale(scale, Path(tmp), fraction, runs, transforms, seed))
+            if crosswalk_rows and (not transforms or 'prep_zipcode_to_county_mapping' in transforms):
+                results.extend(bench_crosswalk(Path(tmp), crosswalk_rows, runs, seed))
+        finally:
+            settings.root_path = original_root
+
+    return {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'args': {'scales': scales, 'fraction': fraction, 'runs': runs, 'seed': seed,
+                 'crosswalk_rows': crosswalk_rows},
+        'environment': environment(),
+        'results': results,
+    }
+
+
+def compare(before, after, threshold=0.1):
+    """Print the change of each transform from `before` to `after`; returns the regressions."""
+    def index(doc):
+        return {(r['transform'], r['scale']): r for r in doc['results']}
+
+    old, new = index(before), index(after)
+    print(f"{before['commit']} -> {after['commit']}")
+    if before['args'] != after['args']:
+        print(f"  note: different arguments, {before['args']} vs {after['args']}")
+    print(f"  {'transform':<36} {'scale':<22} {'before s':>9} {'after s':>9} {'time':>7} {'memory':>7} {'output':>7}")
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        o, n = old[key], new[key]
+        ratio = n['seconds'] / o['seconds'] if o['seconds'] else float('nan')
+        memory = n['peak_traced_bytes'] / o['peak_traced_bytes'] if o['peak_traced_bytes'] else float('nan')
+        output = n['output_bytes'] / o['output_bytes'] if o['output_bytes'] else float('nan')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            flag = '  SLOWER'
+        print(f"  {key[0]:<36} {key[1]:<22} {o['seconds']:>9.3f} {n['seconds']:>9.3f} "
+              f"{ratio:>6.2f}x {memory:>6.2f}x {output:>6.2f}x{flag}")
+    for key in sorted(old.keys() - new.keys()):
+        print(f'  {key[0]:<36} {key[1]:<22} only in {before["commit"]}')
+    for key in sorted(new.keys() - old.keys()):
+        print(f'  {key[0]:<36} {key[1]:<22} only in {after["commit"]}')
+    return regressions
+
+
+def _load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=list(SCALES))
+    parser.add_argument('--fraction', type=float, default=0.02,
+                        help='fraction of the national feature counts to generate')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--transforms', nargs='+', help='only run these transforms')
+    parser.add_argument('--crosswalk-rows', type=int, default=54000, help='0 skips the crosswalk benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help='write the results JSON here')
+    parser.add_argument('--save', action='store_true', help='write benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs='+', type=Path, metavar='RESULTS',
+                        help='compare two results files, or one against a new run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown that counts as a regression in --compare')
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes one or two results files')
+
+    if args.compare and len(args.compare) == 2:
+        before, after = map(_load, args.compare)
+    else:
+        after = run_benchmarks(args.scales, args.fraction, args.runs, args.transforms,
+                               args.crosswalk_rows, args.seed)
+        outputs = [args.output] if args.output else []
+        if args.save:
+            outputs.append(RESULTS_DIR/f"{after['commit']}.json")
+        for to_file in outputs:
+            to_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(to_file, 'w') as file:
+                json.dump(after, file, indent=2)
+            print(f'BENCH: results written to {to_file}', file=sys.stderr)
+        if not args.compare:
+            print(json.dumps(after, indent=2))
+            return 0
+        before = _load(args.compare[0])
+
+    return 1 if compare(before, after, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Before/after benchmark for the ZIP-county mapping prep.
+
+A synthetic crosswalk shaped like HUD's ZIP_COUNTY file (zip, county,
+usps_zip_pref_city, usps_zip_pref_state and the ratio columns) is timed
+three ways:
+
+* `transform`: the old per-row `apply(lambda x: x[:2])` prep against
+  `tiger.zipcode_to_county_mapping` (vectorized slicing, categoricals)
+* `memory`: bytes held by the state/city columns as object vs categorical
+* `parse`: `pd.read_excel` through openpyxl on every run against a
+  source-cache hit (`read_excel_cached`); needs openpyxl
+
+Results are printed as JSON:
+
+    python benchmarks/bench_zip_county.py --rows 54000 --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from serverless.pipeline.data.tiger import zipcode_to_county_mapping
+from serverless.pipeline.data.sources import read_excel_cached
+
+
+def synthetic_crosswalk(rows=54000, seed=0):
+    rng = np.random.default_rng(seed)
+    states = np.array([f'{i:02d}' for i in range(1, 57)])
+    cities = np.array([f'CITY {i}' for i in range(rows // 3 or 1)])
+    statefp = rng.choice(states, rows)
+    return pd.DataFrame({
+        'zip': pd.Series(rng.integers(0, 100000, rows)).map('{:05d}'.format),
+        'county': pd.Series(statefp) + pd.Series(rng.integers(1, 200, rows)).map('{:03d}'.format),
+        'usps_zip_pref_city': rng.choice(cities, rows),
+        'usps_zip_pref_state': pd.Series(statefp).map(lambda s: f'S{s}'),
+        'res_ratio': rng.random(rows),
+        'bus_ratio': rng.random(rows),
+        'oth_ratio': rng.random(rows),
+        'tot_ratio': rng.random(rows),
+    })
+
+
+def legacy_mapping(df):
+    """The transform as `prep_zipcode_to_county_mapping` did it before."""
+    df = df.copy()
+    df['statefp'] = df['county'].apply(lambda x: x[:2])
+    df['countyfp'] = df['county'].apply(lambda x: x[2:])
+    df['state'] = df['usps_zip_pref_state'].str.lower()
+    df['city'] = df['usps_zip_pref_city'].str.lower()
+    return df
+
+
+def _time(func, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench_transform(df, runs):
+    before, old = _time(lambda: legacy_mapping(df), runs)
+    after, new = _time(lambda: zipcode_to_county_mapping(df), runs)
+    pd.testing.assert_frame_equal(
+        old[['statefp', 'countyfp', 'state', 'city']],
+        new[['statefp', 'countyfp', 'state', 'city']].astype(str)
+    )
+    memory = {
+        'before_bytes': int(old[['state', 'city']].memory_usage(deep=True, index=False).sum()),
+        'after_bytes': int(new[['state', 'city']].memory_usage(deep=True, index=False).sum()),
+    }
+    return {'before_s': before, 'after_s': after, 'speedup': before / after}, memory
+
+
+def bench_parse(df, runs):
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return {'skipped': 'openpyxl is not installed'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'ZIP_COUNTY.xlsx'
+        df.to_excel(source, index=False, engine='openpyxl')
+        dtype = {'zip': str, 'county': str}
+        before, _ = _time(lambda: pd.read_excel(source, engine='openpyxl', dtype=dtype), runs)
+        first, _ = _time(lambda: read_excel_cached(source, cache_root=Path(tmp)/'cache', dtype=dtype), 1)
+        after, _ = _time(lambda: read_excel_cached(source, cache_root=Path(tmp)/'cache', dtype=dtype), runs)
+    return {'before_s': before, 'first_cached_run_s': first, 'after_s': after, 'speedup': before / after}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=54000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--skip-parse', action='store_true')
+    args = parser.parse_args(argv)
+
+    df = synthetic_crosswalk(args.rows)
+    transform, memory = bench_transform(df, args.runs)
+    result = {'rows': args.rows, 'runs': args.runs, 'transform': transform, 'memory': memory}
+    if not args.skip_parse:
+        result['parse'] = bench_parse(df, args.runs)
+
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Small client for the query API that decodes every response format into pandas."""
+import io
+from typing import Dict
+
+import pandas as pd
+import requests
+
+
+ACCEPT = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def read_response(response: requests.Response) -> pd.DataFrame:
+    """
+    Decode an API response into a DataFrame based on its Content-Type.
+
+    `requests` already undoes gzip (and br, when brotli is installed)
+    Content-Encoding, so only the payload format matters here.
+    """
+    response.raise_for_status()
+    content_type = response.headers.get('Content-Type', 'application/json').split(';')[0].strip()
+
+    if content_type == ACCEPT['arrow']:
+        import pyarrow as pa
+        return pa.ipc.open_stream(response.content).read_pandas()
+    if content_type in (ACCEPT['parquet'], 'application/x-parquet'):
+        return pd.read_parquet(io.BytesIO(response.content))
+    if content_type == ACCEPT['ndjson']:
+        return pd.read_json(io.StringIO(response.text), orient='records', lines=True)
+    return pd.read_json(io.StringIO(response.text), orient='records')
+
+
+def query(url: str, query_name: str=None, params: Dict[str, str]=None, fmt: str='arrow',
+          compress: bool=True, session: requests.Session=None, sql: str=None, **options) -> pd.DataFrame:
+    """
+    Run a named query against the API endpoint and return the result as a DataFrame.
+
+    `query_name` is one of `named_queries.NAMED_QUERIES` and `params` its
+    parameters, e.g. `query(url, 'tracts_in_county', {'statefp': '47', 'countyfp': '037'})`;
+    without a name the endpoint runs its default query. Raw `sql` is opt-in:
+    it must be passed by keyword and only works against a deployment with
+    `ALLOW_RAW_SQL=1`. Other keyword arguments (`mode`, `columns`, `limit`,
+    `cache`) are sent as query-string parameters.
+    """
+    if query_name and sql:
+        raise ValueError('pass either query_name or sql, not both')
+    headers: Dict[str, str] = {'Accept': ACCEPT[fmt]}
+    if compress:
+        headers['Accept-Encoding'] = 'br, gzip'
+    query_params = {**options, **(params or {})}
+    if query_name:
+        query_params['query'] = query_name
+    if sql:
+        query_params['sql'] = sql
+    response = (session or requests).get(url, params=query_params, headers=headers)
+    return read_response(response)
@@ -0,0 +1,39 @@
+"""Lazily fetched serving artifacts (lookup tables, spatial indexes) from S3."""
+import os
+from pathlib import Path
+
+
+ARTIFACT_DIR = Path(os.environ.get('ARTIFACT_DIR', '/tmp/artifacts'))
+
+
+class ArtifactStore:
+    """
+    Download-once cache of S3 objects in the container's /tmp.
+
+    Files are stored under the dataset version, so a pipeline run that
+    publishes a new version makes warm containers fetch fresh copies. Opened
+    objects (e.g. LookupTable) are kept in memory for the container's life.
+    """
+
+    def __init__(self, s3_client, bucket, loader, root=ARTIFACT_DIR):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.loader = loader
+        self.root = Path(root)
+        self._loaded = {}
+
+    def path(self, key, version):
+        local = self.root/version/key
+        if not local.is_file():
+            local.parent.mkdir(parents=True, exist_ok=True)
+            part = local.with_name(local.name + '.part')
+            self.s3.download_file(self.bucket, key, str(part))
+            os.replace(part, local)
+        return local
+
+    def get(self, key, version):
+        """The loaded artifact for `key`, fetching it on first use."""
+        if (key, version) not in self._loaded:
+            self._loaded = {k: v for k, v in self._loaded.items() if k[1] == version}
+            self._loaded[(key, version)] = self.loader(self.path(key, version))
+        return self._loaded[(key, version)]
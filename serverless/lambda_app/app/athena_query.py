@@ -0,0 +1,212 @@
+"""Waiting on Athena queries from inside a Lambda invocation."""
+import json
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+
+TERMINAL_STATES = {'SUCCEEDED', 'FAILED', 'CANCELLED'}
+
+# leave this much of the invocation for reading results and responding
+DEADLINE_SAFETY_MS = 2000
+
+
+class QueryError(Exception):
+    """An Athena query failed, was cancelled or ran past the deadline."""
+
+    def __init__(self, message, status_code=502, state=None, query_execution_id=None, metrics=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.state = state
+        self.query_execution_id = query_execution_id
+        self.metrics = metrics or {}
+
+    def to_response(self):
+        return {
+            'statusCode': self.status_code,
+            'headers': {'Content-Type': 'application/json', **metrics_headers(self.metrics)},
+            'body': json.dumps({
+                'error': self.message,
+                'state': self.state,
+                'query_execution_id': self.query_execution_id,
+            })
+        }
+
+
+def deadline_from_context(context, safety_ms=DEADLINE_SAFETY_MS):
+    """Monotonic deadline derived from the Lambda context, or None without one."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + max(context.get_remaining_time_in_millis() - safety_ms, 0) / 1000
+
+
+# StartQueryExecution error codes that aren't Athena's fault
+START_ERROR_STATUS = {
+    'InvalidRequestException': 400,
+    'TooManyRequestsException': 429,
+    'ThrottlingException': 429,
+}
+
+
+def start_query(client, **kwargs):
+    """
+    `start_query_execution(**kwargs)`, returning the query execution id.
+
+    A rejected request raises QueryError: 400 for an invalid query, 429 when
+    Athena throttles and 502 for anything else.
+    """
+    try:
+        return client.start_query_execution(**kwargs)['QueryExecutionId']
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        raise QueryError(
+            error.get('Message') or str(e),
+            status_code=START_ERROR_STATUS.get(error.get('Code'), 502), state='NOT_STARTED'
+        )
+
+
+def wait_for_query(client, query_execution_id, deadline=None, base_delay=0.1, max_delay=2.0):
+    """
+    Poll `get_query_execution` until the query finishes.
+
+    Sleeps use full-jitter exponential backoff between `base_delay` and
+    `max_delay` seconds and never overshoot `deadline`. Returns polling
+    metrics for a SUCCEEDED query; raises QueryError with status 400 for
+    user errors, 502 for other failures and cancellations, and 504 (after
+    stopping the query) when the deadline passes first.
+    """
+    start = time.monotonic()
+    metrics = {'query_execution_id': query_execution_id, 'polls': 0}
+    attempt = 0
+
+    while True:
+        execution = client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        metrics['polls'] += 1
+        status = execution['Status']
+        state = status['State']
+
+        if state in TERMINAL_STATES:
+            statistics = execution.get('Statistics', {})
+            metrics.update({
+                'state': state,
+                'wait_ms': int((time.monotonic() - start) * 1000),
+                'engine_ms': statistics.get('EngineExecutionTimeInMillis'),
+                'bytes_scanned': statistics.get('DataScannedInBytes'),
+            })
+            if state == 'SUCCEEDED':
+                return metrics
+            user_error = status.get('AthenaError', {}).get('ErrorCategory') == 2
+            raise QueryError(
+                status.get('StateChangeReason') or f'query {state.lower()}',
+                status_code=400 if user_error else 502,
+                state=state, query_execution_id=query_execution_id, metrics=metrics
+            )
+
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        attempt += 1
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                client.stop_query_execution(QueryExecutionId=query_execution_id)
+                metrics.update({'state': 'TIMEOUT', 'wait_ms': int((time.monotonic() - start) * 1000)})
+                raise QueryError(
+                    'query did not finish before the function timeout',
+                    status_code=504, state='TIMEOUT',
+                    query_execution_id=query_execution_id, metrics=metrics
+                )
+            delay = min(delay, remaining)
+        time.sleep(delay)
+
+
+def metrics_headers(metrics):
+    """Response headers exposing the polling metrics of a query."""
+    names = {
+        'query_execution_id': 'X-Athena-Query-Id',
+        'polls': 'X-Athena-Polls',
+        'wait_ms': 'X-Athena-Wait-Ms',
+        'engine_ms': 'X-Athena-Engine-Ms',
+        'bytes_scanned': 'X-Athena-Bytes-Scanned',
+    }
+    return {header: str(metrics[key]) for key, header in names.items() if metrics.get(key) is not None}
+
+
+def _boolean(value):
+    return value == 'true'
+
+
+def _decimal(value):
+    # kept as the exact decimal string; a float would round it
+    return value
+
+
+ATHENA_CONVERTERS = {
+    'tinyint': int,
+    'smallint': int,
+    'integer': int,
+    'bigint': int,
+    'float': float,
+    'real': float,
+    'double': float,
+    'decimal': _decimal,
+    'boolean': _boolean,
+}
+
+
+def column_converters(column_info):
+    """One converter per column from the `ResultSetMetadata` Athena types.
+
+    Types without a converter (varchar, date, timestamp, ...) stay strings,
+    as do decimals, so they keep their exact value.
+    """
+    return [ATHENA_CONVERTERS.get(col['Type'].lower(), str) for col in column_info]
+
+
+def convert_columns(raw_columns, converters):
+    """Convert column-wise; missing cells (no VarCharValue) become None."""
+    return [
+        [None if value is None else convert(value) for value in column]
+        for column, convert in zip(raw_columns, converters)
+    ]
+
+
+def iter_result_pages(client, query_execution_id, next_token=None, max_rows=None, page_size=1000):
+    """
+    Follow `NextToken` through `get_query_results`.
+
+    Yields `(columns, converters, rows, next_token)` where `rows` are typed
+    tuples. The header row Athena puts at the top of the first page is
+    dropped. `max_rows` caps the total rows fetched; page sizes shrink so
+    no row is fetched past it, which keeps `next_token` an exact
+    continuation point.
+    """
+    first_page = next_token is None
+    fetched = 0
+    while True:
+        kwargs = {'QueryExecutionId': query_execution_id}
+        size = page_size if max_rows is None else min(page_size, max_rows - fetched + first_page)
+        if size <= 0:
+            return
+        kwargs['MaxResults'] = size
+        if next_token:
+            kwargs['NextToken'] = next_token
+
+        response = client.get_query_results(**kwargs)
+        column_info = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        columns = [col['Label'] for col in column_info]
+        converters = column_converters(column_info)
+
+        rows = response['ResultSet']['Rows']
+        if first_page:
+            rows = rows[1:]
+            first_page = False
+        raw_columns = list(zip(*[[d.get('VarCharValue') for d in row['Data']] for row in rows]))
+        typed = convert_columns(raw_columns, converters) if rows else [[] for _ in columns]
+
+        next_token = response.get('NextToken')
+        fetched += len(rows)
+        yield columns, converters, list(zip(*typed)), next_token
+
+        if not next_token:
+            return
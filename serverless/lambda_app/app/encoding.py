@@ -0,0 +1,206 @@
+"""Content negotiation and encoding of query results for the API Gateway proxy."""
+import base64
+import gzip
+import io
+import json
+import os
+
+from athena_query import QueryError
+
+
+# API Gateway rejects Lambda proxy responses over 6 MB
+MAX_RESPONSE_BYTES = int(os.environ.get('MAX_RESPONSE_BYTES', 5_500_000))
+
+BATCH_ROWS = 10000
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FORMATS = {media_type: fmt for fmt, media_type in MEDIA_TYPES.items()}
+FORMATS['application/x-parquet'] = 'parquet'
+TEXT_FORMATS = {'json', 'ndjson'}
+
+
+class ResponseTooLarge(QueryError):
+
+    def __init__(self, limit):
+        super().__init__(
+            f'result exceeds {limit} bytes; narrow the query, select fewer columns or add a LIMIT',
+            status_code=413, state='SUCCEEDED'
+        )
+
+
+def _parse_accept(header):
+    """`(value, q)` pairs of an Accept or Accept-Encoding header, best first."""
+    choices = []
+    for i, part in enumerate((header or '').split(',')):
+        value, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, number = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if value:
+            choices.append((value.strip().lower(), q, i))
+    return [(value, q) for value, q, _ in sorted(choices, key=lambda c: (-c[1], c[2]))]
+
+
+def negotiate_format(accept=None, override=None):
+    """Output format from a `format=` override or the Accept header; JSON by default."""
+    if override in MEDIA_TYPES:
+        return override
+    for media_type, q in _parse_accept(accept):
+        if q > 0 and media_type in FORMATS:
+            return FORMATS[media_type]
+    return 'json'
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate_encoding(accept_encoding=None):
+    """`br` (when the brotli module is available), `gzip` or None."""
+    for encoding, q in _parse_accept(accept_encoding):
+        if q <= 0:
+            continue
+        if encoding == 'br' and _brotli() is not None:
+            return 'br'
+        if encoding == 'gzip':
+            return 'gzip'
+    return None
+
+
+def _check(size, max_bytes):
+    if size > max_bytes:
+        raise ResponseTooLarge(max_bytes)
+
+
+def _batches(records, size=BATCH_ROWS):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_records_json(records, max_bytes=MAX_RESPONSE_BYTES):
+    """
+    Encode records as a compact JSON array one row at a time.
+
+    Raises ResponseTooLarge as soon as the body passes `max_bytes`, so an
+    oversized result is never fully materialized.
+    """
+    out = io.StringIO()
+    size = 1
+    out.write('[')
+    for i, record in enumerate(records):
+        chunk = (',' if i else '') + json.dumps(record, separators=(',', ':'))
+        size += len(chunk)
+        _check(size, max_bytes)
+        out.write(chunk)
+    out.write(']')
+    return out.getvalue().encode()
+
+
+def encode_records_ndjson(records, max_bytes=MAX_RESPONSE_BYTES):
+    out = io.StringIO()
+    size = 0
+    for record in records:
+        chunk = json.dumps(record, separators=(',', ':')) + '\n'
+        size += len(chunk)
+        _check(size, max_bytes)
+        out.write(chunk)
+    return out.getvalue().encode()
+
+
+def encode_records_arrow(records, fmt, max_bytes=MAX_RESPONSE_BYTES):
+    """
+    Arrow IPC stream or Parquet, written in record batches of `BATCH_ROWS`.
+
+    The schema is inferred from the data. Batches are held back while a
+    column has only been null, so a column that is null in the first
+    batch gets its type from a later one instead of failing on it.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = pa.BufferOutputStream()
+    writer = None
+    schema = None
+    pending = []
+    for batch in _batches(records):
+        if writer is not None:
+            pending.append(pa.Table.from_pylist(batch, schema=schema))
+        else:
+            pending.append(pa.Table.from_pylist(batch))
+            schema = pa.unify_schemas([table.schema for table in pending])
+            if any(pa.types.is_null(field.type) for field in schema):
+                continue
+            if fmt == 'arrow':
+                writer = pa.ipc.new_stream(sink, schema)
+            else:
+                writer = pq.ParquetWriter(sink, schema, compression='snappy')
+        for table in pending:
+            writer.write_table(table.cast(schema))
+        pending = []
+        _check(sink.tell(), max_bytes)
+
+    if writer is None:
+        # no rows, or columns that are null throughout
+        schema = pa.unify_schemas([table.schema for table in pending]) if pending else pa.schema([])
+        writer = pa.ipc.new_stream(sink, schema) if fmt == 'arrow' else pq.ParquetWriter(sink, schema)
+        for table in pending:
+            writer.write_table(table.cast(schema))
+    writer.close()
+    _check(sink.tell(), max_bytes)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_records(records, fmt, max_bytes=MAX_RESPONSE_BYTES):
+    """Encode an iterable of record dicts in `fmt`; returns bytes."""
+    if fmt == 'json':
+        return encode_records_json(records, max_bytes)
+    if fmt == 'ndjson':
+        return encode_records_ndjson(records, max_bytes)
+    return encode_records_arrow(records, fmt, max_bytes)
+
+
+def response_headers(fmt, content_encoding=None):
+    headers = {'Content-Type': MEDIA_TYPES[fmt], 'Vary': 'Accept, Accept-Encoding'}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    return headers
+
+
+def is_base64(fmt, content_encoding=None):
+    """Binary formats and compressed bodies travel base64-encoded through API Gateway."""
+    return fmt not in TEXT_FORMATS or content_encoding is not None
+
+
+def encode_body(payload, fmt, content_encoding=None, max_bytes=MAX_RESPONSE_BYTES):
+    """Compress `payload` if negotiated and turn it into a proxy response body."""
+    if content_encoding == 'gzip':
+        payload = gzip.compress(payload)
+    elif content_encoding == 'br':
+        payload = _brotli().compress(payload)
+
+    if is_base64(fmt, content_encoding):
+        body = base64.b64encode(payload).decode()
+    else:
+        body = payload.decode()
+    _check(len(body), max_bytes)
+    return body
@@ -1,38 +1,336 @@
+import base64
+import codecs
+import csv
+import re
+import os
+import time
 import typing
+import uuid
 from pathlib import Path
 import json
 
-import pandas as pd
 import boto3
-import s3fs
+from botocore.exceptions import ClientError
 
+from athena_query import (
+    QueryError, start_query, wait_for_query, deadline_from_context, metrics_headers, column_converters
+)
+from result_cache import ResultCache, cache_headers
+from named_queries import NAMED_QUERIES, DEFAULT_QUERY, DEFAULT_PARAMS, InvalidQuery, resolve
+from artifacts import ArtifactStore
+from lookup import LookupTable
+from encoding import (
+    encode_records, encode_body, negotiate_format, negotiate_encoding, response_headers, is_base64
+)
 
+
+# module-level clients are created once per container and reused by
+# every warm invocation
 ath = boto3.client('athena')
+s3_client = boto3.client('s3')
+
+WORK_GROUP = os.environ.get('WORK_GROUP', 'serverlessprez')
+ALLOW_RAW_SQL = os.environ.get('ALLOW_RAW_SQL') == '1'
+
+cache = ResultCache(
+    s3_client,
+    bucket=os.environ.get('RESULT_CACHE_BUCKET', 'serverlessprez'),
+    max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 128)),
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 86400)),
+)
+
+
+ARTIFACT_BUCKET = os.environ.get('ARTIFACT_BUCKET', 'serverlessprez')
+
+lookups = ArtifactStore(s3_client, ARTIFACT_BUCKET, LookupTable)
+
+LOOKUP_NAMES = {'county_population', 'county_business_patterns', 'zip_county'}
+MAX_LOOKUP_RANGE = 1000
+
+
+def lookup_response(params):
+    """
+    Answer `?lookup=<name>&key=<k>` or `?lookup=<name>&lo=<a>&hi=<b>` from a
+    precomputed lookup table instead of Athena.
+    """
+    start = time.monotonic()
+    name = params['lookup']
+    if name not in LOOKUP_NAMES:
+        return QueryError(f'unknown lookup {name!r}; available: {sorted(LOOKUP_NAMES)}', status_code=400).to_response()
+
+    if 'key' not in params and not ('lo' in params and 'hi' in params):
+        return QueryError('lookup needs key=, or lo= and hi=', status_code=400).to_response()
+    try:
+        limit = min(int(params.get('limit', MAX_LOOKUP_RANGE)), MAX_LOOKUP_RANGE)
+    except ValueError:
+        return QueryError(f"limit must be an integer, got {params['limit']!r}", status_code=400).to_response()
+
+    version = cache.dataset_version()
+    try:
+        table = lookups.get(f'lookup/{name}.lkp', version)
+    except ClientError:
+        return QueryError(f'lookup {name!r} is not available', status_code=404).to_response()
+    if 'key' in params:
+        records = table.get(params['key'], [])
+    else:
+        records = [r for _, group in table.range(params['lo'], params['hi'], limit=limit) for r in group]
+
+    return {
+        'statusCode': 200 if records else 404,
+        'headers': {
+            'Content-Type': 'application/json',
+            'X-Lookup-Us': str(int((time.monotonic() - start) * 1e6)),
+            'X-Dataset-Version': version,
+        },
+        'body': json.dumps(records, separators=(',', ':'))
+    }
+
+
+def _load_spatial_index(path):
+    # numpy is only imported once a spatial route is used
+    from spatial import SpatialIndex
+    return SpatialIndex(path)
+
+
+spatial_indexes = ArtifactStore(s3_client, ARTIFACT_BUCKET, _load_spatial_index)
+
+# layer -> state column for layers indexed per state, None for national ones
+SPATIAL_LAYERS = {'county': None, 'zcta': None, 'tract': 'STATEFP', 'block': 'STATEFP20'}
+MAX_SPATIAL_POINTS = int(os.environ.get('MAX_SPATIAL_POINTS', 100000))
+MAX_BBOX_FEATURES = 1000
+
+
+def locate_points(layer, lons, lats, version):
+    """
+    Attributes of the `layer` feature containing each point, or None.
+
+    Per-state layers are resolved in two passes: the national county index
+    finds each point's state, then points are grouped by state and looked
+    up in that state's index, so every index is queried once per batch.
+    """
+    import numpy as np
+
+    lons = np.asarray(lons, dtype='f8')
+    lats = np.asarray(lats, dtype='f8')
+    results = [None] * len(lons)
+
+    if SPATIAL_LAYERS[layer] is None:
+        groups = {'all': np.arange(len(lons))}
+    else:
+        counties = spatial_indexes.get('spatial/county/all.sidx', version)
+        found, inverse = np.unique(counties.query_points(lons, lats), return_inverse=True)
+        # several counties map to one state, so group points by the state itself
+        states = np.array([counties.attributes_of(f)['STATEFP'] if f >= 0 else '' for f in found])
+        point_states = states[inverse.ravel()]
+        groups = {state: np.flatnonzero(point_states == state) for state in np.unique(point_states) if state}
+
+    for name, pts in groups.items():
+        index = spatial_indexes.get(f'spatial/{layer}/{name}.sidx', version)
+        found, inverse = np.unique(index.query_points(lons[pts], lats[pts]), return_inverse=True)
+        attributes = [index.attributes_of(f) if f >= 0 else None for f in found]
+        for point, i in zip(pts.tolist(), inverse.tolist()):
+            results[point] = attributes[i]
+    return results
+
+
+def _spatial_points(params, event):
+    """Points from `lat=&lon=`, or a JSON body of `{"points": [[lon, lat], ...]}` / `{"lon": [...], "lat": [...]}`."""
+    if 'lat' in params and 'lon' in params:
+        return [float(params['lon'])], [float(params['lat'])]
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    payload = json.loads(body or '{}')
+    if 'points' in payload:
+        points = payload['points']
+        return [float(p[0]) for p in points], [float(p[1]) for p in points]
+    return [float(x) for x in payload['lon']], [float(y) for y in payload['lat']]
+
+
+def spatial_response(params, event):
+    """
+    Point-in-polygon and bbox queries against the packed spatial indexes.
+
+    `?spatial=<layer>&lat=&lon=` returns the containing feature,
+    `?spatial=<layer>&bbox=minx,miny,maxx,maxy` the features whose bounding
+    box intersects (per-state layers also take `statefp=`), and a POST body
+    of points returns one feature (or null) per point, in order.
+    """
+    start = time.monotonic()
+    layer = params['spatial']
+    if layer not in SPATIAL_LAYERS:
+        return QueryError(f'unknown layer {layer!r}; available: {sorted(SPATIAL_LAYERS)}', status_code=400).to_response()
+
+    version = cache.dataset_version()
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    content_encoding = negotiate_encoding(request_headers.get('accept-encoding'))
+    status = 200
+
+    try:
+        if 'bbox' in params:
+            minx, miny, maxx, maxy = (float(v) for v in params['bbox'].split(','))
+            name = 'all'
+            if SPATIAL_LAYERS[layer]:
+                name = params.get('statefp', '')
+                if not re.fullmatch(r'\d{2}', name):
+                    return QueryError(f'bbox queries on {layer!r} need statefp=', status_code=400).to_response()
+            index = spatial_indexes.get(f'spatial/{layer}/{name}.sidx', version)
+            features = index.query_bbox(minx, miny, maxx, maxy)[:MAX_BBOX_FEATURES]
+            result = [index.attributes_of(f) for f in features]
+        else:
+            lons, lats = _spatial_points(params, event)
+            if len(lons) != len(lats) or len(lons) > MAX_SPATIAL_POINTS:
+                return QueryError(
+                    f'send matching lon/lat arrays of at most {MAX_SPATIAL_POINTS} points', status_code=400
+                ).to_response()
+            result = locate_points(layer, lons, lats, version)
+            if 'lat' in params and 'lon' in params:
+                result = result[0]
+                status = 200 if result else 404
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        return QueryError(f'invalid spatial request: {e!r}', status_code=400).to_response()
+    except ClientError:
+        return QueryError(f'no {layer} index for this request', status_code=404).to_response()
+
+    try:
+        body = encode_body(json.dumps(result, separators=(',', ':')).encode(), 'json', content_encoding)
+    except QueryError as e:
+        return e.to_response()
+
+    headers = response_headers('json', content_encoding)
+    headers.update({
+        'X-Spatial-Us': str(int((time.monotonic() - start) * 1e6)),
+        'X-Dataset-Version': version,
+    })
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'isBase64Encoded': is_base64('json', content_encoding),
+        'body': body,
+    }
+
+
+# layer -> zooms cut by `tiles.build_tiles`; mirrors `tiles.zooms` in settings.yaml
+TILE_ZOOMS = {'county': {0, 2, 4, 6, 8}, 'zcta': {4, 6, 8, 10}, 'tract': {8, 10, 12}}
+TILE_PATH = re.compile(r'tiles/(?P<layer>\w+)/(?P<z>\d{1,2})/(?P<x>\d+)/(?P<y>\d+)(?:\.mvt)?/?$')
+MVT_MEDIA_TYPE = 'application/vnd.mapbox-vector-tile'
+
+
+def tile_response(match, event):
+    """
+    Serve a precomputed vector tile from `s3://<bucket>/tiles/`.
+
+    Tiles are cut from simplified geometries by the pipeline, so map
+    traffic never reaches Athena or the full-resolution partitions. Tiles
+    with no features are 204s, tiles outside the layer's zooms are 404s;
+    If-None-Match is passed through to S3.
+    """
+    layer = match.group('layer')
+    z, x, y = int(match.group('z')), int(match.group('x')), int(match.group('y'))
+    if layer not in TILE_ZOOMS:
+        return QueryError(f'unknown tile layer {layer!r}; available: {sorted(TILE_ZOOMS)}', status_code=400).to_response()
+    # a missing tile inside the pyramid is empty (204); outside it there is no tile at all
+    if z not in TILE_ZOOMS[layer] or x >= 2 ** z or y >= 2 ** z:
+        return QueryError(
+            f'no {layer} tile {z}/{x}/{y}; zooms: {sorted(TILE_ZOOMS[layer])}', status_code=404
+        ).to_response()
+
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    content_encoding = negotiate_encoding(request_headers.get('accept-encoding'))
+    headers = {
+        'Content-Type': MVT_MEDIA_TYPE,
+        'Cache-Control': 'public, max-age=86400',
+        'Vary': 'Accept-Encoding',
+        'X-Dataset-Version': cache.dataset_version(),
+    }
+
+    kwargs = {'Bucket': ARTIFACT_BUCKET, 'Key': f'tiles/{layer}/{z}/{x}/{y}.mvt'}
+    if 'if-none-match' in request_headers:
+        kwargs['IfNoneMatch'] = request_headers['if-none-match']
+    try:
+        obj = s3_client.get_object(**kwargs)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+        if code in ('404', 'NoSuchKey'):
+            return {'statusCode': 204, 'headers': headers, 'body': ''}
+        raise
+
+    headers['ETag'] = obj['ETag']
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'isBase64Encoded': True,
+        'body': encode_body(obj['Body'].read(), 'mvt', content_encoding),
+    }
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket, key.rstrip('/')
+
+
+def delete_prefix(bucket, prefix):
+    """Delete the (at most 1000) objects under `prefix`; failures are only logged."""
+    try:
+        listing = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+        objects = [{'Key': obj['Key']} for obj in listing.get('Contents', [])]
+        if objects:
+            s3_client.delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+    except ClientError as e:
+        print(f'could not delete s3://{bucket}/{prefix}: {e!r}')
+
+
+def check_columns(columns, available):
+    """Raise a 400 QueryError if any requested column isn't in the result."""
+    missing = [c for c in columns or [] if c not in available]
+    if missing:
+        raise QueryError(f'unknown columns {missing}; available: {list(available)}', status_code=400)
+
+
+QUERY_MODES = {'csv', 'unload', 'pandas'}
 
 
 class QueryAthena:
 
     def __init__(self, output_loc='s3://serverlessprez/database/queries'):
         self.output_loc = output_loc
+        self.metrics = {}
 
-    def execute_query(self, sql, **kwargs):
+    def start(self, sql, deadline=None, execution_parameters=None):
+        """Run `sql` and wait for it; returns the query execution id.
 
-        full_result_set = []
+        `execution_parameters` fill the `?` placeholders of `sql` (or of an
+        `EXECUTE` of a prepared statement) as SQL literals.
+        """
 
-        query = ath.start_query_execution(
-            QueryString=sql,
-            ResultConfiguration={'OutputLocation': self.output_loc}
-        )
+        kwargs = {
+            'QueryString': sql,
+            'ResultConfiguration': {'OutputLocation': self.output_loc},
+            'WorkGroup': WORK_GROUP,
+        }
+        if execution_parameters:
+            kwargs['ExecutionParameters'] = execution_parameters
+        qid = start_query(ath, **kwargs)
+
+        self.metrics = wait_for_query(ath, qid, deadline=deadline)
 
-        qid = query['QueryExecutionId']
+        return qid
 
-        query_state = ath.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']['State']
+    def execute_query(self, sql, deadline=None, execution_parameters=None, **kwargs):
 
-        while query_state in ['RUNNING', 'QUEUED']:
-            query_state = ath.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']['State']
+        # pandas is only imported on this path; the default streaming
+        # path never needs it, which keeps cold starts short
+        import pandas as pd
 
+        qid = self.start(sql, deadline=deadline, execution_parameters=execution_parameters)
+
+        bucket, prefix = split_s3_uri(self.output_loc)
         results_df = pd.read_csv(
-            f"{self.output_loc}/{qid}.csv",
+            s3_client.get_object(Bucket=bucket, Key=f'{prefix}/{qid}.csv')['Body'],
             dtype={
                 'zip': str,
                 'county': str,
@@ -43,23 +341,153 @@ class QueryAthena:
 
         return results_df
 
+    def iter_csv_records(self, qid, columns=None):
+        """
+        Stream the result CSV of a finished query from S3 row by row.
+
+        Values are typed from the query's result metadata; only `columns`
+        (all by default) are kept.
+        """
+        metadata = ath.get_query_results(QueryExecutionId=qid, MaxResults=1)
+        column_info = metadata['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        converters = column_converters(column_info)
+
+        bucket, prefix = split_s3_uri(self.output_loc)
+        body = s3_client.get_object(Bucket=bucket, Key=f'{prefix}/{qid}.csv')['Body']
+        reader = csv.reader(codecs.getreader('utf-8')(body))
+        header = next(reader)
+        check_columns(columns, header)
+
+        keep = [i for i, name in enumerate(header) if columns is None or name in columns]
+        for row in reader:
+            record = {}
+            for i in keep:
+                value = row[i]
+                convert = converters[i]
+                # Athena writes NULL as an empty field
+                record[header[i]] = None if value == '' and convert is not str else convert(value)
+            yield record
+
+    def iter_unload_records(self, sql, columns=None, deadline=None, execution_parameters=None):
+        """
+        Run `sql` as an UNLOAD to Parquet and read back only `columns`.
+
+        The Parquet files are read batch by batch with pyarrow, so only the
+        requested column chunks are decoded. The files are deleted once read.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        bucket, prefix = split_s3_uri(self.output_loc)
+        unload_prefix = f'{prefix}/unload/{uuid.uuid4()}'
+        try:
+            self.start(
+                f"UNLOAD ({sql.strip().rstrip(';')}) TO 's3://{bucket}/{unload_prefix}/' "
+                f"WITH (format = 'PARQUET', compression = 'SNAPPY')",
+                deadline=deadline, execution_parameters=execution_parameters
+            )
+
+            listing = s3_client.list_objects_v2(Bucket=bucket, Prefix=f'{unload_prefix}/')
+            for obj in listing.get('Contents', []):
+                data = s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read()
+                parquet_file = pq.ParquetFile(pa.BufferReader(data))
+                check_columns(columns, parquet_file.schema_arrow.names)
+                for batch in parquet_file.iter_batches(columns=columns):
+                    yield from batch.to_pylist()
+        finally:
+            delete_prefix(bucket, f'{unload_prefix}/')
+
 
 def lambda_handler(event, context):
 
     query_string_params = event.get('queryStringParameters') or {}
     sql_from_url_param = query_string_params.get('sql')
 
+    if 'lookup' in query_string_params:
+        return lookup_response(query_string_params)
+
+    if 'spatial' in query_string_params:
+        return spatial_response(query_string_params, event)
+
+    # /serverlessprez/tiles/<layer>/<z>/<x>/<y>.mvt, or ?tile=<layer>/<z>/<x>/<y>
+    tile = (TILE_PATH.search(event.get('path') or '') or
+            TILE_PATH.match('tiles/' + query_string_params.get('tile', '')))
+    if tile:
+        return tile_response(tile, event)
+
+    # queries are named and parameterized (see named_queries.py); raw SQL
+    # from the URL is only accepted when ALLOW_RAW_SQL=1
+    query_name = query_string_params.get('query')
     if sql_from_url_param:
-        sql = sql_from_url_param
+        if not ALLOW_RAW_SQL:
+            return QueryError('raw sql is disabled; use ?query=<name>', status_code=400).to_response()
+        sql = named_sql = sql_from_url_param
+        execution_parameters = None
     else:
-        sql = """
-            SELECT * FROM "serverlessprez"."census_population"
-            where population_2020 >= 200000
-        """
+        try:
+            statement, execution_parameters = resolve(
+                query_name or DEFAULT_QUERY, query_string_params if query_name else DEFAULT_PARAMS
+            )
+        except InvalidQuery as e:
+            return QueryError(str(e), status_code=400).to_response()
+        sql = f'EXECUTE {statement}'
+        named_sql = NAMED_QUERIES[query_name or DEFAULT_QUERY]['sql']
+
+    # csv: stream the result CSV; unload: UNLOAD to Parquet and read columns
+    # with pyarrow; pandas: the original read_csv path
+    mode = query_string_params.get('mode', 'csv')
+    if mode not in QUERY_MODES:
+        return QueryError(f'unknown mode {mode!r}; available: {sorted(QUERY_MODES)}', status_code=400).to_response()
+    columns = query_string_params.get('columns')
+    columns = columns.split(',') if columns else None
+
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    fmt = negotiate_format(request_headers.get('accept'), query_string_params.get('format'))
+    content_encoding = negotiate_encoding(request_headers.get('accept-encoding'))
+
+    use_cache = query_string_params.get('cache', '1') != '0'
+    cache_sql = (f"{sql}\n-- params={execution_parameters} mode={mode} columns={columns} "
+                 f"format={fmt} encoding={content_encoding}")
+
+    start = time.monotonic()
+    body, tier = cache.get(cache_sql) if use_cache else (None, None)
+    headers = response_headers(fmt, content_encoding)
+
+    if body is None:
+        query = QueryAthena()
+        deadline = deadline_from_context(context)
+        try:
+            if mode == 'unload':
+                # UNLOAD can't wrap an EXECUTE, so it runs the statement text
+                records = query.iter_unload_records(
+                    named_sql, columns, deadline=deadline, execution_parameters=execution_parameters
+                )
+            elif mode == 'pandas':
+                df = query.execute_query(sql, deadline=deadline, execution_parameters=execution_parameters)
+                check_columns(columns, df.columns)
+                df = df[columns] if columns else df
+                records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+            else:
+                qid = query.start(sql, deadline=deadline, execution_parameters=execution_parameters)
+                records = query.iter_csv_records(qid, columns)
+
+            if mode == 'pandas' and fmt == 'json':
+                payload = df.to_json(orient='records').encode()
+            else:
+                payload = encode_records(records, fmt)
+            body = encode_body(payload, fmt, content_encoding)
+        except QueryError as e:
+            e.metrics = e.metrics or query.metrics
+            return e.to_response()
+        headers.update(metrics_headers(query.metrics))
+        if use_cache:
+            cache.put(cache_sql, body)
 
-    df = QueryAthena().execute_query(sql)
+    headers.update(cache_headers(tier, int((time.monotonic() - start) * 1000), cache.dataset_version()))
 
     return {
         'statusCode': 200,
-        'body': df.to_json(orient='records')
+        'headers': headers,
+        'isBase64Encoded': is_base64(fmt, content_encoding),
+        'body': body
     }
@@ -1,78 +1,151 @@
+import base64
+import io
 import json
+import os
 import boto3
+from botocore.exceptions import ClientError
+
+from athena_query import (
+    QueryError, start_query, wait_for_query, deadline_from_context, metrics_headers, iter_result_pages
+)
+from named_queries import DEFAULT_QUERY, DEFAULT_PARAMS, InvalidQuery, resolve
 
 
 ath = boto3.client('athena')
 
+WORK_GROUP = os.environ.get('WORK_GROUP', 'serverlessprez')
+ALLOW_RAW_SQL = os.environ.get('ALLOW_RAW_SQL') == '1'
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
 
-def results_to_df_structured_json(results):
+def encode_cursor(query_execution_id, next_token):
+    payload = json.dumps({'q': query_execution_id, 't': next_token}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
 
-    columns = [
-        col['Label']
-        for col in results['ResultSet']['ResultSetMetadata']['ColumnInfo']
-    ]
 
-    listed_results = []
-    for res in results['ResultSet']['Rows'][1:]:
-        values = []
-        for field in res['Data']:
-            try:
-                values.append(list(field.values())[0])
-            except:
-                values.append(list(' '))
+def decode_cursor(cursor):
+    """`(query_execution_id, next_token)` of a cursor; QueryError (400) if it's malformed."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload['q'], payload['t']
+    except (ValueError, KeyError, TypeError):
+        raise QueryError('invalid cursor', status_code=400)
 
-        listed_results.append(
-            dict(zip(columns, values))
-        )
 
-    return listed_results
+def write_records_json(pages, out):
+    """Stream typed result pages to `out` as a JSON array of objects."""
+    written = 0
+    out.write('[')
+    for columns, _, rows, _ in pages:
+        for row in rows:
+            out.write(', ' if written else '')
+            out.write(json.dumps(dict(zip(columns, row))))
+            written += 1
+    out.write(']')
+    return written
 
 
 class QueryAthena:
 
     def __init__(self, output_loc='s3://serverlessprez/database/queries'):
         self.output_loc = output_loc
+        self.metrics = {}
+        self.next_cursor = None
 
-    def execute_query(self, sql, **kwargs):
-
-        full_result_set = []
-
-        query = ath.start_query_execution(
-            QueryString=sql,
-            ResultConfiguration={'OutputLocation': self.output_loc}
-        )
-
-        qid = query['QueryExecutionId']
+    def execute_query(self, sql, deadline=None, execution_parameters=None, **kwargs):
 
-        query_state = ath.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']['State']
+        kwargs = {
+            'QueryString': sql,
+            'ResultConfiguration': {'OutputLocation': self.output_loc},
+            'WorkGroup': WORK_GROUP,
+        }
+        if execution_parameters:
+            kwargs['ExecutionParameters'] = execution_parameters
+        qid = start_query(ath, **kwargs)
 
-        while query_state in ['RUNNING', 'QUEUED']:
-            query_state = ath.get_query_execution(QueryExecutionId=qid)['QueryExecution']['Status']['State']
+        self.metrics = wait_for_query(ath, qid, deadline=deadline)
 
-        results = ath.get_query_results(QueryExecutionId=qid)
+        return qid
 
-        results_json_struct = results_to_df_structured_json(results)
+    def read_results(self, qid, out, next_token=None, limit=DEFAULT_LIMIT):
+        """
+        Write up to `limit` rows of a finished query to `out` as JSON.
 
-        return results_json_struct
+        Pages are fetched lazily and written as they arrive, so memory is
+        bounded by `limit`. If rows remain, `self.next_cursor` holds an
+        opaque cursor the client passes back to continue. Athena rejecting
+        the results raises QueryError: 400 when continuing from a cursor.
+        """
+        self.next_cursor = None
+        last_token = [None]
+
+        def pages():
+            for page in iter_result_pages(ath, qid, next_token=next_token, max_rows=limit):
+                last_token[0] = page[3]
+                yield page
+
+        try:
+            written = write_records_json(pages(), out)
+        except ClientError as e:
+            # a cursor for a query Athena no longer has (or never had) is the client's fault
+            raise QueryError(
+                e.response.get('Error', {}).get('Message') or str(e),
+                status_code=400 if next_token else 502, query_execution_id=qid
+            )
+        if last_token[0]:
+            self.next_cursor = encode_cursor(qid, last_token[0])
+        return written
 
 
 def lambda_handler(event, context):
 
     query_string_params = event.get('queryStringParameters') or {}
     sql_from_url_param = query_string_params.get('sql')
-
-    if sql_from_url_param:
-        sql = sql_from_url_param
-    else:
-        sql = """
-            SELECT * FROM "serverlessprez"."census_population"
-            where population_2020 >= 200000
-            LIMIT 10;
-        """
-
-    results_json = QueryAthena().execute_query(sql)
+    cursor = query_string_params.get('cursor')
+    try:
+        limit = min(int(query_string_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return QueryError(f'limit must be an integer from 1 to {MAX_LIMIT}', status_code=400).to_response()
+
+    # the same named, parameterized queries as the API (see named_queries.py);
+    # raw SQL from the URL is only accepted when ALLOW_RAW_SQL=1
+    query_name = query_string_params.get('query')
+    query = QueryAthena()
+    try:
+        if cursor:
+            qid, next_token = decode_cursor(cursor)
+        else:
+            if sql_from_url_param:
+                if not ALLOW_RAW_SQL:
+                    raise QueryError('raw sql is disabled; use ?query=<name>', status_code=400)
+                sql, execution_parameters = sql_from_url_param, None
+            else:
+                try:
+                    statement, execution_parameters = resolve(
+                        query_name or DEFAULT_QUERY, query_string_params if query_name else DEFAULT_PARAMS
+                    )
+                except InvalidQuery as e:
+                    raise QueryError(str(e), status_code=400)
+                sql = f'EXECUTE {statement}'
+            qid = query.execute_query(
+                sql, deadline=deadline_from_context(context), execution_parameters=execution_parameters
+            )
+            next_token = None
+        out = io.StringIO()
+        query.read_results(qid, out, next_token=next_token, limit=limit)
+    except QueryError as e:
+        return e.to_response()
+
+    headers = metrics_headers(query.metrics)
+    if query.next_cursor:
+        headers['X-Next-Cursor'] = query.next_cursor
 
     return {
         'statusCode': 200,
-        'body': json.dumps(results_json)
+        'headers': headers,
+        'body': out.getvalue()
     }
@@ -0,0 +1,123 @@
+"""
+Sorted, memory-mapped key/value lookup files.
+
+Layout (little-endian):
+
+    8 bytes   magic b'SPLKUP01'
+    4 bytes   header length H
+    H bytes   JSON header: {"name", "key_width", "count"}
+    count * key_width bytes   keys, ASCII, right-padded with spaces, sorted
+    (count + 1) * 8 bytes     uint64 offsets into the value region
+    ...                       values: one JSON array of records per key
+
+Point and range lookups binary-search the fixed-width keys directly in the
+mmap, so a loaded file costs no parsing and a lookup touches only a few
+pages. Shared by the pipeline (writer) and the Lambda (reader), so only
+the standard library is used.
+"""
+import json
+import mmap
+import struct
+
+
+MAGIC = b'SPLKUP01'
+
+
+def write_lookup(path, items, key_width, name=''):
+    """Write `items`, an iterable of `(key, json_bytes)` sorted by key."""
+    keys, values = [], []
+    for key, value in items:
+        key = str(key).encode('ascii')
+        if len(key) > key_width:
+            raise ValueError(f'key {key!r} longer than {key_width}')
+        keys.append(key.ljust(key_width))
+        values.append(value)
+    if keys != sorted(keys):
+        raise ValueError('lookup keys must be sorted')
+
+    header = json.dumps({'name': name, 'key_width': key_width, 'count': len(keys)}).encode()
+    offsets = [0]
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        file.write(b''.join(keys))
+        file.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for value in values:
+            file.write(value)
+
+
+class LookupTable:
+    """Read-only view of a lookup file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f'{path} is not a lookup file')
+        (header_len,) = struct.unpack_from('<I', self._mm, 8)
+        header = json.loads(self._mm[12:12 + header_len])
+        self.name = header['name']
+        self.key_width = header['key_width']
+        self.count = header['count']
+        self._keys = 12 + header_len
+        self._offsets = self._keys + self.count * self.key_width
+        self._values = self._offsets + (self.count + 1) * 8
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i):
+        start = self._keys + i * self.key_width
+        return self._mm[start:start + self.key_width]
+
+    def _pad(self, key):
+        """`key` as stored, or None when no stored key can equal it (too long or not ASCII)."""
+        try:
+            key = str(key).encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        if len(key) > self.key_width:
+            return None
+        return key.ljust(self.key_width)
+
+    def _bisect(self, key, right=False):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key(mid)
+            if k < key or (right and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _value(self, i):
+        start, stop = struct.unpack_from('<2Q', self._mm, self._offsets + 8 * i)
+        return json.loads(self._mm[self._values + start:self._values + stop])
+
+    def get(self, key, default=None):
+        """Records stored for `key`, or `default`."""
+        padded = self._pad(key)
+        if padded is None:
+            return default
+        i = self._bisect(padded)
+        if i < self.count and self._key(i) == padded:
+            return self._value(i)
+        return default
+
+    def range(self, lo, hi, limit=None):
+        """`(key, records)` for every key with lo <= key <= hi, in key order."""
+        lo, hi = str(lo), str(hi)
+        if not (lo.isascii() and hi.isascii()):
+            return
+        # a bound longer than the keys sorts after the key equal to its prefix
+        start = self._bisect(lo.encode()[:self.key_width].ljust(self.key_width), right=len(lo) > self.key_width)
+        stop = self._bisect(hi.encode()[:self.key_width].ljust(self.key_width), right=True)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        for i in range(start, stop):
+            yield self._key(i).decode('ascii').rstrip(), self._value(i)
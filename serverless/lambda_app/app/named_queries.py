@@ -0,0 +1,86 @@
+"""
+Catalog of named, parameterized queries served by the API.
+
+Each entry is deployed as an Athena prepared statement by
+`Pipeline.create_prepared_statements` and executed with
+`EXECUTE <statement> USING ...`. Parameters are validated against strict
+patterns before they reach Athena, and every query on a partitioned table
+takes all of that table's partition columns as parameters so Athena always
+prunes partitions. This module is shared by the pipeline and the Lambda,
+so it must not import anything outside the standard library.
+"""
+import re
+
+
+STATE_FIPS = r'\d{2}'
+COUNTY_FIPS = r'\d{3}'
+ZIP_CODE = r'\d{5}'
+INTEGER = r'\d{1,12}'
+
+NAMED_QUERIES = {
+    'large_counties': {
+        'layer': ('census', 'population'),
+        'sql': 'SELECT * FROM serverlessprez.census_population WHERE population_2020 >= ?',
+        'params': [('min_population', INTEGER)],
+    },
+    'population_by_state': {
+        'layer': ('census', 'population'),
+        'sql': 'SELECT * FROM serverlessprez.census_population WHERE st = ?',
+        'params': [('statefp', STATE_FIPS)],
+    },
+    'tracts_in_county': {
+        'layer': ('tiger', 'tract'),
+        'sql': 'SELECT * FROM serverlessprez.tiger_tract WHERE statefp = ? AND countyfp = ?',
+        'params': [('statefp', STATE_FIPS), ('countyfp', COUNTY_FIPS)],
+    },
+    'zip_to_county': {
+        'layer': ('tiger', 'mapping'),
+        'sql': 'SELECT * FROM serverlessprez.tiger_mapping WHERE statefp = ? AND zip = ?',
+        'params': [('statefp', STATE_FIPS), ('zip', ZIP_CODE)],
+    },
+    'business_patterns_by_county': {
+        'layer': ('census', 'businesspatterns'),
+        'sql': 'SELECT * FROM serverlessprez.census_businesspatterns WHERE fipstate = ? AND fipscty = ?',
+        'params': [('statefp', STATE_FIPS), ('countyfp', COUNTY_FIPS)],
+    },
+}
+
+DEFAULT_QUERY = 'large_counties'
+DEFAULT_PARAMS = {'min_population': '200000'}
+
+
+class InvalidQuery(ValueError):
+    """Unknown query name or a missing/malformed parameter."""
+
+
+def statement_name(name):
+    return f'serverlessprez_{name}'
+
+
+def resolve(name, params):
+    """
+    Validate `params` for the named query.
+
+    Returns `(statement_name, execution_parameters)`; execution parameters
+    are SQL literals in statement order, e.g. `["'01'", "'001'"]`.
+    """
+    if name not in NAMED_QUERIES:
+        raise InvalidQuery(f'unknown query {name!r}; available: {sorted(NAMED_QUERIES)}')
+
+    values = []
+    for param, pattern in NAMED_QUERIES[name]['params']:
+        value = params.get(param)
+        if value is None:
+            raise InvalidQuery(f'query {name!r} requires parameter {param!r}')
+        if not re.fullmatch(pattern, value):
+            raise InvalidQuery(f'parameter {param!r} must match {pattern}')
+        values.append(value if pattern == INTEGER else f"'{value}'")
+    return statement_name(name), values
+
+
+def check_partition_pruning(name, partition_by):
+    """Raise InvalidQuery unless every partition column of the table is a parameter."""
+    sql = NAMED_QUERIES[name]['sql'].lower()
+    missing = [p for p in partition_by or [] if not re.search(rf'\b{p.lower()}\s*=\s*\?', sql)]
+    if missing:
+        raise InvalidQuery(f'query {name!r} does not filter on partition columns {missing}')
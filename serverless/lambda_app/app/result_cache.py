@@ -0,0 +1,125 @@
+"""Two-tier cache of query responses keyed on normalized SQL and dataset version."""
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+VERSION_KEY = 'database/version.json'
+
+
+def normalize_sql(sql):
+    """
+    Canonical form of a query for cache keys.
+
+    Outside of quoted literals and identifiers whitespace is collapsed and
+    text lowercased; a trailing semicolon is dropped.
+    """
+    parts = QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i]).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+class ResultCache:
+    """
+    In-process LRU in front of a shared S3 tier.
+
+    The LRU lives at module level in the handler, so it survives warm
+    invocations of the same container; the S3 tier is shared by all
+    containers. Keys hash the normalized SQL together with the dataset
+    version that `Pipeline.to_s3` writes to `database/version.json`, so a
+    pipeline run invalidates every cached result. Entries also expire
+    after `ttl` seconds. S3 errors (a missing key is AccessDenied without
+    `s3:ListBucket`, throttling, ...) are logged and treated as misses, so
+    the cache never fails a request.
+    """
+
+    def __init__(self, s3_client, bucket, prefix='cache', max_entries=128, ttl=86400, version_ttl=60):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_checked = 0
+
+    def dataset_version(self):
+        """Current dataset version, re-read from S3 at most every `version_ttl` seconds."""
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            try:
+                body = self.s3.get_object(Bucket=self.bucket, Key=VERSION_KEY)['Body'].read()
+                self._version = json.loads(body)['version']
+            except ClientError as e:
+                print(f'CACHE: reading {VERSION_KEY} failed: {e!r}')
+                self._version = self._version or '0'
+            self._version_checked = now
+        return self._version
+
+    def key(self, sql):
+        version = self.dataset_version()
+        digest = hashlib.sha256(normalize_sql(sql).encode()).hexdigest()
+        return f'{version}/{digest}'
+
+    def _s3_key(self, key):
+        return f'{self.prefix}/{key}.json'
+
+    def get(self, sql):
+        """Return `(body, tier)`; tier is `memory`, `s3` or None on a miss."""
+        key = self.key(sql)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, body = entry
+            if expires > time.time():
+                self._entries.move_to_end(key)
+                return body, 'memory'
+            del self._entries[key]
+
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._s3_key(key))
+            expires = obj['LastModified'].timestamp() + self.ttl
+            if expires <= time.time():
+                return None, None
+            body = obj['Body'].read().decode()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', 'AccessDenied'):
+                print(f'CACHE: get {key} failed: {e!r}')
+            return None, None
+        self._remember(key, body, expires)
+        return body, 's3'
+
+    def put(self, sql, body):
+        """Cache `body` in both tiers; a failed S3 write only loses the shared copy."""
+        key = self.key(sql)
+        self._remember(key, body, time.time() + self.ttl)
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=self._s3_key(key), Body=body.encode(),
+                ContentType='application/json'
+            )
+        except ClientError as e:
+            print(f'CACHE: put {key} failed: {e!r}')
+
+    def _remember(self, key, body, expires):
+        self._entries[key] = (expires, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def cache_headers(tier, latency_ms, version):
+    return {
+        'X-Cache': 'HIT' if tier else 'MISS',
+        'X-Cache-Tier': tier or 'none',
+        'X-Cache-Latency-Ms': str(latency_ms),
+        'X-Dataset-Version': version,
+    }
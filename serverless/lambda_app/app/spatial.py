@@ -0,0 +1,147 @@
+"""
+Memory-mapped reader for the packed STR R-tree files written by
+`serverless/pipeline/spatial_index.py`, whose docstring describes the
+layout. Queries run level by level on whole arrays of (point, node)
+candidate pairs, then an even-odd ray-crossing test on the candidate
+polygons, so batches of points are resolved with NumPy rather than
+per-point Python. Only NumPy and the standard library are used, so the
+Lambda needs no GEOS.
+"""
+import json
+import mmap
+import struct
+
+import numpy as np
+
+
+# must match serverless/pipeline/spatial_index.py
+MAGIC = b'SPIDX001'
+
+# cap on point x edge pairs tested at once in the ray-crossing step
+MAX_PAIRS = 4_000_000
+# points walked down the tree together
+POINT_CHUNK = 16384
+
+
+class SpatialIndex:
+    """Read-only, memory-mapped view of an index file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f'{path} is not a spatial index')
+        (header_len,) = struct.unpack_from('<I', self._mm, 8)
+        header = json.loads(self._mm[12:12 + header_len])
+        data_start = -(-(12 + header_len) // 8) * 8
+
+        self.node_size = header['node_size']
+        self.features = header['features']
+        self.meta = header['meta']
+        arrays = {}
+        for name, (offset, dtype, shape) in header['arrays'].items():
+            count = int(np.prod(shape)) if shape else 0
+            arrays[name] = np.frombuffer(
+                self._mm, dtype=dtype, count=count, offset=data_start + offset
+            ).reshape(shape)
+        self.levels = [arrays[f'level_{i}'] for i in range(header['levels'])]
+        self.coords = arrays['coords']
+        self.ring_offsets = arrays['ring_offsets']
+        self.feature_rings = arrays['feature_rings']
+        self.attribute_offsets = arrays['attribute_offsets']
+        self.attributes = arrays['attributes']
+        self._ring_last = None
+
+    def __len__(self):
+        return self.features
+
+    def attributes_of(self, feature):
+        start, stop = self.attribute_offsets[feature], self.attribute_offsets[feature + 1]
+        return json.loads(self.attributes[start:stop].tobytes())
+
+    def _descend(self, pts, nodes, keep):
+        """Walk candidate (query, node) pairs from the root to the leaves.
+
+        `keep(node_boxes, pts)` returns the mask of pairs whose node box
+        can still contain a match.
+        """
+        for depth in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[depth]
+            mask = keep(boxes.take(nodes, axis=0), pts)
+            pts, nodes = pts[mask], nodes[mask]
+            if depth == 0:
+                break
+            children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+            pts = np.repeat(pts, self.node_size)
+            valid = children < len(self.levels[depth - 1])
+            pts, nodes = pts[valid], children[valid]
+        return pts, nodes
+
+    def _contains(self, pts, features, xs, ys):
+        """
+        Even-odd point-in-polygon test of candidate (point, feature) pairs.
+
+        Every pair is expanded to the edges of its feature and the crossings
+        are counted with one bincount, in chunks of about `MAX_PAIRS` edges.
+        """
+        if self._ring_last is None:
+            self._ring_last = np.zeros(len(self.coords), dtype=bool)
+            self._ring_last[self.ring_offsets[1:] - 1] = True
+
+        first = self.ring_offsets[self.feature_rings[features]]
+        counts = self.ring_offsets[self.feature_rings[features + 1]] - first - 1
+        ends = np.cumsum(counts)
+        inside = np.zeros(len(pts), dtype=bool)
+
+        a = 0
+        while a < len(pts):
+            done = ends[a - 1] if a else 0
+            b = max(a + 1, int(np.searchsorted(ends, done + MAX_PAIRS, side='right')))
+            pair = np.repeat(np.arange(b - a), counts[a:b])
+            k = np.arange(len(pair)) - np.repeat(ends[a:b] - counts[a:b] - done, counts[a:b])
+            k += np.repeat(first[a:b], counts[a:b])
+            x1, y1 = self.coords[k, 0], self.coords[k, 1]
+            x2, y2 = self.coords[k + 1, 0], self.coords[k + 1, 1]
+            px, py = xs[pts[a:b]][pair], ys[pts[a:b]][pair]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crosses = ((y1 > py) != (y2 > py)) & (px < (x2 - x1) * (py - y1) / (y2 - y1) + x1)
+            crosses &= ~self._ring_last[k]
+            inside[a:b] = np.bincount(pair, weights=crosses, minlength=b - a) % 2 == 1
+            a = b
+        return inside
+
+    def query_points(self, xs, ys):
+        """
+        Index of the feature containing each point, or -1.
+
+        `xs`/`ys` are longitude/latitude arrays of any length.
+        """
+        xs = np.asarray(xs, dtype='f8')
+        ys = np.asarray(ys, dtype='f8')
+        result = np.full(len(xs), -1, dtype='i8')
+        if not self.features or not len(xs):
+            return result
+
+        def keep(boxes, pts):
+            x, y = xs.take(pts), ys.take(pts)
+            return (boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])
+
+        # chunks keep the candidate arrays of each level in cache
+        for start in range(0, len(xs), POINT_CHUNK):
+            pts = np.arange(start, min(start + POINT_CHUNK, len(xs)))
+            pts, features = self._descend(pts, np.zeros(len(pts), dtype='i8'), keep)
+            inside = self._contains(pts, features, xs, ys)
+            result[pts[inside]] = features[inside]
+        return result
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """Indexes of features whose bounding box intersects the box."""
+        if not self.features:
+            return np.arange(0)
+
+        def keep(boxes, pts):
+            return ((boxes[:, 0] <= maxx) & (minx <= boxes[:, 2]) &
+                    (boxes[:, 1] <= maxy) & (miny <= boxes[:, 3]))
+
+        _, features = self._descend(np.zeros(1, dtype='i8'), np.zeros(1, dtype='i8'), keep)
+        return np.sort(features)
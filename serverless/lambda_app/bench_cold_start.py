@@ -0,0 +1,146 @@
+"""
+Cold-start benchmark for the Lambda handler.
+
+Two measurements, both local:
+
+* `imports` runs `python -X importtime` on the handler module in fresh
+  interpreters and reports the module's cumulative import time plus the
+  slowest imports.
+* `rie` builds the container image and, for every run, starts a fresh
+  container with the Lambda runtime interface emulator, invokes it once and
+  reads the `Init Duration` from the REPORT line in the container log.
+
+Results are printed as JSON. `--max-import-ms` / `--max-init-ms` make the
+script exit non-zero when the median exceeds a budget, so it can gate a
+deploy:
+
+    python serverless/lambda_app/bench_cold_start.py imports --max-import-ms 300
+    python serverless/lambda_app/bench_cold_start.py rie --runs 5 --max-init-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+
+LAMBDA_APP = Path(__file__).parent
+APP_DIR = LAMBDA_APP/'app'
+IMAGE = 'serverlessprez-lambda-bench'
+RIE_URL = 'http://localhost:{port}/2015-03-31/functions/function/invocations'
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+INIT_DURATION = re.compile(r'Init Duration: ([\d.]+) ms')
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env['PYTHONPATH'] = str(APP_DIR)
+    return env
+
+
+def measure_imports(module='lambda', runs=5, top=10):
+    """Cumulative import time of `module` over `runs` fresh interpreters."""
+    totals, slowest = [], {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'__import__({module!r})'],
+            env=_env(), capture_output=True, text=True, check=True
+        )
+        for line in proc.stderr.splitlines():
+            match = IMPORTTIME.match(line)
+            if not match:
+                continue
+            cumulative, name = int(match.group(2)), match.group(4)
+            if name == module:
+                totals.append(cumulative / 1000)
+            if len(match.group(3)) <= 1:
+                slowest[name] = max(slowest.get(name, 0), cumulative / 1000)
+
+    return {
+        'module': module,
+        'runs': runs,
+        'median_ms': statistics.median(totals),
+        'min_ms': min(totals),
+        'max_ms': max(totals),
+        'slowest_top_level_ms': dict(sorted(slowest.items(), key=lambda kv: -kv[1])[:top]),
+    }
+
+
+def measure_rie(runs=5, port=9000, event=None, build=True):
+    """Init Duration and first-invoke latency of fresh containers under the RIE."""
+    if build:
+        subprocess.run(['docker', 'build', '-t', IMAGE, str(LAMBDA_APP)], check=True)
+
+    payload = json.dumps(event or {'queryStringParameters': {}}).encode()
+    inits, invokes = [], []
+    for _ in range(runs):
+        container = subprocess.run(
+            ['docker', 'run', '-d', '-p', f'{port}:8080',
+             '-e', 'AWS_DEFAULT_REGION', '-e', 'AWS_ACCESS_KEY_ID',
+             '-e', 'AWS_SECRET_ACCESS_KEY', '-e', 'AWS_SESSION_TOKEN', IMAGE],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        try:
+            start = time.perf_counter()
+            for _ in range(50):
+                try:
+                    request = urllib.request.Request(RIE_URL.format(port=port), data=payload)
+                    urllib.request.urlopen(request, timeout=120).read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            invokes.append((time.perf_counter() - start) * 1000)
+
+            logs = subprocess.run(['docker', 'logs', container], capture_output=True, text=True).stdout
+            match = INIT_DURATION.search(logs)
+            if match:
+                inits.append(float(match.group(1)))
+        finally:
+            subprocess.run(['docker', 'rm', '-f', container], capture_output=True)
+
+    return {
+        'runs': runs,
+        'init_median_ms': statistics.median(inits) if inits else None,
+        'first_invoke_median_ms': statistics.median(invokes),
+        'init_ms': inits,
+        'first_invoke_ms': invokes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imports = sub.add_parser('imports', help='import time of the handler module')
+    imports.add_argument('--module', default='lambda')
+    imports.add_argument('--runs', type=int, default=5)
+    imports.add_argument('--max-import-ms', type=float)
+
+    rie = sub.add_parser('rie', help='init duration under the runtime interface emulator')
+    rie.add_argument('--runs', type=int, default=5)
+    rie.add_argument('--port', type=int, default=9000)
+    rie.add_argument('--no-build', action='store_true')
+    rie.add_argument('--max-init-ms', type=float)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'imports':
+        result = measure_imports(args.module, args.runs)
+        over = args.max_import_ms is not None and result['median_ms'] > args.max_import_ms
+    else:
+        result = measure_rie(args.runs, args.port, build=not args.no_build)
+        over = (args.max_init_ms is not None and result['init_median_ms'] is not None
+                and result['init_median_ms'] > args.max_init_ms)
+
+    print(json.dumps(result, indent=2))
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
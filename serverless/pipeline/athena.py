@@ -0,0 +1,152 @@
+"""Dependency-ordered, concurrent execution of Athena statements."""
+import time
+from typing import Dict, Iterable, List
+
+from serverless import settings
+
+
+TERMINAL_STATES = {'SUCCEEDED', 'FAILED', 'CANCELLED'}
+UNSUCCESSFUL_STATES = {'FAILED', 'CANCELLED', 'SKIPPED', 'TIMEOUT'}
+BATCH_GET_LIMIT = 50
+
+
+def statement(name: str, sql: str, depends_on: Iterable[str]=()) -> Dict:
+    """A named statement that may only start once `depends_on` have succeeded."""
+    return {'name': name, 'sql': sql, 'depends_on': list(depends_on)}
+
+
+class AthenaScheduler(object):
+    """
+    Run Athena statements in dependency order.
+
+    Statements whose dependencies have all succeeded are submitted right
+    away, up to `max_concurrency` at a time (Athena's active DDL quota).
+    Running queries are polled together with `batch_get_query_execution`,
+    backing off exponentially from `poll_interval` to `max_poll_interval`
+    while nothing finishes. A statement whose dependency failed is skipped;
+    anything still running after `timeout` seconds is cancelled.
+    """
+
+    def __init__(self, client, output_location: str, max_concurrency: int=None,
+                 poll_interval: float=None, max_poll_interval: float=None,
+                 timeout: float=None, work_group: str=None):
+        self.client = client
+        self.output_location = output_location
+        self.max_concurrency = max_concurrency or settings.athena.max_concurrency
+        self.poll_interval = poll_interval or settings.athena.poll_interval
+        self.max_poll_interval = max_poll_interval or settings.athena.max_poll_interval
+        self.timeout = timeout or settings.athena.timeout
+        self.work_group = work_group
+
+    def _start(self, stmt: Dict) -> str:
+        kwargs = {
+            'QueryString': stmt['sql'],
+            'ResultConfiguration': {'OutputLocation': self.output_location},
+        }
+        if self.work_group:
+            kwargs['WorkGroup'] = self.work_group
+        return self.client.start_query_execution(**kwargs)['QueryExecutionId']
+
+    def _poll(self, query_ids: List[str]) -> List[Dict]:
+        executions = []
+        for i in range(0, len(query_ids), BATCH_GET_LIMIT):
+            response = self.client.batch_get_query_execution(
+                QueryExecutionIds=query_ids[i:i + BATCH_GET_LIMIT]
+            )
+            executions.extend(response['QueryExecutions'])
+        return executions
+
+    def run(self, statements: List[Dict]) -> Dict[str, Dict]:
+        """Execute `statements` and return a result per statement name.
+
+        Each result holds the state, failure reason, query execution id,
+        seconds from submission to completion and Athena's engine time.
+        """
+        names = {s['name'] for s in statements}
+        for stmt in statements:
+            missing = set(stmt['depends_on']) - names
+            if missing:
+                raise ValueError(f"{stmt['name']} depends on unknown statements {sorted(missing)}")
+
+        results = {
+            s['name']: {**s, 'state': 'PENDING', 'reason': None, 'query_execution_id': None,
+                        'submitted': None, 'seconds': None, 'engine_ms': None}
+            for s in statements
+        }
+        pending = list(statements)
+        running = {}
+        delay = self.poll_interval
+        deadline = time.monotonic() + self.timeout
+
+        while pending or running:
+            progressed = False
+            for stmt in list(pending):
+                states = [results[d]['state'] for d in stmt['depends_on']]
+                result = results[stmt['name']]
+                if any(s in UNSUCCESSFUL_STATES for s in states):
+                    result['state'] = 'SKIPPED'
+                    result['reason'] = 'a dependency did not succeed'
+                    pending.remove(stmt)
+                    progressed = True
+                elif all(s == 'SUCCEEDED' for s in states) and len(running) < self.max_concurrency:
+                    pending.remove(stmt)
+                    progressed = True
+                    result['submitted'] = time.monotonic()
+                    try:
+                        qid = self._start(stmt)
+                    except Exception as e:
+                        result['state'] = 'FAILED'
+                        result['reason'] = repr(e)
+                        continue
+                    result['state'] = 'QUEUED'
+                    result['query_execution_id'] = qid
+                    running[qid] = stmt['name']
+                    delay = self.poll_interval
+
+            if not running:
+                if not progressed:
+                    # nothing can start and nothing is running: a dependency cycle
+                    for stmt in pending:
+                        results[stmt['name']]['state'] = 'SKIPPED'
+                        results[stmt['name']]['reason'] = 'dependency cycle'
+                    pending = []
+                continue
+
+            if time.monotonic() > deadline:
+                for qid, name in running.items():
+                    self.client.stop_query_execution(QueryExecutionId=qid)
+                    results[name]['state'] = 'TIMEOUT'
+                    results[name]['reason'] = f'not finished after {self.timeout}s'
+                running = {}
+                for stmt in pending:
+                    results[stmt['name']]['state'] = 'SKIPPED'
+                    results[stmt['name']]['reason'] = 'scheduler timed out'
+                pending = []
+                continue
+
+            time.sleep(delay)
+
+            finished = False
+            for execution in self._poll(list(running)):
+                status = execution['Status']
+                result = results[running[execution['QueryExecutionId']]]
+                result['state'] = status['State']
+                if status['State'] in TERMINAL_STATES:
+                    finished = True
+                    result['reason'] = status.get('StateChangeReason')
+                    result['seconds'] = time.monotonic() - result['submitted']
+                    result['engine_ms'] = execution.get('Statistics', {}).get('TotalExecutionTimeInMillis')
+                    del running[execution['QueryExecutionId']]
+
+            delay = self.poll_interval if finished else min(delay * 2, self.max_poll_interval)
+
+        return results
+
+
+def print_results(results: Dict[str, Dict]):
+    for name, r in results.items():
+        seconds = f"{r['seconds']:.1f}s" if r['seconds'] is not None else '-'
+        line = f"  {r['state']:<10} {seconds:>8}  {name}"
+        if r['reason'] and r['state'] != 'SUCCEEDED':
+            line += f"  ({r['reason']})"
+        print(line)
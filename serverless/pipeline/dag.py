@@ -0,0 +1,196 @@
+"""
+Dependency-ordered, cached and concurrent execution of pipeline steps.
+
+A step declares the steps it depends on, the local paths it reads
+(`inputs`), the paths it must leave behind (`outputs`) and any parameters
+that change what it does (`params`). Its fingerprint hashes the params, the
+size and mtime of every input file and the fingerprints of its
+dependencies; it is taken again after a successful run, so inputs the step
+fetched itself (raw downloads) count. A step whose fingerprint matches the
+last successful run and whose outputs still exist is not run again.
+Fingerprints, results and wall times are kept in `pipeline_state.json` next
+to the other pipeline state.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+from serverless import settings, tracing
+
+
+DONE = {'ok', 'cached', 'skipped'}
+
+
+def step(name: str, func: Callable, depends_on: Iterable[str]=(), inputs: Iterable=(),
+         outputs: Iterable=(), params: Dict=None, kwargs: Dict=None, cache: bool=True,
+         keep_result: bool=False) -> Dict:
+    """
+    A pipeline step calling `func(**kwargs)`.
+
+    `cache=False` steps always run. With `keep_result` the (JSON-safe)
+    return value is saved, so it's available when a later run skips the step.
+    """
+    return {
+        'name': name, 'func': func, 'depends_on': list(depends_on),
+        'inputs': [Path(p) for p in inputs], 'outputs': [Path(p) for p in outputs],
+        'params': params or {}, 'kwargs': kwargs or {}, 'cache': cache,
+        'keep_result': keep_result,
+    }
+
+
+def pipeline_state_path() -> Path:
+    return settings.root_path/settings.data.manifest_path/'pipeline_state.json'
+
+
+def _input_files(paths: List[Path]):
+    for path in paths:
+        if path.is_file():
+            yield path
+        elif path.is_dir():
+            yield from sorted(p for p in path.rglob('*') if p.is_file())
+
+
+def fingerprint(stp: Dict, upstream: Dict[str, str]) -> str:
+    """md5 of a step's params, input file stats and upstream fingerprints."""
+    md5 = hashlib.md5(json.dumps(
+        {'name': stp['name'], 'params': stp['params'], 'kwargs': stp['kwargs'],
+         'upstream': {d: upstream.get(d) for d in stp['depends_on']}},
+        sort_keys=True, default=str
+    ).encode())
+    for file in _input_files(stp['inputs']):
+        stat = file.stat()
+        md5.update(f'{file}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return md5.hexdigest()
+
+
+class StepRunner(object):
+    """
+    Run steps in dependency order on a thread pool of `max_workers`.
+
+    Steps start as soon as their dependencies are done, so independent
+    branches (e.g. the census and TIGER ETLs) overlap. A failed step blocks
+    its dependents but not the rest of the graph. Steps named in `skip` are
+    treated as done without running; steps in `force` run even if cached.
+    """
+
+    def __init__(self, max_workers: int=None, state_path=None):
+        self.max_workers = max_workers or settings.pipeline.max_workers
+        self.state_path = Path(state_path or pipeline_state_path())
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def load_state(self) -> Dict:
+        if self.state_path.is_file():
+            with open(self.state_path) as file:
+                return json.load(file)
+        return {}
+
+    def save_state(self):
+        with self._lock:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_path, 'w') as file:
+                json.dump(self.state, file, indent=1, sort_keys=True, default=str)
+
+    def _run_one(self, stp: Dict, fp: str) -> Dict:
+        start = time.perf_counter()
+        result = {'status': 'ok', 'error': None, 'result': None, 'fingerprint': fp}
+        print(f"STEP: {stp['name']} started")
+        try:
+            with tracing.span(f"step:{stp['name']}"):
+                value = stp['func'](**stp['kwargs'])
+            result['result'] = value
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = repr(e)
+        result['seconds'] = time.perf_counter() - start
+        print(f"STEP: {stp['name']} {result['status']} in {result['seconds']:.1f}s")
+        return result
+
+    def _check(self, steps: List[Dict]):
+        names = {s['name'] for s in steps}
+        for stp in steps:
+            missing = set(stp['depends_on']) - names
+            if missing:
+                raise ValueError(f"{stp['name']} depends on unknown steps {sorted(missing)}")
+
+    def run(self, steps: List[Dict], skip: Iterable[str]=(), force: Iterable[str]=()) -> Dict[str, Dict]:
+        """Execute `steps`; returns status, seconds, error and result per step."""
+        self._check(steps)
+        skip, force = set(skip), set(force)
+        self.state = self.load_state()
+        self.results = {}
+        fingerprints = {}
+        pending = list(steps)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for stp in list(pending):
+                    name = stp['name']
+                    statuses = [self.results.get(d, {}).get('status') for d in stp['depends_on']]
+                    if any(s is not None and s not in DONE for s in statuses):
+                        pending.remove(stp)
+                        self.results[name] = {'status': 'blocked', 'seconds': 0.0, 'result': None,
+                                              'error': 'a dependency did not succeed'}
+                        continue
+                    if not all(s in DONE for s in statuses) or len(running) >= self.max_workers:
+                        continue
+
+                    pending.remove(stp)
+                    previous = self.state.get(name, {})
+                    if name in skip:
+                        fingerprints[name] = previous.get('fingerprint')
+                        self.results[name] = {'status': 'skipped', 'seconds': 0.0, 'error': None,
+                                              'result': previous.get('result')}
+                        continue
+
+                    fp = fingerprint(stp, fingerprints)
+                    fingerprints[name] = fp
+                    if (stp['cache'] and name not in force and previous.get('fingerprint') == fp
+                            and all(p.exists() for p in stp['outputs'])):
+                        self.results[name] = {'status': 'cached', 'seconds': 0.0, 'error': None,
+                                              'result': previous.get('result')}
+                        continue
+
+                    running[pool.submit(self._run_one, stp, fp)] = stp
+
+                if not running:
+                    if pending:
+                        # nothing can start and nothing is running: a dependency cycle
+                        for stp in pending:
+                            self.results[stp['name']] = {'status': 'blocked', 'seconds': 0.0, 'result': None,
+                                                         'error': 'dependency cycle'}
+                        pending = []
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stp = running.pop(future)
+                    result = future.result()
+                    self.results[stp['name']] = result
+                    if result['status'] == 'ok':
+                        # again, for inputs the step itself fetched (e.g. raw downloads)
+                        result['fingerprint'] = fingerprints[stp['name']] = fingerprint(stp, fingerprints)
+                        self.state[stp['name']] = {
+                            'fingerprint': result['fingerprint'],
+                            'seconds': result['seconds'],
+                            'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            'result': result['result'] if stp['keep_result'] else None,
+                        }
+                        self.save_state()
+
+        return {s['name']: self.results[s['name']] for s in steps}
+
+
+def print_step_results(results: Dict[str, Dict]):
+    total = sum(r['seconds'] for r in results.values())
+    print(f'PIPELINE: {len(results)} steps, {total:.1f}s of step time')
+    for name, r in results.items():
+        line = f"  {r['status']:<8} {r['seconds']:8.1f}s  {name}"
+        if r['error']:
+            line += f"  ({r['error']})"
+        print(line)
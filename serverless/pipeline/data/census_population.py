@@ -1,32 +1,38 @@
-import os
-import sys
-from pathlib import Path
-import shutil
-
 import pandas as pd
 
-from serverless import settings
-from serverless.utils import download_url
+from serverless import settings, tracing
+from serverless.pipeline.data.sources import read_source
+
+
+FIPS_CODE = 'Federal Information Processing Standards (FIPS) Code'
+RURAL_URBAN_CODE = 'Rural-Urban Continuum Code 2013'
 
 
+def shared_categories(*series):
+    """Cast `series` to one categorical dtype, so merges on them compare integer codes."""
+    dtype = pd.CategoricalDtype(pd.concat(series).dropna().unique())
+    return [s.astype(dtype) for s in series]
+
+
+@tracing.traced()
 def get_population_data(post_prep_filename):
 
-    population_20_url = settings.etl.census.population.url
-    population_estimates_url = settings.etl.census.population.pop_estimates.url
-    st_cty_ref_url = settings.etl.census.st_cty_ref.url
+    population = settings.etl.census.population
 
-    pop20 = pd.read_excel(
-        settings.etl.census.population.URL,
+    # each source is downloaded to data/raw once and parsed once; reruns
+    # read the cached parquet, and only the columns used below
+    pop20 = read_source(
+        population, pd.read_excel,
+        columns=[FIPS_CODE, 'Population 2020', RURAL_URBAN_CODE],
+        engine='openpyxl',
         header=4,
         nrows=3280,
-        dtype={
-            'Federal Information Processing Standards (FIPS) Code': str
-        },
+        dtype={FIPS_CODE: str},
         usecols=[
-            'Federal Information Processing Standards (FIPS) Code',
+            FIPS_CODE,
             'State',
             'Area name',
-            'Rural-Urban Continuum Code 2013',
+            RURAL_URBAN_CODE,
             'Population 1990',
             'Population 2000',
             'Population 2010',
@@ -35,49 +41,43 @@ def get_population_data(post_prep_filename):
         ]
     ).rename(
         columns={
-            'Federal Information Processing Standards (FIPS) Code': 'FIPStxt',
-            'Rural-Urban Continuum Code 2013': 'Rural_urban_continuum_code_2013'
+            FIPS_CODE: 'FIPStxt',
+            RURAL_URBAN_CODE: 'Rural_urban_continuum_code_2013'
         }
     )
 
-    download_url(
-        population_20_url,
-        settings.root_path/settings.data.raw_path/settings.etl.census.population.raw_file
-    )
-
     pop20.columns = [c.replace(' ', '_').replace('-', '_') for c in pop20.columns]
 
-    pop_est = pd.read_excel(
-        population_estimates_url,
-        header=3, nrows=3142
-    )
-
-    download_url(
-        population_estimates_url,
-        settings.root_path/settings.data.raw_path/settings.etl.census.population.pop_estimates.raw_file
+    pop_est = read_source(
+        population.pop_estimates, pd.read_excel,
+        engine='openpyxl', header=3, nrows=3142
     )
 
-    st_cty_ref = pd.read_csv(
-        st_cty_ref_url,
-        encoding = "ISO-8859-1", dtype={'cty': str, 'st': str}
+    st_cty_ref = read_source(
+        settings.etl.census.st_cty_ref, pd.read_csv,
+        encoding="ISO-8859-1", dtype={'cty': str, 'st': str}
     )
 
-    download_url(
-        st_cty_ref_url,
-        settings.root_path/settings.data.raw_path/settings.etl.census.st_cty_ref.raw_file
-    )
-
-    pop_est['geoarea'] = pop_est['Unnamed: 0'].apply(lambda x: x.replace('.', ''))
+    pop_est['geoarea'] = pop_est['Unnamed: 0'].str.replace('.', '', regex=False)
     pop_est = pop_est.drop(columns=['Unnamed: 0'])
+    pop_est['geoarea'], st_cty_ref['ctyname'] = shared_categories(pop_est['geoarea'], st_cty_ref['ctyname'])
     pop_est = pop_est.merge(st_cty_ref, left_on='geoarea', right_on='ctyname').drop(columns=['geoarea'])
-    pop_est.columns = [f'PopulationEstimate_{col}' if isinstance(col, int) else col for col in pop_est.columns]
+    # cached column names are strings, so the year columns are '2010', ...
+    pop_est.columns = [f'PopulationEstimate_{col}' if col.isdigit() else col for col in pop_est.columns]
     pop_est.columns = [col.replace(' ', '') for col in pop_est.columns]
 
     pop_est['FIPStxt'] = pop_est['st'] + pop_est['cty']
+    pop20['FIPStxt'], pop_est['FIPStxt'] = shared_categories(pop20['FIPStxt'], pop_est['FIPStxt'])
     pop_est = pop20[['FIPStxt', 'Population_2020', 'Rural_urban_continuum_code_2013']].merge(pop_est, on='FIPStxt')
 
+    # keys go back to plain strings so the table schema doesn't change
+    pop_est['FIPStxt'] = pop_est['FIPStxt'].astype(str)
+    pop_est['ctyname'] = pop_est['ctyname'].astype(str)
+
     post_prep_filename.parent.mkdir(parents=True, exist_ok=True)
     pop_est.to_parquet(post_prep_filename)
+    tracing.count('rows', len(pop_est))
+    tracing.count('bytes_written', post_prep_filename.stat().st_size)
 
 
 def main():
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from serverless import settings
+from serverless.pipeline.partitions import iter_partitions
+from serverless.lambda_app.app.lookup import write_lookup
+
+
+def _processed(path):
+    return settings.root_path/settings.data.processed_path/path
+
+# name -> (source under data/processed, function returning the key column, key width)
+LOOKUPS = {
+    'county_population': (
+        settings.etl.census.population.processed_file,
+        lambda df: df['FIPStxt'],
+        5,
+    ),
+    'county_business_patterns': (
+        settings.etl.census.businesspatterns.processed_file,
+        lambda df: df['fipstate'] + df['fipscty'],
+        5,
+    ),
+    'zip_county': (
+        settings.etl.tiger.mapping.file_path,
+        lambda df: df['zip'],
+        5,
+    ),
+}
+
+
+def build_lookup(name, df, key, key_width, to_path):
+    """Group `df` by `key` and write one JSON array of records per key."""
+    df = df.astype(object).where(df.notna(), None)
+    df['_key'] = key.astype(str).to_numpy()
+
+    def items():
+        for (value,), group in iter_partitions(df, ['_key']):
+            records = group.drop(columns=['_key']).to_dict(orient='records')
+            yield value, json.dumps(records, default=str).encode()
+
+    to_path.parent.mkdir(parents=True, exist_ok=True)
+    write_lookup(to_path, items(), key_width, name=name)
+    print(f'LOOKUP: wrote {name} ({len(df)} rows) to {to_path}')
+
+
+def build_lookups(names=None):
+    lookup_path = settings.root_path/settings.data.lookup_path
+    for name, (source, key, key_width) in LOOKUPS.items():
+        if names and name not in names:
+            continue
+        df = pd.read_parquet(_processed(source))
+        build_lookup(name, df, key(df), key_width, lookup_path/f'{name}.lkp')
+
+
+def main():
+    build_lookups()
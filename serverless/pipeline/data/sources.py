@@ -0,0 +1,109 @@
+"""
+Downloading and cached parsing of raw source files.
+
+Parsing spreadsheets with openpyxl is by far the slowest part of the census
+and mapping ETLs, and the sources rarely change. `fetch_source` downloads a
+source into `data/raw` once and checks it against its recorded md5 on later
+runs; `read_cached` parses a file once per distinct content and reader
+arguments and keeps the result as Parquet under `data/interim/cache/`, so
+later runs read the Parquet instead, decoding only the requested columns.
+`read_source` does both for a source block of `settings.etl`.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Tuple
+
+import pandas as pd
+
+from serverless import settings, tracing
+from serverless.utils import download_url, file_md5
+
+
+def cache_dir() -> Path:
+    return settings.root_path/settings.data.interim_path/'cache'
+
+
+def cache_path(path, digest: str, reader_kwargs: dict, root=None) -> Path:
+    """Cache file for `path` with content hash `digest` read with `reader_kwargs`."""
+    key = hashlib.md5(
+        (digest + json.dumps(reader_kwargs, sort_keys=True, default=str)).encode()
+    ).hexdigest()[:16]
+    return Path(root or cache_dir())/f'{Path(path).stem}-{key}.parquet'
+
+
+def fetch_source(url: str, raw_file, md5: str=None) -> Tuple[Path, str]:
+    """
+    Download `url` to `raw_file` unless it's already there; returns `(path, md5)`.
+
+    The md5 of the file is recorded next to it in `<raw_file>.md5`. A file
+    that no longer matches its recorded hash (truncated, edited by hand) is
+    downloaded again, and when `md5` is given the file must match it.
+    """
+    raw_file = Path(raw_file)
+    sidecar = raw_file.with_name(raw_file.name + '.md5')
+
+    if raw_file.is_file():
+        digest = file_md5(raw_file)
+        recorded = sidecar.read_text().strip() if sidecar.is_file() else digest
+        if digest != recorded or (md5 and digest != md5):
+            print(f'STALE: {raw_file} does not match its recorded md5, downloading again')
+            raw_file.unlink()
+
+    if not raw_file.is_file():
+        raw_file.parent.mkdir(parents=True, exist_ok=True)
+        download_url(
+            url, raw_file,
+            chunk_size=settings.download.chunk_size,
+            retries=settings.download.retries,
+            timeout=settings.download.timeout,
+        )
+        digest = file_md5(raw_file)
+        tracing.count('bytes_downloaded', raw_file.stat().st_size)
+        if md5 and digest != md5:
+            raise ValueError(f'{raw_file} has md5 {digest}, expected {md5}')
+
+    sidecar.write_text(digest)
+    return raw_file, digest
+
+
+def read_cached(path, reader, columns=None, cache_root=None, digest: str=None,
+                **reader_kwargs) -> pd.DataFrame:
+    """
+    `reader(path, **reader_kwargs)`, parsed at most once per source content.
+
+    Column names are always strings (Parquet requires it), on a cache miss as
+    well as a hit. `columns` limits what is returned, and on a hit what is
+    read from disk. `cache_root` overrides `data/interim/cache`; pass the
+    file's `digest` when it is already known.
+    """
+    to_file = cache_path(path, digest or file_md5(path), reader_kwargs, root=cache_root)
+    if to_file.is_file():
+        print(f'CACHED: {path} from {to_file.name}')
+        tracing.count('bytes_read', to_file.stat().st_size)
+        return pd.read_parquet(to_file, columns=columns)
+
+    print(f'PARSING: {path}')
+    tracing.count('bytes_read', Path(path).stat().st_size)
+    df = reader(path, **reader_kwargs)
+    df.columns = df.columns.map(str)
+    to_file.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(to_file, index=False)
+    return df[columns] if columns else df
+
+
+def read_excel_cached(path, columns=None, cache_root=None, **kwargs) -> pd.DataFrame:
+    """`pd.read_excel` through `read_cached`."""
+    kwargs.setdefault('engine', 'openpyxl')
+    return read_cached(path, pd.read_excel, columns=columns, cache_root=cache_root, **kwargs)
+
+
+def read_source(source, reader, columns=None, **reader_kwargs) -> pd.DataFrame:
+    """
+    Fetch a `settings.etl` source block (`url`, `raw_file`, optional `md5`)
+    into `data/raw` and read it through the cache.
+    """
+    path, digest = fetch_source(
+        source.url, settings.root_path/settings.data.raw_path/source.raw_file, md5=source.get('md5')
+    )
+    return read_cached(path, reader, columns=columns, digest=digest, **reader_kwargs)
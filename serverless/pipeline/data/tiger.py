@@ -2,23 +2,71 @@ import os
 import shutil
 import re
 import json
+import multiprocessing
+import time
+from collections import Counter
+from functools import partial
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 
-from serverless import settings
-from serverless.utils import download_url
-
-
-def prep_zipcode_to_county_mapping(inpath, outpath, partition):
-    df = pd.read_excel(inpath, engine='openpyxl', dtype={'zip': str, 'county': str})
-    df['statefp'] = df['county'].apply(lambda x: x[:2])
-    df['countyfp'] = df['county'].apply(lambda x: x[2:])
-    df['state'] = df['usps_zip_pref_state'].str.lower()
-    df['city'] = df['usps_zip_pref_city'].str.lower()
-    df.to_parquet(outpath, index=False, partition_cols=partition)
+from serverless import settings, tracing
+from serverless.utils import download_many
+from serverless.pipeline.partitions import (
+    iter_partitions, partition_location, manifest_path, write_manifest
+)
+from serverless.pipeline.spatial_index import str_order, write_index
+from serverless.pipeline.data.tiles import simplify_geo_data, tiles
+from serverless.pipeline.data.sources import read_excel_cached
+
+
+def zipcode_to_county_mapping(df):
+    """Add FIPS codes and lowercased state/city to the HUD ZIP-county crosswalk."""
+    df = df.copy()
+    df['statefp'] = df['county'].str[:2]
+    df['countyfp'] = df['county'].str[2:]
+    # a few dozen states and ~20k cities over ~50k rows: categoricals keep
+    # one copy of each string, and parquet dictionary-encodes them
+    df['state'] = df['usps_zip_pref_state'].str.lower().astype('category')
+    df['city'] = df['usps_zip_pref_city'].str.lower().astype('category')
+    return df
+
+def prep_zipcode_to_county_mapping(inpath, outpath, partition, row_group_size=None, compression='snappy'):
+    """
+    Write the ZIP-county crosswalk as one Parquet file per `partition` value.
+
+    The workbook is parsed through the source cache, so re-runs of an
+    unchanged file never touch openpyxl. Partitions are written like the
+    TIGER layers: `<outpath>/statefp=01/01.parquet`, with row groups of
+    `row_group_size` rows, plus a manifest. Returns the manifest entries.
+    """
+    df = zipcode_to_county_mapping(
+        read_excel_cached(inpath, dtype={'zip': str, 'county': str})
+    )
+    partition = list(partition or [])
+    outpath = Path(outpath)
+
+    entries = []
+    for values, group in iter_partitions(df, partition):
+        fileid = ''.join(str(v) for v in values) or Path(inpath).stem
+        to_file = outpath/partition_location(partition, values)/f'{fileid}.parquet'
+        rows, size = _write_partition(
+            group, to_file, output_format='parquet', partitions=partition,
+            compression=compression, row_group_size=row_group_size
+        )
+        entries.append({
+            'partition': dict(zip(partition, map(str, values))),
+            'path': to_file.relative_to(settings.root_path).as_posix(),
+            'rows': rows,
+            'bytes': size,
+        })
+    write_manifest(manifest_path(outpath, inpath), inpath, partition, entries)
+    return entries
 
 def shp_to_esri_enclosed_json_input(gdf, geom_type='esriGeometryPolygon'):
 
@@ -54,34 +102,376 @@ def shp_to_esri_enclosed_json_input(gdf, geom_type='esriGeometryPolygon'):
 
     return esri_enclosed_json_inputs
 
-def partition_geo_data(path, partitions, processed_path, input_df=None, geom_type='esriGeometryPolygon'):
-
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+ESRI_GEOMETRY_KEYS = {
+    'esriGeometryPolygon': 'rings',
+    'esriGeometryPolyline': 'paths',
+}
+
+def _json_default(value):
+    """Encode numpy scalars and timestamps the way `gdf.to_json()` would."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _encode_column(series):
+    """JSON-encode every value of a column once, with missing values as null."""
+    values = series.astype(object).where(series.notna(), None).tolist()
+    return [json.dumps(v, default=_json_default) for v in values]
+
+def _esri_parts(geom):
+    """Rings (polygons) or paths (lines) of a geometry as nested coordinate lists."""
+    if geom.geom_type == 'Polygon':
+        parts = [geom.exterior, *geom.interiors]
+    elif geom.geom_type == 'MultiPolygon':
+        parts = [ring for poly in geom.geoms for ring in (poly.exterior, *poly.interiors)]
+    elif geom.geom_type == 'LineString':
+        parts = [geom]
+    elif geom.geom_type == 'MultiLineString':
+        parts = list(geom.geoms)
+    else:
+        raise ValueError(f'cannot write {geom.geom_type} as Esri rings/paths')
+    return [np.asarray(part.coords).tolist() for part in parts]
+
+def write_esri_enclosed_json(gdf, fp, geom_type='esriGeometryPolygon'):
+    """
+    Stream `gdf` to the text file handle `fp` as Esri EnclosedJson.
+
+    Produces the same document `json.dump(shp_to_esri_enclosed_json_input(gdf))`
+    does, but one feature at a time straight from the column and geometry
+    arrays, so no GeoJSON string or dict tree of the whole frame is built.
+    Multipolygons are written as a flat list of rings, which is what the Esri
+    JsonSerde expects. Returns the number of features written.
+    """
+    geom_key = ESRI_GEOMETRY_KEYS[geom_type]
+    geometry_name = gdf.geometry.name
+    columns = [c for c in gdf.columns if c != geometry_name]
+
+    aliases = ', '.join(f'{json.dumps(c)}: {json.dumps(c)}' for c in columns)
+    fp.write(
+        f'{{"displayFieldName": "", "fieldAliases": {{{aliases}}}, '
+        f'"geometryType": {json.dumps(geom_type)}, "spatialReference": {{"wkid": 4269}}'
+    )
+
+    prefixes = [f'{json.dumps(c)}: ' for c in columns]
+    encoded = [_encode_column(gdf[c]) for c in columns]
+
+    rows = zip(*encoded) if columns else repeat(())
+
+    written = 0
+    for geom, row in zip(gdf.geometry.values, rows):
+        if geom is None or geom.is_empty:
+            continue
+        fp.write(', "features": [' if not written else ', ')
+        attributes = ', '.join(p + v for p, v in zip(prefixes, row))
+        fp.write(f'{{"attributes": {{{attributes}}}, "geometry": {{"{geom_key}": ')
+        fp.write(json.dumps(_esri_parts(geom)))
+        fp.write('}}')
+        written += 1
+
+    fp.write(']}' if written else '}')
+    return written
+
+OUTPUT_SUFFIXES = {
+    'esri_json': '.geojson',
+    'parquet': '.parquet',
+}
+
+def _write_partition(group, to_file, output_format='esri_json', geom_type='esriGeometryPolygon',
+                     partitions=(), compression='snappy', row_group_size=None):
+    to_file.parent.mkdir(parents=True, exist_ok=True)
+    if output_format == 'parquet':
+        # partition values live in the Hive path, so they're dropped from the file
+        group.drop(columns=list(partitions)).to_parquet(
+            to_file, index=False, compression=compression, row_group_size=row_group_size
+        )
+        rows = len(group)
+    else:
+        with open(to_file, 'w', buffering=WRITE_BUFFER_SIZE) as file:
+            rows = write_esri_enclosed_json(group, file, geom_type=geom_type)
+    return rows, to_file.stat().st_size
+
+@tracing.traced()
+def partition_geo_data(path, partitions, processed_path, input_df=None, geom_type='esriGeometryPolygon',
+                       max_workers=None, output_format='esri_json', compression='snappy',
+                       row_group_size=None):
+    """
+    Write `path` (or `input_df`) as one file per partition.
+
+    With `input_df` and no `path`, the unpartitioned file and the manifest
+    are named after the `processed_path` folder (e.g. `county`).
+
+    `output_format` is either `esri_json` (Esri EnclosedJson for the Esri
+    JsonSerde) or `parquet` (GeoParquet with WKB geometry, `compression` and
+    row groups of `row_group_size` rows).
+
+    The frame is sorted once by the partition keys and written as contiguous
+    slices, through a shared thread pool when `max_workers` > 1. Without
+    partition keys the whole layer goes to a single file named after the
+    source. A manifest of the written partitions (values, path, rows, bytes)
+    is saved for `Pipeline.to_s3` and `build_athena_model` and returned.
+    """
     gdf = input_df if input_df is not None else gpd.read_file(path).to_crs(4269).convert_dtypes()
-
-    if partitions:
-
-        grouped = gdf.groupby(partitions, as_index=False)
-
-        for name, group in grouped:
-            if isinstance(name, str):
-                name = [name]
-            filters = list(zip(partitions, name))
-            fileid = ''.join([i[1] for i in filters])
-            loc = '/'.join([f'{f[0]}={f[1]}'.lower() for f in filters])
-
-            esri_format = shp_to_esri_enclosed_json_input(group, geom_type=geom_type)
-
-            to_path = Path(processed_path/loc)
-            to_path.mkdir(parents=True, exist_ok=True)
-
-            with open(to_path/f'{fileid}.geojson', 'w') as file:
-                json.dump(esri_format, file)
-
-def tiger():
+    partitions = list(partitions or [])
+    processed_path = Path(processed_path)
+    source = path if path is not None else processed_path.name
+    max_workers = max_workers or settings.parallel.writer_threads
+    suffix = OUTPUT_SUFFIXES[output_format]
+    write = partial(
+        _write_partition, output_format=output_format, geom_type=geom_type,
+        partitions=partitions, compression=compression, row_group_size=row_group_size
+    )
+
+    jobs = []
+    for values, group in iter_partitions(gdf, partitions):
+        fileid = ''.join(str(v) for v in values) or Path(source).stem
+        loc = partition_location(partitions, values)
+        to_file = processed_path/loc/f'{fileid}{suffix}'
+        jobs.append((dict(zip(partitions, map(str, values))), to_file, group))
+
+    if max_workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            written = list(pool.map(lambda job: write(job[2], job[1]), jobs))
+    else:
+        written = [write(group, to_file) for _, to_file, group in jobs]
+
+    entries = [
+        {
+            'partition': partition,
+            'path': to_file.relative_to(settings.root_path).as_posix(),
+            'rows': rows,
+            'bytes': size,
+        }
+        for (partition, to_file, _), (rows, size) in zip(jobs, written)
+    ]
+    write_manifest(manifest_path(processed_path, source), source, partitions, entries)
+    tracing.count('rows', sum(e['rows'] for e in entries))
+    tracing.count('bytes_written', sum(e['bytes'] for e in entries))
+
+    return entries
+
+def _polygon_rings(geom):
+    """Exterior and interior rings of a (multi)polygon as (n, 2) coordinate arrays."""
+    polygons = geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]
+    return [
+        np.asarray(ring.coords)[:, :2]
+        for polygon in polygons for ring in (polygon.exterior, *polygon.interiors)
+    ]
+
+def build_spatial_index(gdf, to_file, tolerance=0.0, columns=None, meta=None):
+    """
+    Write the polygons of `gdf` as a packed STR R-tree (see pipeline/spatial_index.py).
+
+    Geometries are simplified with `tolerance` (degrees, topology preserved)
+    when it's set; `columns` (all non-geometry columns by default) are kept as
+    each feature's attributes. Returns the number of features indexed.
+    """
+    geometry_name = gdf.geometry.name
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    geometry = gdf.geometry
+    if tolerance:
+        geometry = geometry.simplify(tolerance, preserve_topology=True)
+
+    boxes = geometry.bounds.to_numpy(dtype='f8')
+    order = str_order(boxes)
+    geoms, boxes = geometry.values[order], boxes[order]
+
+    rings, feature_rings = [], [0]
+    for geom in geoms:
+        rings.extend(_polygon_rings(geom))
+        feature_rings.append(len(rings))
+    ring_offsets = np.zeros(len(rings) + 1, dtype='i8')
+    ring_offsets[1:] = np.cumsum([len(ring) for ring in rings])
+    coords = np.concatenate(rings) if rings else np.empty((0, 2))
+
+    columns = columns or [c for c in gdf.columns if c != geometry_name]
+    encoded = [_encode_column(gdf[c].iloc[order]) for c in columns]
+    prefixes = [f'{json.dumps(c)}:' for c in columns]
+    attributes = [
+        ('{' + ','.join(p + v for p, v in zip(prefixes, row)) + '}').encode()
+        for row in (zip(*encoded) if columns else repeat((), len(geoms)))
+    ]
+
+    to_file.parent.mkdir(parents=True, exist_ok=True)
+    write_index(to_file, boxes, coords, ring_offsets, feature_rings, attributes, meta=meta)
+    return len(geoms)
+
+@tracing.traced()
+def build_spatial_indexes(gdf, layer, partition_by=(), tolerance=0.0, columns=None):
+    """
+    One index per value of `partition_by` (e.g. a state), or one for the
+    whole layer, under `settings.data.spatial_path/<layer>/`. The Lambda
+    reads them from `s3://<bucket>/spatial/`, see
+    `Pipeline.upload_artifacts(local_dir=spatial_path, prefix='spatial')`.
+    """
+    spatial_path = settings.root_path/settings.data.spatial_path/layer
+    partition_by = list(partition_by or [])
+    written = []
+    for values, group in iter_partitions(gdf, partition_by):
+        name = ''.join(str(v) for v in values) or 'all'
+        to_file = spatial_path/f'{name}.sidx'
+        meta = {'layer': layer, 'partition': dict(zip(partition_by, map(str, values))), 'tolerance': tolerance}
+        count = build_spatial_index(group, to_file, tolerance=tolerance, columns=columns, meta=meta)
+        print(f'INDEXED: {count} {layer} features to {to_file}')
+        written.append(to_file)
+    return written
+
+def download_tiger_files():
+    """Fetch every raw TIGER file that isn't on disk yet, concurrently.
+
+    Returns the set of raw paths that were downloaded in this run and a
+    dict of the raw paths that failed to download and their errors.
+    """
+    jobs = []
+    for folder, subfolder in settings.etl.tiger.items():
+        raw_path = settings.root_path/settings.data.raw_path/subfolder.file_path
+        for file in subfolder.files:
+            raw_file_path = raw_path/file
+            if not os.path.isfile(raw_file_path):
+                jobs.append((subfolder.url+file, raw_file_path))
+
+    results = download_many(
+        jobs,
+        max_workers=settings.download.max_workers,
+        chunk_size=settings.download.chunk_size,
+        retries=settings.download.retries,
+        timeout=settings.download.timeout,
+    )
+    downloaded = {Path(r['path']) for r in results if 'error' not in r}
+    failed = {Path(r['path']): r['error'] for r in results if 'error' in r}
+    return downloaded, failed
+
+def process_tiger_unit(layer, file, downloaded=False):
+    """Unzip, reproject and partition one file of one TIGER layer.
+
+    A unit is processed when its raw file was `downloaded` in this run or
+    its manifest, written last, is missing (it never ran or failed part way);
+    otherwise it's skipped. Runs in a worker process when
+    `tiger(parallel=True)`, so it only takes picklable arguments and never
+    raises: failures, including a missing raw file, come back in the result.
+    """
     zip_extension = '.zip'
     shp_extension = '.shp'
     excel_extensions = ['.xls', '.xlsx']
 
+    start = time.perf_counter()
+    result = {'layer': layer, 'file': file, 'status': 'skipped', 'error': None}
+
+    try:
+        subfolder = settings.etl.tiger.get(layer)
+
+        raw_path = settings.root_path/settings.data.raw_path/subfolder.file_path
+        interim_path = settings.root_path/settings.data.interim_path/subfolder.file_path
+        processed_path = settings.root_path/settings.data.processed_path/subfolder.file_path
+
+        raw_file_path = raw_path/file
+        interim_file_path = interim_path/file
+        existing_interim_files = [re.sub(r'\..*', '', i.name) for i in interim_path.iterdir()]
+
+        file_name_wo_zip = file.replace(zip_extension, '')
+
+        if not raw_file_path.is_file():
+            raise FileNotFoundError(f'raw file {raw_file_path} is missing')
+
+        stale = downloaded or not manifest_path(processed_path, raw_file_path).is_file()
+
+        if stale and raw_file_path.suffix in excel_extensions:
+            print(F'PREPPING: from {raw_file_path} to {processed_path}')
+            prep_zipcode_to_county_mapping(
+                raw_file_path, processed_path, subfolder.partition_by,
+                row_group_size=subfolder.get('row_group_size'),
+                compression=subfolder.get('compression', 'snappy'),
+            )
+            result['status'] = 'ok'
+
+        elif stale:
+            if (zip_extension in file) and (file_name_wo_zip not in existing_interim_files):
+                print(f'UNZIPPING: from {raw_file_path} to {interim_file_path.parent}')
+                shutil.unpack_archive(raw_file_path, interim_file_path.parent)
+
+            if raw_file_path.suffix == zip_extension:
+                interim_file = interim_file_path.parent/(raw_file_path.stem+shp_extension)
+                gdf = gpd.read_file(interim_file).to_crs(4269).convert_dtypes()
+                tracing.count('bytes_read', sum(
+                    f.stat().st_size for f in interim_file.parent.glob(interim_file.stem + '.*')
+                ))
+                spatial_index = subfolder.get('spatial_index')
+                if spatial_index:
+                    build_spatial_indexes(
+                        gdf, layer,
+                        partition_by=spatial_index.get('partition_by'),
+                        tolerance=spatial_index.get('tolerance', 0.0),
+                        columns=spatial_index.get('columns'),
+                    )
+                tile_config = subfolder.get('tiles')
+                if tile_config:
+                    simplify_geo_data(
+                        gdf, layer, raw_file_path.stem, tile_config.zooms, columns=tile_config.get('columns')
+                    )
+                # last: its manifest marks the unit as done
+                print(f'PARTITIONING: from {interim_file} to {processed_path}')
+                partition_geo_data(
+                    interim_file, subfolder.partition_by, processed_path, input_df=gdf,
+                    output_format=subfolder.get('output_format', 'esri_json'),
+                    compression=subfolder.get('compression', 'snappy'),
+                    row_group_size=subfolder.get('row_group_size'),
+                )
+            result['status'] = 'ok'
+
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = repr(e)
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def traced_tiger_unit(layer, file, downloaded=False, trace=None):
+    """
+    `process_tiger_unit` in a trace span. With `trace` (the parent's
+    `tracing.config()`) tracing is turned on in the worker and its events
+    are returned in the result's `trace`, for the parent to merge.
+    """
+    if trace:
+        tracing.enable(**trace)
+    with tracing.span('process_tiger_unit', layer=layer, file=file):
+        result = process_tiger_unit(layer, file, downloaded)
+    if trace:
+        result['trace'] = tracing.collect()
+    return result
+
+def _print_tiger_summary(results, seconds):
+    counts = Counter(r['status'] for r in results)
+    print(f'TIGER ETL: {len(results)} units in {seconds:.1f}s '
+          f'({counts["ok"]} ok, {counts["skipped"]} skipped, {counts["failed"]} failed)')
+    for r in sorted(results, key=lambda r: (r['layer'], r['file'])):
+        line = f"  {r['status']:<8} {r['layer']:<10} {r['file']:<32} {r['seconds']:8.1f}s"
+        if r['error']:
+            line += f"  {r['error']}"
+        print(line)
+
+@tracing.traced()
+def tiger(parallel=None, max_workers=None):
+    """
+    Run the TIGER ETL for every (layer, file) unit in `settings.etl.tiger`.
+
+    Raw files are downloaded first; each unit is then processed serially or,
+    with `parallel=True`, on a process pool of `max_workers` processes
+    (defaults come from `settings.parallel`). Workers are spawned rather than
+    forked, since this runs on a pipeline thread and a fork would copy locks
+    other threads hold. A unit whose download failed counts as failed, and
+    a failing unit doesn't stop the others; a summary is printed and the
+    per-unit results are returned.
+    """
+    parallel = settings.parallel.enabled if parallel is None else parallel
+    max_workers = max_workers or settings.parallel.etl_workers or os.cpu_count()
+
+    start = time.perf_counter()
+    downloaded, failed_downloads = download_tiger_files()
+
+    units, results = [], []
     for folder, subfolder in settings.etl.tiger.items():
 
         raw_path = settings.root_path/settings.data.raw_path/subfolder.file_path
@@ -92,42 +482,35 @@ def tiger():
         processed_path.mkdir(parents=True, exist_ok=True)
         interim_path.mkdir(parents=True, exist_ok=True)
 
-        url = subfolder.url
-
         for file in subfolder.files:
-            raw_file_path = raw_path/file
-            processed_file_path = processed_path/file
-            interim_file_path = interim_path/file
-            raw_file_exists = os.path.isfile(raw_file_path)
-            existing_interim_files = [re.sub('\..*', '', i.name) for i in interim_path.iterdir()]
-            processed_file_exists = os.path.isfile(processed_file_path)
-
-            file_name_wo_zip = file.replace(zip_extension, '')
-
-            if not raw_file_exists:
-                print(f'DOWNLOADING: from {url+file} to {raw_file_path}')
-                download_url(url+file, raw_file_path)
-                if (zip_extension in file) and (file_name_wo_zip not in existing_interim_files):
-                    print(f'UNZIPPING: from {raw_file_path} to {interim_file_path.parent}')
-                    shutil.unpack_archive(raw_file_path, interim_file_path.parent)
-
-                if raw_file_path.suffix == zip_extension:
-                    interim_file = interim_file_path.parent/(raw_file_path.stem+shp_extension)
-                    interim_file_exists = os.path.isfile(interim_file)
-                    # if not interim_file_exists:
-                    print(f'PARTITIONING: from {interim_file} to {processed_path}')
-                    partition_geo_data(interim_file, subfolder.partition_by, processed_path)
-
-            elif raw_file_path.suffix in excel_extensions:
-                interim_file = interim_file_path.parent/'data.parquet'
-                interim_file_exists = os.path.isfile(interim_file)
-                if not interim_file_exists:
-                    print(F'PREPPING: from {raw_file_path} to {interim_file}')
-                    prep_zipcode_to_county_mapping(raw_file_path, processed_file_path.parent, subfolder.partition_by)
-
-        print(f'FINISHED POPULATING RAW, INTERIM, AND PROCESSED DIRECTORIES for {processed_path}')
-
-    return None
+            if raw_path/file in failed_downloads:
+                results.append({'layer': folder, 'file': file, 'status': 'failed', 'seconds': 0.0,
+                                'error': f'download failed: {failed_downloads[raw_path/file]}'})
+            else:
+                units.append((folder, file, raw_path/file in downloaded))
+
+    if parallel and len(units) > 1:
+        trace = tracing.config() if tracing.enabled() else None
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(traced_tiger_unit, *unit, trace=trace): unit for unit in units}
+            for future in as_completed(futures):
+                layer, file, _ = futures[future]
+                try:
+                    result = future.result()
+                    tracing.merge(result.pop('trace', None))
+                    results.append(result)
+                except Exception as e:
+                    # the worker process itself died, e.g. BrokenProcessPool
+                    results.append({'layer': layer, 'file': file, 'status': 'failed',
+                                    'error': repr(e), 'seconds': 0.0})
+    else:
+        results += [traced_tiger_unit(*unit) for unit in units]
+
+    _print_tiger_summary(results, time.perf_counter() - start)
+
+    return results
 
 def main():
     tiger()
+    # tiles are cut once every unit has written its simplified geometries
+    tiles()
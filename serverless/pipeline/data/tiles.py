@@ -0,0 +1,201 @@
+"""
+Simplified geometries and vector-tile pyramids for map traffic.
+
+Two steps, both configured by a layer's `tiles` setting:
+
+* `simplify_geo_data` runs inside each TIGER unit and writes GeoParquet
+  copies of the layer at every zoom in `zooms`, simplified to about half a
+  pixel at that zoom, next to the full-resolution partitions in
+  `data/processed/tiger/<layer>/_simplified/z<zoom>/`. Athena skips paths
+  starting with `_`, and so does `Pipeline._get_dirs`, so they never show
+  up in the layer's table.
+* `build_tiles` runs once per layer after the ETL, clears the layer's old
+  tiles, reads the simplified copies back and cuts Mapbox Vector Tiles to
+  `data/tiles/<layer>/<z>/<x>/<y>.mvt`, which the Lambda serves under
+  `tiles/` so map requests never read the full-resolution partitions. It
+  needs the optional `mapbox_vector_tile` package and is skipped without it.
+
+Tiles are synced with `Pipeline.upload_artifacts(local_dir=<tiles_path>, prefix='tiles',
+delete=True)`, which also removes tiles that are no longer built.
+"""
+import shutil
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from serverless import settings, tracing
+
+
+WEB_MERCATOR = 3857
+ORIGIN = 20037508.342789244
+TILE_PIXELS = 256
+EXTENT = 4096
+# tiles are clipped slightly larger than their bounds so strokes don't
+# show seams at tile edges
+BUFFER_PIXELS = 4
+
+
+def _mapbox_vector_tile():
+    try:
+        import mapbox_vector_tile
+    except ImportError:
+        return None
+    return mapbox_vector_tile
+
+
+SIMPLIFIED_DIR = '_simplified'
+
+
+def tiles_path(layer):
+    return settings.root_path/settings.data.tiles_path/layer
+
+
+def simplified_path(layer):
+    """Simplified copies of `layer`, beside its processed partitions."""
+    return settings.root_path/settings.data.processed_path/settings.etl.tiger[layer].file_path/SIMPLIFIED_DIR
+
+
+def tolerance(zoom):
+    """Half a pixel at `zoom`, in Web Mercator meters."""
+    return 2 * ORIGIN / (TILE_PIXELS * 2 ** zoom) / 2
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) of a tile in Web Mercator meters."""
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_ranges(bounds, z):
+    """Inclusive x and y tile ranges covered by each row of `bounds` (n, 4)."""
+    size = 2 * ORIGIN / 2 ** z
+    last = 2 ** z - 1
+    x0 = np.clip(np.floor((bounds[:, 0] + ORIGIN) / size), 0, last).astype(int)
+    x1 = np.clip(np.floor((bounds[:, 2] + ORIGIN) / size), 0, last).astype(int)
+    y0 = np.clip(np.floor((ORIGIN - bounds[:, 3]) / size), 0, last).astype(int)
+    y1 = np.clip(np.floor((ORIGIN - bounds[:, 1]) / size), 0, last).astype(int)
+    return x0, x1, y0, y1
+
+
+@tracing.traced()
+def simplify_geo_data(gdf, layer, name, zooms, columns=None):
+    """
+    Write `gdf` simplified for every zoom in `zooms`.
+
+    Each geometry is simplified on its own with topology preserved, so
+    polygons stay valid; shared borders between neighbours are simplified
+    independently, which leaves sub-pixel slivers at most. Returns the
+    written paths.
+    """
+    geometry_name = gdf.geometry.name
+    columns = list(columns or [c for c in gdf.columns if c != geometry_name])
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    projected = gdf[columns + [geometry_name]].to_crs(WEB_MERCATOR)
+
+    written = []
+    for zoom in zooms:
+        simplified = projected.geometry.simplify(tolerance(zoom), preserve_topology=True)
+        keep = (~simplified.is_empty).to_numpy()
+        out = gpd.GeoDataFrame(
+            projected[columns][keep], geometry=simplified[keep].values, crs=WEB_MERCATOR
+        ).to_crs(gdf.crs)
+        to_file = simplified_path(layer)/f'z{zoom}'/f'{name}.parquet'
+        to_file.parent.mkdir(parents=True, exist_ok=True)
+        out.to_parquet(to_file, index=False, compression='zstd')
+        written.append(to_file)
+    print(f'SIMPLIFIED: {layer}/{name} at zooms {list(zooms)}')
+    return written
+
+
+def read_simplified(layer, zoom):
+    """Every simplified file of `layer` at `zoom`, in Web Mercator."""
+    files = sorted((simplified_path(layer)/f'z{zoom}').glob('*.parquet'))
+    if not files:
+        return None
+    gdf = pd.concat([gpd.read_parquet(f) for f in files], ignore_index=True)
+    return gpd.GeoDataFrame(gdf, geometry=gdf.geometry.name).to_crs(WEB_MERCATOR)
+
+
+def encode_tile(mvt, layer, geoms, records, bounds):
+    """One MVT tile of already-clipped Web Mercator geometries."""
+    features = [
+        {'geometry': geom, 'properties': {k: v for k, v in record.items() if v is not None}}
+        for geom, record in zip(geoms, records)
+    ]
+    # the 1.2 keyword API (pinned: 2.x needs shapely 2), which 2.x also accepts
+    return mvt.encode(
+        [{'name': layer, 'features': features}], quantize_bounds=bounds, extents=EXTENT,
+    )
+
+
+def build_tiles(layer, zooms, columns=None):
+    """
+    Cut the MVT pyramid of `layer` for `zooms` from its simplified copies.
+
+    The layer's previous tiles are removed first, so features that no
+    longer exist don't leave tiles behind. Features are bucketed into the tiles their bounding box covers, clipped
+    to each (buffered) tile and encoded. Returns the number of tiles written.
+    """
+    from shapely.ops import clip_by_rect
+
+    mvt = _mapbox_vector_tile()
+    if mvt is None:
+        print(f'TILES: mapbox_vector_tile is not installed, skipping {layer}')
+        return 0
+
+    shutil.rmtree(tiles_path(layer), ignore_errors=True)
+    written = 0
+    for zoom in zooms:
+        gdf = read_simplified(layer, zoom)
+        if gdf is None:
+            continue
+        geometry_name = gdf.geometry.name
+        keep = list(columns or [c for c in gdf.columns if c != geometry_name])
+        records = gdf[keep].astype(object).where(gdf[keep].notna(), None).to_dict(orient='records')
+        geoms = list(gdf.geometry.values)
+
+        buckets = defaultdict(list)
+        for i, (x0, x1, y0, y1) in enumerate(zip(*tile_ranges(gdf.geometry.bounds.to_numpy(), zoom))):
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    buckets[(x, y)].append(i)
+
+        buffer = BUFFER_PIXELS * 2 * ORIGIN / (EXTENT * 2 ** zoom)
+        for (x, y), members in buckets.items():
+            minx, miny, maxx, maxy = tile_bounds(zoom, x, y)
+            clipped = [
+                clip_by_rect(geoms[i], minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+                for i in members
+            ]
+            nonempty = [j for j, geom in enumerate(clipped) if not geom.is_empty]
+            if not nonempty:
+                continue
+            tile = encode_tile(
+                mvt, layer, [clipped[j] for j in nonempty], [records[members[j]] for j in nonempty],
+                (minx, miny, maxx, maxy)
+            )
+            to_file = tiles_path(layer)/str(zoom)/str(x)/f'{y}.mvt'
+            to_file.parent.mkdir(parents=True, exist_ok=True)
+            to_file.write_bytes(tile)
+            written += 1
+        print(f'TILES: {layer} z{zoom}: {written} tiles so far')
+    return written
+
+
+def tiles(layers=None):
+    """Build the tile pyramid of every TIGER layer with a `tiles` setting."""
+    counts = {}
+    for layer, subfolder in settings.etl.tiger.items():
+        config = subfolder.get('tiles')
+        if not config or (layers and layer not in layers):
+            continue
+        counts[layer] = build_tiles(layer, config.zooms, columns=config.get('columns'))
+    return counts
+
+
+def main():
+    tiles()
@@ -0,0 +1,174 @@
+"""Helpers for writing Hive-style partitions and the manifests that describe them."""
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from serverless import settings
+
+
+def partition_bounds(df, keys: List) -> Iterator[Tuple[tuple, int, int]]:
+    """
+    Yield `(values, start, stop)` for every run of equal `keys` in `df`.
+
+    `df` must already be sorted by `keys`; runs are found by comparing the
+    factorized key codes of neighbouring rows, so no Python-level groupby is
+    needed. With no keys the whole frame is a single run.
+    """
+    n = len(df)
+    if not n:
+        return
+    if not keys:
+        yield (), 0, n
+        return
+
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for key in keys:
+        codes = pd.factorize(df[key])[0]
+        change[1:] |= codes[1:] != codes[:-1]
+
+    starts = np.flatnonzero(change)
+    stops = np.append(starts[1:], n)
+    columns = [df[key].to_numpy() for key in keys]
+    for start, stop in zip(starts, stops):
+        yield tuple(col[start] for col in columns), int(start), int(stop)
+
+
+def iter_partitions(df, keys: List) -> Iterator[Tuple[tuple, object]]:
+    """Sort `df` once by `keys` and yield `(values, slice)` for every partition.
+
+    Rows with a missing key are dropped, like `groupby` does. Categorical
+    columns keep only the categories used in each slice, so a partition
+    file doesn't carry the dictionary of the whole frame.
+    """
+    if keys:
+        df = df.dropna(subset=keys).sort_values(keys, kind='mergesort')
+    categorical = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    for values, start, stop in partition_bounds(df, keys):
+        part = df.iloc[start:stop]
+        if categorical:
+            part = part.assign(**{c: part[c].cat.remove_unused_categories() for c in categorical})
+        yield values, part
+
+
+def partition_location(keys: List, values: tuple) -> str:
+    """Relative Hive directory for a partition, e.g. `statefp=01/countyfp=001`."""
+    return '/'.join(f'{k}={v}'.lower() for k, v in zip(keys, values))
+
+
+def manifest_path(processed_path, source: str) -> Path:
+    """Manifest file for the partitions one `source` file wrote under `processed_path`."""
+    layer = Path(processed_path).relative_to(settings.root_path/settings.data.processed_path)
+    return settings.root_path/settings.data.manifest_path/layer/f'{Path(source).stem}.json'
+
+
+def write_manifest(path, source: str, partition_by: List, partitions: List[Dict]):
+    """
+    Record which partitions a source file produced.
+
+    Each entry holds the partition values, the file path relative to the
+    project root, its row count and its size in bytes.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({
+            'source': str(source),
+            'partition_by': list(partition_by or []),
+            'partitions': partitions,
+        }, file, indent=1)
+
+
+def read_manifests(layer: str) -> List[Dict]:
+    """All partition entries written for a layer, e.g. `read_manifests('tiger/tract')`."""
+    entries = []
+    manifest_dir = settings.root_path/settings.data.manifest_path/layer
+    for path in sorted(manifest_dir.glob('*.json')):
+        with open(path) as file:
+            entries.extend(json.load(file)['partitions'])
+    return entries
+
+
+def partition_spec(partition_by: List, partition: Dict) -> str:
+    """`statefp = '01', countyfp = '001'` for one manifest entry.
+
+    Values are lowercased the same way `partition_location` writes them.
+    """
+    return ', '.join(f"{k.lower()} = '{str(partition[k]).lower()}'" for k in partition_by)
+
+
+def partition_s3_location(bucket: str, entry: Dict) -> str:
+    """S3 directory of a manifest entry, keyed the way `Pipeline.to_s3` uploads it."""
+    return f"s3://{bucket}/{str(Path(entry['path']).parent.as_posix()).lower()}/"
+
+
+def add_partition_statements(table: str, bucket: str, partition_by: List, entries: List[Dict],
+                             batch_size: int=100) -> List[Tuple[str, List[str]]]:
+    """
+    Batched `ALTER TABLE ... ADD IF NOT EXISTS PARTITION` statements.
+
+    Returns `(sql, locations)` pairs so the caller can record which
+    partitions a statement registered once it succeeds.
+    """
+    specs = {}
+    for entry in entries:
+        specs.setdefault(partition_s3_location(bucket, entry), partition_spec(partition_by, entry['partition']))
+
+    locations = sorted(specs)
+    statements = []
+    for i in range(0, len(locations), batch_size):
+        batch = locations[i:i + batch_size]
+        clauses = '\n'.join(f"  PARTITION ({specs[loc]}) LOCATION '{loc}'" for loc in batch)
+        statements.append((f"ALTER TABLE {table} ADD IF NOT EXISTS\n{clauses};", batch))
+    return statements
+
+
+def partition_projection_properties(location: str, partition_by: List, entries: List[Dict],
+                                    max_enum_partitions: int=1000) -> Dict[str, str]:
+    """
+    Athena partition-projection table properties for a layer.
+
+    Athena projects every combination of the keys' values, so keys are
+    enums of the values found in the manifests only while the product of
+    the enum sizes stays within `max_enum_partitions`. Keys past that (e.g.
+    county and tract codes under a state) are `injected`: queries must
+    filter them with equality, which every named query does. Queries need
+    no partition registration at all.
+    """
+    properties = {'projection.enabled': 'true'}
+    template = location.rstrip('/')
+    combinations = 1
+    for key in partition_by:
+        values = sorted({str(e['partition'][key]).lower() for e in entries})
+        if combinations * len(values) <= max_enum_partitions:
+            combinations *= len(values)
+            properties[f'projection.{key.lower()}.type'] = 'enum'
+            properties[f'projection.{key.lower()}.values'] = ','.join(values)
+        else:
+            properties[f'projection.{key.lower()}.type'] = 'injected'
+        template += f'/{key.lower()}=${{{key.lower()}}}'
+    properties['storage.location.template'] = template + '/'
+    return properties
+
+
+def registered_partitions_path() -> Path:
+    return settings.root_path/settings.data.manifest_path/'athena_partitions.json'
+
+
+def load_registered_partitions() -> Dict[str, List[str]]:
+    """S3 locations already registered per table by earlier runs."""
+    path = registered_partitions_path()
+    if not path.is_file():
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_registered_partitions(registered: Dict[str, List[str]]):
+    path = registered_partitions_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({k: sorted(v) for k, v in registered.items()}, file, indent=1)
@@ -4,18 +4,30 @@ import re
 import json
 import shutil
 import time
-from typing import List, Dict, Callable, Set
+from functools import partial
+from typing import List, Dict, Callable, Optional, Set
 
-import numpy as np
 import pandas as pd
-import geopandas as gpd
 import boto3
+from botocore.config import Config
 import requests
 
-from serverless import settings
+from serverless import settings, tracing
+from serverless.pipeline.sync import sync_to_s3
+from serverless.pipeline.transfer import upload_files, transfer_config
+from serverless.pipeline.athena import AthenaScheduler, statement, print_results
+from serverless.pipeline.schema import table_schema, table_matches, create_table_sql
+from serverless.lambda_app.app.named_queries import NAMED_QUERIES, statement_name, check_partition_pruning
+from serverless.pipeline.partitions import (
+    read_manifests, add_partition_statements, partition_projection_properties,
+    partition_s3_location, load_registered_partitions, save_registered_partitions
+)
 
 
 s3 = boto3.resource('s3')
+s3_client = boto3.client(
+    's3', config=Config(max_pool_connections=settings.s3.max_workers * settings.s3.max_concurrency)
+)
 ath = boto3.client('athena')
 lambda_client = boto3.client('lambda')
 api_client = boto3.client('apigateway')
@@ -33,6 +45,10 @@ def isdir_s3(bucket, key: str) -> bool:
     return len(objs) > 1
 
 
+# step numbers `run_pipeline(skip=[...])` used to take
+RUN_PIPELINE_STEP_NUMBERS = {1: 'to_s3', 2: 'athena_model', 3: 'lambda', 4: 'api'}
+
+
 def sql_create_from_dataframe(df, name):
     sql_text = pd.io.sql.get_schema(df, name)\
                     .replace('TABLE', 'EXTERNAL TABLE')\
@@ -62,31 +78,80 @@ class Pipeline(object):
     def __init__(self, filepaths: Set, partitions: List=None):
 
         processed_dir_loc = filepaths
-        self.processed_files = (
+
+    @property
+    def processed_files(self):
+        """Fresh generator over every file in the processed tree."""
+        return (
             i for i in (
                 settings.root_path/settings.data.processed_path
             ).rglob('*[!.].*') if i.is_file()
         )
 
-
+    @tracing.traced()
     def to_s3(self, partitions: List=None,
               dtypes: Dict=None,
               build_athena_model: bool=True,
               path: str='.*/.*',
-              file_type: str='to_csv', **kwargs) -> str:
-
-        s3.create_bucket(Bucket=self.BUCKET_NAME)
-
+              file_type: str='to_csv',
+              dry_run: bool=False,
+              delete: bool=False, **kwargs) -> Dict:
+        """
+        Sync the processed tree to S3, uploading only new or changed files.
+
+        The bucket prefix is listed once and compared with a local manifest
+        of hashes (see `serverless.pipeline.sync`). `dry_run` returns the
+        plan without uploading; `delete` also removes keys under the prefix
+        that no longer exist locally. `path` is a regex matched against each
+        file's S3 key (e.g. `data/processed/tiger/county/...`) and limits
+        both the upload and `delete`. Uploads run concurrently; pass
+        `max_workers` and a `transfer_config` dict to override `settings.s3`.
+        Raises if any upload fails, after recording the ones that succeeded.
+        """
+        if not dry_run:
+            s3.create_bucket(Bucket=self.BUCKET_NAME)
+
+        files = {}
         for file in self.processed_files:
-            file_str = str(file).lower()
-            key = file_str.replace(str(settings.root_path).lower(), '').strip('/')
-            if re.search(path, file_str):
-                if not isfile_s3(self.BUCKET, key):
-                    s3.Bucket(self.BUCKET_NAME).upload_file(file_str, key)
+            key = str(file).lower().replace(str(settings.root_path).lower(), '').strip('/')
+            if re.search(path, key):
+                files[key] = file
+
+        prefix = str(settings.data.processed_path).lower().strip('/') + '/'
+        upload = partial(
+            upload_files,
+            max_workers=kwargs.get('max_workers'),
+            config=transfer_config(**kwargs.get('transfer_config', {}))
+        )
+        return sync_to_s3(
+            s3_client, self.BUCKET_NAME, files, prefix, upload=upload,
+            delete=delete, dry_run=dry_run, path=path
+        )
+
+    def upload_artifacts(self, local_dir: str=None, prefix: str='lookup', delete: bool=False,
+                         **kwargs) -> Dict:
+        """
+        Sync precomputed serving artifacts (lookup tables, indexes, tiles)
+        that the Lambda loads directly from `s3://<bucket>/<prefix>/`.
+
+        Only new or changed files are uploaded; `delete` also removes keys
+        under the prefix that no longer exist locally (e.g. stale tiles).
+        """
+        local_dir = Path(local_dir or settings.root_path/settings.data.lookup_path)
+        files = {
+            f"{prefix}/{file.relative_to(local_dir).as_posix()}": file
+            for file in sorted(local_dir.rglob('*')) if file.is_file()
+        }
+        upload = partial(upload_files, max_workers=kwargs.get('max_workers'))
+        return sync_to_s3(s3_client, self.BUCKET_NAME, files, f'{prefix}/', upload=upload, delete=delete)
 
     def _get_dirs(self):
         self._dirs = {}
+        processed_path = settings.root_path/settings.data.processed_path
         for file in self.processed_files:
+            # hidden from Athena as well, e.g. the simplified geometries for tiles
+            if any(part.startswith(('_', '.')) for part in file.relative_to(processed_path).parts[:-1]):
+                continue
             file_str = str(file)
             file_path = file_str.split('/')
             path = '/'.join([f for f in file_path[:-1] if '=' not in f])
@@ -101,17 +166,36 @@ class Pipeline(object):
         else:
             return self._get_dirs()
 
+    @tracing.traced()
     def build_athena_model(self, **kwargs) -> Dict:
+        """
+        Create the Athena database, one table per processed layer and the
+        partitions of partitioned tables.
+
+        Statements run through `AthenaScheduler`: the database first, then all
+        tables concurrently, then each table's partition registration once
+        that table exists. Returns the per-statement results.
+
+        How partitions are registered is set per layer by
+        `partition_registration` (default `settings.athena`):
+        `manifest` adds only partitions from the local partition manifests
+        that weren't registered by an earlier run, `projection` writes
+        partition-projection table properties so nothing needs registering,
+        and `msck` (or a layer without manifests) runs MSCK REPAIR TABLE.
+        A table whose definition changed is dropped and created again, and
+        its partitions are registered again; pass
+        `reregister_partitions=True` after recreating tables by hand.
+        """
 
         path = kwargs.get('path', '.*/.*')
 
         self._get_dirs()
-        query_details = {}
 
-        ath.start_query_execution(
-            QueryString=f"CREATE DATABASE IF NOT EXISTS {self.BUCKET_NAME}",
-            ResultConfiguration={'OutputLocation': f's3://{self.BUCKET_NAME}/database/queries'}
-        )
+        statements = [
+            statement('database', f"CREATE DATABASE IF NOT EXISTS {self.BUCKET_NAME}")
+        ]
+        registered = load_registered_partitions()
+        partition_batches = {}
 
         for parent, file in self._dirs.items():
 
@@ -123,76 +207,192 @@ class Pipeline(object):
                 table_suffix = "_".join(s3_path.split('/')[2:]) # document hard coded value, put in _settings.py
                 table_name = f"{self.BUCKET_NAME}." + table_suffix
 
+                layer = settings.etl.get(folder).get(subfolder)
+
+                location = f's3://{self.BUCKET_NAME}/{s3_path}/'
+                partition_by = layer.partition_by
+                registration = layer.get('partition_registration', settings.athena.partition_registration)
+                entries = read_manifests(f'{folder}/{subfolder}') if partition_by else []
+
+                # column names and types come from the file's metadata (Parquet
+                # footer or Esri JSON header), cached under settings.data.db_schema_dir
+                columns = table_schema(table_name, file)
+
                 if '.geojson' in file:
-                    df = gpd.read_file(file)
                     metadata = f"""ROW FORMAT SERDE 'com.esri.hadoop.hive.serde.JsonSerde'
                                     STORED AS INPUTFORMAT 'com.esri.json.hadoop.EnclosedJsonInputFormat'
                                     OUTPUTFORMAT 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat'
-                                    LOCATION 's3://{self.BUCKET_NAME}/{s3_path}/';"""
+                                    LOCATION '{location}'"""
+                    tblproperties = {}
                 else:
-                    df = pd.read_parquet(file)
+                    # GeoParquet layers keep WKB bytes in `geometry`, a BINARY column
                     metadata = f"""STORED AS PARQUET
-                                    LOCATION 's3://{self.BUCKET_NAME}/{s3_path}/'
-                                    tblproperties ("parquet.compression"="SNAPPY");"""
-
-                partition_by = settings.etl.get(folder).get(subfolder).partition_by
-                if partition_by:
-                    partition_statement = f"{' '.join([i + ' STRING,' for i in partition_by]).rstrip(',')}"
-                    metadata = f" PARTITIONED BY ({partition_statement})\n {metadata}"
-                    sql_text = sql_create_from_dataframe(df, table_name) + metadata
-                    for p in partition_by:
-                        sql_text = re.sub(p + ' STRING', '', sql_text, count=1)
-                    sql_text = re.sub('\s,', '', sql_text)
-
-                else:
-                    sql_text = sql_create_from_dataframe(df, table_name) + metadata
-
-                ###### remove illegal athena chars: <
-                sql_text = sql_text.replace('<', '_lt_') # replace with _lt_ for `less than`
+                                    LOCATION '{location}'"""
+                    tblproperties = {'parquet.compression': layer.get('compression', 'snappy').upper()}
+
+                if registration == 'projection' and entries:
+                    tblproperties.update(partition_projection_properties(
+                        location, partition_by, entries,
+                        max_enum_partitions=settings.athena.projection_max_enum_partitions
+                    ))
+                if tblproperties:
+                    properties = ', '.join(f'"{k}"="{v}"' for k, v in tblproperties.items())
+                    metadata = f"""{metadata}
+                                    tblproperties ({properties})"""
+                metadata += ';'
+
+                # IF NOT EXISTS: reruns keep an unchanged table so only new
+                # partitions get added; a table whose columns, partition keys
+                # or properties changed is dropped (the data stays in S3) and
+                # created again with all of its partitions
+                sql_text = create_table_sql(table_name, columns, partition_by) + '\n' + metadata
+                existing = self.table_metadata(table_name)
+                recreate = existing is not None and not table_matches(existing, columns, partition_by, tblproperties)
 
                 print(sql_text)
                 (settings.root_path/settings.data.DB_TABLE_DEFINITIONS).mkdir(parents=True, exist_ok=True)
                 with open((settings.root_path/settings.data.DB_TABLE_DEFINITIONS)/table_name, 'w') as file_obj:
                     file_obj.write(sql_text)
 
-                query = ath.start_query_execution(
-                    QueryString=sql_text,
-                    ResultConfiguration={'OutputLocation': f's3://{self.BUCKET_NAME}/database/queries'}
-                )
-                query_details[table_name] = query
-
-                time.sleep(5)
-
-                if partition_by:
-                    ath.start_query_execution(
-                        QueryString=f"MSCK REPAIR TABLE `{table_name}`;",
-                        ResultConfiguration={'OutputLocation': f's3://{self.BUCKET_NAME}/database/queries'}
+                if recreate:
+                    statements.append(statement(
+                        f'{table_name}:drop', f'DROP TABLE IF EXISTS {table_name};', depends_on=['database']
+                    ))
+                statements.append(statement(
+                    table_name, sql_text, depends_on=[f'{table_name}:drop' if recreate else 'database']
+                ))
+
+                if not partition_by or (registration == 'projection' and entries):
+                    continue
+
+                if registration == 'manifest' and entries:
+                    fresh_table = existing is None or recreate or kwargs.get('reregister_partitions')
+                    known = set() if fresh_table else set(registered.get(table_name, []))
+                    new_entries = [e for e in entries if partition_s3_location(self.BUCKET_NAME, e) not in known]
+                    batches = add_partition_statements(
+                        table_name, self.BUCKET_NAME, partition_by, new_entries,
+                        batch_size=settings.athena.partition_batch_size
                     )
+                    for i, (sql, locations) in enumerate(batches):
+                        name = f'{table_name}:partitions:{i}'
+                        statements.append(statement(name, sql, depends_on=[table_name]))
+                        partition_batches[name] = (table_name, locations)
+                else:
+                    statements.append(statement(
+                        f'{table_name}:partitions',
+                        f"MSCK REPAIR TABLE `{table_name}`;",
+                        depends_on=[table_name]
+                    ))
+
+        scheduler = AthenaScheduler(ath, f's3://{self.BUCKET_NAME}/database/queries')
+        results = scheduler.run(statements)
+        print_results(results)
+        tracing.count('statements', len(results))
+
+        for name, (table_name, locations) in partition_batches.items():
+            if results[name]['state'] == 'SUCCEEDED':
+                registered[table_name] = sorted(set(registered.get(table_name, [])) | set(locations))
+        if partition_batches:
+            save_registered_partitions(registered)
+
+        return results
+
+    def table_metadata(self, table_name: str) -> Optional[Dict]:
+        """Catalog metadata of `<database>.<table>`, or None if it doesn't exist yet."""
+        database, table = table_name.split('.', 1)
+        try:
+            return ath.get_table_metadata(
+                CatalogName='AwsDataCatalog', DatabaseName=database, TableName=table
+            )['TableMetadata']
+        except (ath.exceptions.MetadataException, ath.exceptions.InvalidRequestException):
+            return None
+
+    def create_workgroup(self, **kwargs) -> Dict:
+        """
+        Create (or update) the Athena work group the API queries run in.
+
+        The work group enforces its result location and cancels any query
+        that scans more than `settings.athena.bytes_scanned_cutoff` bytes.
+        """
+        name = settings.athena.work_group
+        configuration = {
+            'ResultConfiguration': {'OutputLocation': f's3://{self.BUCKET_NAME}/database/queries'},
+            'EnforceWorkGroupConfiguration': True,
+            'PublishCloudWatchMetricsEnabled': True,
+            'BytesScannedCutoffPerQuery': settings.athena.bytes_scanned_cutoff,
+        }
+        try:
+            return ath.create_work_group(Name=name, Configuration=configuration)
+        except ath.exceptions.InvalidRequestException:
+            return ath.update_work_group(
+                WorkGroup=name,
+                ConfigurationUpdates={
+                    'ResultConfigurationUpdates': configuration['ResultConfiguration'],
+                    'EnforceWorkGroupConfiguration': True,
+                    'PublishCloudWatchMetricsEnabled': True,
+                    'BytesScannedCutoffPerQuery': settings.athena.bytes_scanned_cutoff,
+                }
+            )
 
+    def create_prepared_statements(self, **kwargs) -> Dict:
+        """
+        Deploy every query in `named_queries.NAMED_QUERIES` as a prepared
+        statement in the API work group, after checking that each one
+        filters on all partition columns of its table.
+        """
+        work_group = settings.athena.work_group
+        responses = {}
+        for name, query in NAMED_QUERIES.items():
+            folder, subfolder = query['layer']
+            check_partition_pruning(name, settings.etl.get(folder).get(subfolder).partition_by)
+            statement_kwargs = {
+                'StatementName': statement_name(name),
+                'WorkGroup': work_group,
+                'QueryStatement': query['sql'],
+                'Description': name,
+            }
+            try:
+                responses[name] = ath.create_prepared_statement(**statement_kwargs)
+            except ath.exceptions.InvalidRequestException:
+                responses[name] = ath.update_prepared_statement(**statement_kwargs)
+        return responses
 
     def create_lambda(self, file:str, name:str, **kwargs) -> Dict:
+        """
+        Create the Lambda from its container image, or point the existing
+        function at `image_uri`, and wait until it can be invoked.
+        """
         image_uri = kwargs.get('image_uri')
         if not image_uri:
-            raise ValeError('must provide an ImageUri')
+            raise ValueError('must provide an ImageUri')
         # destination = make_archive(file)
         # print(destination)
         # s3.Bucket(self.BUCKET_NAME).upload_file(str(destination), self.LAMBDA_LOC)
-        response = lambda_client.create_function(
-            Code={
-                # 'S3Bucket': self.BUCKET_NAME,
-                # 'S3Key': self.LAMBDA_LOC,
-                'ImageUri': image_uri
-            },
-            Description='serverlessprez',
-            FunctionName=self.LAMBDA_NAME,
-            # Handler='lambda.lambda_handler',
-            Publish=True,
-            Role='arn:aws:iam::639381120660:role/serverlessprez',
-            # Runtime='python3.8',
-            Timeout=60,
-            MemorySize=512,
-            PackageType='Image',
-        )
+        try:
+            response = lambda_client.create_function(
+                Code={
+                    # 'S3Bucket': self.BUCKET_NAME,
+                    # 'S3Key': self.LAMBDA_LOC,
+                    'ImageUri': image_uri
+                },
+                Description='serverlessprez',
+                FunctionName=self.LAMBDA_NAME,
+                # Handler='lambda.lambda_handler',
+                Publish=True,
+                Role='arn:aws:iam::639381120660:role/serverlessprez',
+                # Runtime='python3.8',
+                Timeout=60,
+                MemorySize=512,
+                PackageType='Image',
+            )
+            lambda_client.get_waiter('function_active_v2').wait(FunctionName=self.LAMBDA_NAME)
+        except lambda_client.exceptions.ResourceConflictException:
+            response = lambda_client.update_function_code(
+                FunctionName=self.LAMBDA_NAME,
+                ImageUri=image_uri,
+                Publish=True,
+            )
+            lambda_client.get_waiter('function_updated_v2').wait(FunctionName=self.LAMBDA_NAME)
         return response
 
 
@@ -215,11 +415,31 @@ class Pipeline(object):
         return response
 
 
-    def create_api(self, name:str, method: str='GET', integration: str='AWS_PROXY', stage: str=None, **kwargs) -> Dict:
+    def find_rest_api(self, name: str) -> Optional[Dict]:
+        """The REST API called `name`, or None."""
+        for page in api_client.get_paginator('get_rest_apis').paginate():
+            for rest_api in page['items']:
+                if rest_api['name'] == name:
+                    return rest_api
+        return None
+
+    def create_api(self, name:str, method: str='ANY', integration: str='AWS_PROXY', stage: str=None, **kwargs) -> Dict:
+        """
+        Create the REST API proxying to the Lambda, or reuse the one called
+        `name`: its integration invokes the function by name, so a new
+        Lambda image needs no API changes.
+        """
+        existing = self.find_rest_api(name)
+        if existing:
+            self.rest_api_id = existing['id']
+            return existing
 
         # Create rest api
+        # binary media types let the Lambda return base64 Arrow/Parquet and
+        # gzip/br compressed bodies, which API Gateway decodes for the client
         rest_api = api_client.create_rest_api(
-            name=name
+            name=name,
+            binaryMediaTypes=['*/*']
         )
 
         self.rest_api_id = rest_api["id"]
@@ -229,58 +449,65 @@ class Pipeline(object):
             restApiId=self.rest_api_id
         )['items'][0]['id']
 
-        # Create an api resource
+        # Create an api resource, plus a greedy {proxy+} child so paths like
+        # /serverlessprez/tiles/<layer>/<z>/<x>/<y>.mvt reach the Lambda too
         api_resource = api_client.create_resource(
             restApiId=self.rest_api_id,
             parentId=root_resource_id,
             pathPart=self.ENTRY_POINT
         )
 
-        api_resource_id = api_resource['id']
-
-        # Add a post method to the rest api resource
-        api_method = api_client.put_method(
-            restApiId=self.rest_api_id,
-            resourceId=api_resource_id,
-            httpMethod=method,
-            authorizationType='NONE',
-            # requestParameters={
-            #   'method.request.querystring.serverlessprez': False
-            # }
-        )
-
-        print(api_method)
-
-        put_method_res = api_client.put_method_response(
+        proxy_resource = api_client.create_resource(
             restApiId=self.rest_api_id,
-            resourceId=api_resource_id,
-            httpMethod=method,
-            statusCode='200'
+            parentId=api_resource['id'],
+            pathPart='{proxy+}'
         )
 
         # The uri comes from a base lambda string with the function ARN attached to it
         arn_uri = f"arn:aws:apigateway:us-east-1:lambda:path/2015-03-31/functions/arn:aws:lambda:us-east-1:639381120660:function:{self.LAMBDA_NAME}/invocations"
 
-        put_integration = api_client.put_integration(
-            restApiId=self.rest_api_id,
-            resourceId=api_resource_id,
-            httpMethod=method,
-            type=integration,
-            integrationHttpMethod='POST',
-            uri=arn_uri,
-            credentials='arn:aws:iam::639381120660:role/serverlessprez',
-            requestTemplates={
-                "application/json":"{\"serverlessprez\":\"$input.params('serverlessprez')\"}"
-            }
-        )
+        for api_resource_id in (api_resource['id'], proxy_resource['id']):
+
+            # Add the method to the rest api resource
+            api_method = api_client.put_method(
+                restApiId=self.rest_api_id,
+                resourceId=api_resource_id,
+                httpMethod=method,
+                authorizationType='NONE',
+                # requestParameters={
+                #   'method.request.querystring.serverlessprez': False
+                # }
+            )
 
-        put_integration_response = api_client.put_integration_response(
-            restApiId=self.rest_api_id,
-            resourceId=api_resource_id,
-            httpMethod=method,
-            statusCode='200',
-            selectionPattern=''
-        )
+            print(api_method)
+
+            put_method_res = api_client.put_method_response(
+                restApiId=self.rest_api_id,
+                resourceId=api_resource_id,
+                httpMethod=method,
+                statusCode='200'
+            )
+
+            put_integration = api_client.put_integration(
+                restApiId=self.rest_api_id,
+                resourceId=api_resource_id,
+                httpMethod=method,
+                type=integration,
+                integrationHttpMethod='POST',
+                uri=arn_uri,
+                credentials='arn:aws:iam::639381120660:role/serverlessprez',
+                requestTemplates={
+                    "application/json":"{\"serverlessprez\":\"$input.params('serverlessprez')\"}"
+                }
+            )
+
+            put_integration_response = api_client.put_integration_response(
+                restApiId=self.rest_api_id,
+                resourceId=api_resource_id,
+                httpMethod=method,
+                statusCode='200',
+                selectionPattern=''
+            )
 
         # this bit sets a stage 'dev' that is built off the created apigateway
         # it will look something like this:
@@ -304,57 +531,114 @@ class Pipeline(object):
             )
 
 
-    def _test_api_endpoint(self, **kwargs):
-        url = f"https://{self.rest_api_id}.execute-api.us-east-1.amazonaws.com/{self.STAGE_NAME}/{self.ENTRY_POINT}"
+    def _test_api_endpoint(self, rest_api_id: str=None, attempts: int=None, delay: float=None, **kwargs):
+        """
+        GET the deployed endpoint until it answers 200, backing off between
+        attempts while the new deployment propagates.
+        """
+        rest_api_id = rest_api_id or self.rest_api_id
+        attempts = attempts or settings.pipeline.api_check_attempts
+        delay = delay or settings.pipeline.api_check_delay
+        url = f"https://{rest_api_id}.execute-api.us-east-1.amazonaws.com/{self.STAGE_NAME}/{self.ENTRY_POINT}"
         self.api_url = url
-        resp = requests.get(url)
+        for attempt in range(attempts):
+            resp = requests.get(url)
+            if resp.status_code == 200:
+                return resp.json()
+            print(f'API: {url} returned {resp.status_code}, retrying in {delay:.1f}s')
+            time.sleep(delay)
+            delay *= 2
+        resp.raise_for_status()
         return resp.json()
 
 
     @staticmethod
-    def run_pipeline(skip:list=[], **kwargs):
-
-        paths = Path('../data/processed/')
-        pipeline = Pipeline(paths)
-
-        steps = {
-            1: {
-                'func': pipeline.to_s3,
-                'args': {**kwargs}
-            },
-            2: {
-                'func': pipeline.build_athena_model,
-                'args': {
-                    'target_data': target_data,
-                    **kwargs
-                }
-            },
-            3: {
-                'func': pipeline.create_lambda,
-                'args': {
-                    'file': '../lambda_app/app/lambda.py',
-                    'name': pipeline.LAMBDA_NAME,
-                    **kwargs
-                }
-            },
-            4: {
-                'func': pipeline.create_api,
-                'args': {
-                    'name': pipeline.LAMBDA_NAME,
-                    **kwargs
-                }
-            }
-        }
-
-        for step, call in steps.items():
-            if step in skip:
-                continue
-            call['func'](**call['args'])
-
-        time.sleep(10)
-
-        if 4 not in skip:
-            test = pipeline._test_api_endpoint()
-            return test
+    def run_pipeline(skip: list=[], force: list=[], max_workers: int=None, **kwargs):
+        """
+        Run the ETLs and deploy the data, Athena model, Lambda and API as a
+        graph of steps (see `serverless.pipeline.dag`).
+
+        Steps whose inputs and settings haven't changed since their last
+        successful run are not run again; list them in `force` to rerun.
+        `skip` takes step names, or the old step numbers 1-4 (to_s3,
+        athena_model, lambda, api). Raises RuntimeError naming the failed
+        and blocked steps if any step didn't succeed.
+        """
+        from serverless.pipeline.dag import StepRunner, step, print_step_results
+        from serverless.pipeline.data import census_population, census_businesspatterns, tiger, lookups
+
+        root = settings.root_path
+        processed = root/settings.data.processed_path
+        census, etl_tiger = settings.etl.census, settings.etl.tiger
+        pipeline = Pipeline(processed)
+        runner = StepRunner(max_workers=max_workers)
+        skip = [RUN_PIPELINE_STEP_NUMBERS.get(s, s) for s in skip]
+        if 'api' in skip:
+            skip.append('test_api')
+
+        def athena_model(**kwargs):
+            results = pipeline.build_athena_model(**kwargs)
+            failed = [name for name, r in results.items() if r['state'] != 'SUCCEEDED']
+            if failed:
+                raise RuntimeError(f'athena statements did not succeed: {failed}')
+
+        def api(**kwargs):
+            pipeline.create_api(**kwargs)
+            return {'rest_api_id': pipeline.rest_api_id}
+
+        def test_api(**kwargs):
+            return pipeline._test_api_endpoint(rest_api_id=runner.results['api']['result']['rest_api_id'], **kwargs)
+
+        etls = ['census_population', 'census_businesspatterns', 'tiger']
+        uploads = ['upload_lookups', 'upload_spatial', 'upload_tiles']
+        steps = [
+            step('census_population', census_population.main, params=census.population,
+                 inputs=[root/settings.data.raw_path/census.population.raw_file],
+                 outputs=[processed/census.population.processed_file]),
+            step('census_businesspatterns', census_businesspatterns.main, params=census.businesspatterns,
+                 inputs=[root/settings.data.raw_path/census.businesspatterns.raw_file],
+                 outputs=[processed/census.businesspatterns.processed_file]),
+            step('tiger', tiger.main, params=etl_tiger,
+                 inputs=[root/settings.data.raw_path/etl_tiger[layer].file_path/file
+                         for layer in etl_tiger for file in etl_tiger[layer].files],
+                 outputs=[processed/etl_tiger[layer].file_path for layer in etl_tiger]),
+            step('lookups', lookups.main, depends_on=etls, inputs=[processed],
+                 outputs=[root/settings.data.lookup_path]),
+            step('upload_lookups', pipeline.upload_artifacts, depends_on=['lookups'],
+                 inputs=[root/settings.data.lookup_path],
+                 kwargs={'local_dir': root/settings.data.lookup_path, 'prefix': 'lookup', **kwargs}),
+            step('upload_spatial', pipeline.upload_artifacts, depends_on=['tiger'],
+                 inputs=[root/settings.data.spatial_path],
+                 kwargs={'local_dir': root/settings.data.spatial_path, 'prefix': 'spatial', **kwargs}),
+            step('upload_tiles', pipeline.upload_artifacts, depends_on=['tiger'],
+                 inputs=[root/settings.data.tiles_path],
+                 kwargs={'local_dir': root/settings.data.tiles_path, 'prefix': 'tiles', 'delete': True, **kwargs}),
+            # to_s3 publishes the new dataset version, so serving artifacts go up first
+            step('to_s3', pipeline.to_s3, depends_on=etls + uploads, inputs=[processed], kwargs=kwargs),
+            step('athena_model', athena_model, depends_on=['to_s3'], inputs=[processed],
+                 params=settings.athena, kwargs=kwargs),
+            step('workgroup', pipeline.create_workgroup, params=settings.athena, kwargs=kwargs),
+            step('prepared_statements', pipeline.create_prepared_statements,
+                 depends_on=['athena_model', 'workgroup'],
+                 inputs=[Path(__file__).parent.parent/'lambda_app'/'app'/'named_queries.py'], kwargs=kwargs),
+            step('lambda', pipeline.create_lambda, depends_on=['prepared_statements'],
+                 kwargs={'file': '../lambda_app/app/lambda.py', 'name': pipeline.LAMBDA_NAME, **kwargs}),
+            step('api', api, depends_on=['lambda'], keep_result=True,
+                 kwargs={'name': pipeline.LAMBDA_NAME, **kwargs}),
+            step('test_api', test_api, depends_on=['api'], cache=False),
+        ]
+
+        results = runner.run(steps, skip=skip, force=force)
+        print_step_results(results)
+        if tracing.enabled():
+            tracing.report()
+
+        failed = [f"{name} {r['status']}: {r['error']}" for name, r in results.items()
+                  if r['status'] in ('failed', 'blocked')]
+        if failed:
+            raise RuntimeError(f'{len(failed)} pipeline steps did not succeed: ' + '; '.join(failed))
+
+        if results['test_api']['status'] == 'ok':
+            return results['test_api']['result']
 
         return 200
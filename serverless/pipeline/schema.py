@@ -0,0 +1,243 @@
+"""
+Table schemas for the Athena DDL, read from file metadata only.
+
+Parquet schemas come from the file footer (`pyarrow.parquet.read_schema`),
+Esri EnclosedJson schemas from the header's `fields` types or, without
+them, the attributes of the first features, so no data pages are decoded.
+Schemas are cached as JSON under `settings.data.db_schema_dir` keyed by the
+sample file's path, size and mtime, so regenerating the catalog only
+touches files that changed.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from serverless import settings
+
+
+READ_SIZE = 64 * 1024
+# features sampled to type Esri attributes when the header has no `fields`
+ESRI_SAMPLE_FEATURES = 100
+# bump when inference changes, so cached schemas are inferred again
+SCHEMA_CACHE_VERSION = 2
+
+# the Esri JsonSerde exposes the feature geometry as a binary column
+ESRI_GEOMETRY_COLUMN = ('geometry', 'BINARY')
+
+ESRI_ATTRIBUTE_TYPES = {
+    bool: 'BOOLEAN',
+    int: 'BIGINT',
+    float: 'DOUBLE',
+    str: 'STRING',
+}
+
+ESRI_FIELD_TYPES = {
+    'esriFieldTypeOID': 'BIGINT',
+    'esriFieldTypeSmallInteger': 'SMALLINT',
+    'esriFieldTypeInteger': 'INT',
+    'esriFieldTypeBigInteger': 'BIGINT',
+    'esriFieldTypeSingle': 'FLOAT',
+    'esriFieldTypeDouble': 'DOUBLE',
+    # epoch milliseconds
+    'esriFieldTypeDate': 'BIGINT',
+}
+
+
+def athena_type(arrow_type) -> str:
+    """Athena (Hive DDL) type of a pyarrow type."""
+    import pyarrow.types as t
+
+    if t.is_dictionary(arrow_type):
+        return athena_type(arrow_type.value_type)
+    if t.is_boolean(arrow_type):
+        return 'BOOLEAN'
+    if t.is_int8(arrow_type):
+        return 'TINYINT'
+    if t.is_int16(arrow_type) or t.is_uint8(arrow_type):
+        return 'SMALLINT'
+    if t.is_int32(arrow_type) or t.is_uint16(arrow_type):
+        return 'INT'
+    if t.is_int64(arrow_type) or t.is_uint32(arrow_type):
+        return 'BIGINT'
+    if t.is_uint64(arrow_type):
+        return 'DECIMAL(20,0)'
+    if t.is_float16(arrow_type) or t.is_float32(arrow_type):
+        return 'FLOAT'
+    if t.is_float64(arrow_type):
+        return 'DOUBLE'
+    if t.is_decimal(arrow_type):
+        return f'DECIMAL({arrow_type.precision},{arrow_type.scale})'
+    if t.is_date(arrow_type):
+        return 'DATE'
+    if t.is_timestamp(arrow_type):
+        return 'TIMESTAMP'
+    if t.is_binary(arrow_type) or t.is_large_binary(arrow_type) or t.is_fixed_size_binary(arrow_type):
+        return 'BINARY'
+    if t.is_list(arrow_type) or t.is_large_list(arrow_type) or t.is_fixed_size_list(arrow_type):
+        return f'ARRAY<{athena_type(arrow_type.value_type)}>'
+    if t.is_map(arrow_type):
+        return f'MAP<{athena_type(arrow_type.key_type)},{athena_type(arrow_type.item_type)}>'
+    if t.is_struct(arrow_type):
+        fields = ','.join(f'{f.name}:{athena_type(f.type)}' for f in arrow_type)
+        return f'STRUCT<{fields}>'
+    # strings, times, nulls and anything else Athena can't read natively
+    return 'STRING'
+
+
+def parquet_columns(path) -> List[Tuple[str, str]]:
+    """`(name, athena_type)` for every column in a Parquet file's footer."""
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    return [
+        (field.name, athena_type(field.type))
+        for field in schema if not field.name.startswith('__index_level_')
+    ]
+
+
+def _read_esri_head(path, features=1):
+    """The header dict and the first `features` features of an EnclosedJson file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    with open(path) as file:
+
+        def more():
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise ValueError(f'{path}: unexpected end of Esri JSON')
+            return chunk
+
+        # everything up to the features array is a small JSON object once closed
+        while '"features": [' not in buffer:
+            try:
+                buffer += more()
+            except ValueError:
+                # no features at all: the whole (small) file is the header
+                return json.loads(buffer), []
+        head, _, buffer = buffer.partition('"features": [')
+        header = json.loads(head.rstrip().rstrip(',') + '}')
+
+        found = []
+        while len(found) < features:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                break
+            try:
+                feature, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                try:
+                    buffer += more()
+                except ValueError:
+                    break
+                continue
+            found.append(feature)
+            buffer = buffer[end:]
+    return header, found
+
+
+def _sampled_type(values) -> str:
+    """Athena type that holds every non-null sampled value: ints and floats widen to DOUBLE."""
+    types = {ESRI_ATTRIBUTE_TYPES.get(type(v), 'STRING') for v in values if v is not None}
+    if types == {'BIGINT', 'DOUBLE'}:
+        return 'DOUBLE'
+    return types.pop() if len(types) == 1 else 'STRING'
+
+
+def esri_json_columns(path, features=ESRI_SAMPLE_FEATURES) -> List[Tuple[str, str]]:
+    """
+    `(name, athena_type)` of an Esri EnclosedJson file's attributes, plus
+    the binary geometry column.
+
+    The header's `fields` types are used when it declares them; otherwise
+    the first `features` features are sampled, a column holding both ints
+    and floats is DOUBLE, and one that is null in every sampled feature or
+    mixes other types is STRING.
+    """
+    header = _read_esri_head(path, 0)[0]
+    declared = {f['name']: f.get('type') for f in header.get('fields', [])}
+    names = list(header.get('fieldAliases', {})) or list(declared)
+    if names and all(declared.get(name) for name in names):
+        columns = [(name, ESRI_FIELD_TYPES.get(declared[name], 'STRING')) for name in names]
+    else:
+        found = _read_esri_head(path, features)[1]
+        columns = [(name, _sampled_type(f['attributes'].get(name) for f in found)) for name in names]
+    return columns + [ESRI_GEOMETRY_COLUMN]
+
+
+def infer_columns(path) -> List[Tuple[str, str]]:
+    """Columns of a Parquet or Esri JSON file, from its metadata."""
+    if str(path).endswith('.parquet'):
+        return parquet_columns(path)
+    return esri_json_columns(path)
+
+
+def schema_cache_path(table_name: str) -> Path:
+    return settings.root_path/settings.data.db_schema_dir/f'{table_name}.json'
+
+
+def table_schema(table_name: str, sample_file) -> List[Tuple[str, str]]:
+    """
+    Columns of `table_name` inferred from `sample_file`, through the schema cache.
+    """
+    stat = os.stat(sample_file)
+    key = {'file': str(sample_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+           'version': SCHEMA_CACHE_VERSION}
+    cache_path = schema_cache_path(table_name)
+    if cache_path.is_file():
+        with open(cache_path) as file:
+            cached = json.load(file)
+        if cached.get('key') == key:
+            return [tuple(column) for column in cached['columns']]
+
+    columns = infer_columns(sample_file)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, 'w') as file:
+        json.dump({'table': table_name, 'key': key, 'columns': columns}, file, indent=1)
+    return columns
+
+
+def _column(name: str, column_type: str) -> Tuple[str, str]:
+    # how the Glue catalog reports a column created by `create_table_sql`
+    return name.replace('<', '_lt_').lower(), column_type.replace(' ', '').lower()
+
+
+def table_matches(metadata: Dict, columns: List[Tuple[str, str]], partition_by: List=None,
+                  properties: Dict=None) -> bool:
+    """
+    Whether an existing table (`get_table_metadata`'s `TableMetadata`) has
+    `columns`, `partition_by` and the table `properties`, including no
+    partition projection unless `properties` turn it on.
+    """
+    partition_by = list(partition_by or [])
+    partition_keys = {p.lower() for p in partition_by}
+    wanted = [_column(name, column_type) for name, column_type in columns if name.lower() not in partition_keys]
+    existing = [_column(c['Name'], c['Type']) for c in metadata.get('Columns', [])]
+    wanted_keys = [(p.lower(), 'string') for p in partition_by]
+    existing_keys = [_column(c['Name'], c['Type']) for c in metadata.get('PartitionKeys', [])]
+
+    properties = {k: str(v) for k, v in (properties or {}).items()}
+    parameters = metadata.get('Parameters', {})
+    stale = [k for k in parameters if k.startswith('projection.') and k not in properties]
+    return (wanted == existing and wanted_keys == existing_keys and not stale
+            and all(parameters.get(k) == v for k, v in properties.items()))
+
+
+def create_table_sql(table_name: str, columns: List[Tuple[str, str]], partition_by: List=None) -> str:
+    """
+    `CREATE EXTERNAL TABLE IF NOT EXISTS` with `columns`, minus the partition
+    columns, which go to `PARTITIONED BY` as strings. Storage clauses are
+    left to the caller, and so is dropping a table whose definition changed
+    (see `table_matches`).
+    """
+    partition_by = list(partition_by or [])
+    partition_keys = {p.lower() for p in partition_by}
+    body = ',\n'.join(
+        # Athena rejects `<` in names; kept as `_lt_` like sql_create_from_dataframe did
+        f'  `{name.replace("<", "_lt_")}` {column_type}'
+        for name, column_type in columns if name.lower() not in partition_keys
+    )
+    sql_text = f'CREATE EXTERNAL TABLE IF NOT EXISTS {table_name} (\n{body}\n)'
+    if partition_by:
+        sql_text += f"\nPARTITIONED BY ({', '.join(f'{p} STRING' for p in partition_by)})"
+    return sql_text
@@ -0,0 +1,110 @@
+"""
+Packed STR R-tree over polygon layers, stored as one memory-mappable file.
+
+Layout (little-endian):
+
+    8 bytes   magic b'SPIDX001'
+    4 bytes   header length H
+    H bytes   JSON header: node size, level count, feature count and the
+              offset/dtype/shape of every array below
+    arrays, each 8-byte aligned:
+      level_0 ... level_k     float64 (n, 4) boxes; level_0 holds one box per
+                              feature, level_k the root
+      coords                  float64 (m, 2) ring vertices
+      ring_offsets            int64 (rings + 1) into coords
+      feature_rings           int64 (features + 1) into ring_offsets
+      attribute_offsets       int64 (features + 1) into attributes
+      attributes              uint8, one JSON object per feature
+
+Features are stored in Sort-Tile-Recursive order, so the children of node
+`i` on level `L` are nodes `i * node_size ... (i + 1) * node_size - 1` on
+level `L - 1` and the tree needs no pointers. Queries run level by level
+on whole arrays of (point, node) candidate pairs, then an even-odd
+ray-crossing test on the candidate polygons, so batches of points are
+resolved with NumPy rather than per-point Python.
+
+This module writes the files; the Lambda reads them with
+`lambda_app/app/spatial.py`, which only needs NumPy, so it has no GEOS.
+"""
+import json
+import math
+import struct
+
+import numpy as np
+
+
+MAGIC = b'SPIDX001'
+NODE_SIZE = 16
+
+
+def str_order(boxes, node_size=NODE_SIZE):
+    """Sort-Tile-Recursive order of `boxes` (n, 4: minx, miny, maxx, maxy)."""
+    n = len(boxes)
+    if n == 0:
+        return np.arange(0)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    leaves = math.ceil(n / node_size)
+    slab = node_size * math.ceil(leaves / math.ceil(math.sqrt(leaves)))
+    order = np.argsort(cx, kind='stable')
+    for start in range(0, n, slab):
+        chunk = order[start:start + slab]
+        order[start:start + slab] = chunk[np.argsort(cy[chunk], kind='stable')]
+    return order
+
+
+def build_levels(boxes, node_size=NODE_SIZE):
+    """Bounding boxes of every tree level, leaves first, root last."""
+    levels = [np.ascontiguousarray(boxes, dtype='<f8')]
+    while len(levels[-1]) > 1:
+        child = levels[-1]
+        starts = np.arange(0, len(child), node_size)
+        levels.append(np.column_stack([
+            np.minimum.reduceat(child[:, 0], starts),
+            np.minimum.reduceat(child[:, 1], starts),
+            np.maximum.reduceat(child[:, 2], starts),
+            np.maximum.reduceat(child[:, 3], starts),
+        ]))
+    return levels
+
+
+def write_index(path, boxes, coords, ring_offsets, feature_rings, attributes, meta=None,
+                node_size=NODE_SIZE):
+    """
+    Write an index whose features are already in `str_order`.
+
+    `attributes` is a list of JSON-encoded bytes, one per feature.
+    """
+    attribute_offsets = np.zeros(len(attributes) + 1, dtype='<i8')
+    attribute_offsets[1:] = np.cumsum([len(a) for a in attributes])
+    arrays = {f'level_{i}': level for i, level in enumerate(build_levels(boxes, node_size))} if len(boxes) else {}
+    arrays.update({
+        'coords': np.ascontiguousarray(coords, dtype='<f8'),
+        'ring_offsets': np.asarray(ring_offsets, dtype='<i8'),
+        'feature_rings': np.asarray(feature_rings, dtype='<i8'),
+        'attribute_offsets': attribute_offsets,
+        'attributes': np.frombuffer(b''.join(attributes), dtype='u1'),
+    })
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [offset, array.dtype.str, list(array.shape)]
+        offset += -(-array.nbytes // 8) * 8
+    header = json.dumps({
+        'node_size': node_size,
+        'levels': sum(name.startswith('level_') for name in arrays),
+        'features': len(boxes),
+        'arrays': layout,
+        'meta': meta or {},
+    }).encode()
+    data_start = -(-(12 + len(header)) // 8) * 8
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        file.write(b'\0' * (data_start - 12 - len(header)))
+        for name, array in arrays.items():
+            raw = array.tobytes()
+            file.write(raw)
+            file.write(b'\0' * (-len(raw) % 8))
@@ -0,0 +1,199 @@
+"""Incremental sync of the local processed tree to S3."""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+from serverless import settings
+from serverless.utils import file_md5
+
+
+DELETE_BATCH_SIZE = 1000
+VERSION_KEY = 'database/version.json'
+
+
+def sync_state_path() -> Path:
+    return settings.root_path/settings.data.manifest_path/'s3_sync.json'
+
+
+def load_sync_state(path=None) -> Dict:
+    """Per-key md5/size/mtime/etag recorded by the last sync, or `{}`."""
+    path = Path(path or sync_state_path())
+    if not path.is_file():
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_sync_state(state: Dict, path=None):
+    path = Path(path or sync_state_path())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+
+
+def list_bucket_index(client, bucket: str, prefix: str='') -> Dict[str, Dict]:
+    """Index every object under `prefix` by key with one paginated LIST."""
+    index = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            index[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag'].strip('"')}
+    return index
+
+
+def local_index(files: Dict[str, Path], state: Dict) -> Dict[str, Dict]:
+    """
+    Size, mtime and md5 of every local file keyed by its S3 key.
+
+    The md5 from `state` is reused when size and mtime are unchanged, so only
+    new or modified files are hashed.
+    """
+    index = {}
+    for key, path in files.items():
+        stat = os.stat(path)
+        previous = state.get(key, {})
+        if previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+            md5 = previous['md5']
+        else:
+            md5 = file_md5(path)
+        index[key] = {'path': str(path), 'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': md5}
+    return index
+
+
+def plan_sync(local: Dict, remote: Dict, state: Dict, delete: bool=False,
+              path: str='.*') -> Dict[str, List[str]]:
+    """
+    Decide which keys to upload, leave alone or delete.
+
+    A key is unchanged when S3 has the same size and either its ETag is the
+    local md5 (single-part upload) or it still carries the ETag recorded for
+    this md5 when we last uploaded it (multipart upload). Remote keys with
+    no local file are listed under `delete` only when `delete=True` and
+    they match `path`.
+    """
+    plan = {'upload': [], 'unchanged': [], 'delete': []}
+    for key, info in sorted(local.items()):
+        obj = remote.get(key)
+        previous = state.get(key, {})
+        if obj is None or obj['size'] != info['size']:
+            plan['upload'].append(key)
+        elif obj['etag'] == info['md5']:
+            plan['unchanged'].append(key)
+        elif previous.get('md5') == info['md5'] and previous.get('etag') == obj['etag']:
+            plan['unchanged'].append(key)
+        else:
+            plan['upload'].append(key)
+
+    if delete:
+        plan['delete'] = sorted(k for k in remote if k not in local and re.search(path, k))
+    return plan
+
+
+def dataset_version(state: Dict) -> str:
+    """Short hash of every synced key and its md5."""
+    digest = hashlib.sha256()
+    for key in sorted(state):
+        digest.update(f"{key}:{state[key]['md5']}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def version_published(client, bucket: str, key: str=VERSION_KEY) -> bool:
+    """Whether the dataset version file exists, so the result cache isn't pinned to its fallback."""
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+        return True
+    except client.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def publish_dataset_version(client, bucket: str, state: Dict, key: str=VERSION_KEY) -> str:
+    """
+    Write the dataset version the Lambda result cache keys on.
+
+    Any change to the synced data changes the version, which invalidates
+    all cached query results.
+    """
+    version = dataset_version(state)
+    client.put_object(
+        Bucket=bucket, Key=key, ContentType='application/json',
+        Body=json.dumps({'version': version}).encode()
+    )
+    return version
+
+
+def delete_keys(client, bucket: str, keys: Iterable[str]):
+    keys = list(keys)
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in keys[i:i + DELETE_BATCH_SIZE]], 'Quiet': True}
+        )
+
+
+def sync_to_s3(client, bucket: str, files: Dict[str, Path], prefix: str,
+               upload: Callable=None, delete: bool=False, dry_run: bool=False,
+               path: str='.*', state_path=None) -> Dict[str, List[str]]:
+    """
+    Upload new or changed `files` (S3 key -> local path) under `prefix`.
+
+    `upload(client, bucket, [(path, key), ...])` does the transfers and
+    defaults to sequential `upload_file` calls; it returns a report whose
+    `failed` lists `{'key': ...}` dicts, like `transfer.upload_files`.
+    `path` is a regex over S3 keys limiting what `delete` may remove; filter
+    `files` by the same regex. With `dry_run=True` the plan is returned
+    without touching S3. After a real sync the prefix is listed once more so
+    the recorded ETags match what S3 stored, the results are merged into the
+    sync state and, if anything changed or no version was published yet, a
+    new dataset version is published.
+    Failed uploads keep their previous state, so the next sync retries them,
+    and raise a RuntimeError once the rest is recorded.
+    """
+    state = load_sync_state(state_path)
+    remote = list_bucket_index(client, bucket, prefix)
+    local = local_index(files, state)
+    plan = plan_sync(local, remote, state, delete=delete, path=path)
+
+    print(f"S3 SYNC PLAN: {len(plan['upload'])} to upload, {len(plan['unchanged'])} unchanged, "
+          f"{len(plan['delete'])} to delete")
+    if dry_run:
+        return plan
+
+    failed = set()
+    if plan['upload']:
+        jobs = [(local[key]['path'], key) for key in plan['upload']]
+        if upload is None:
+            for file, key in jobs:
+                try:
+                    client.upload_file(file, bucket, key)
+                except Exception as e:
+                    failed.add(key)
+                    print(f'FAILED UPLOAD: {key}: {e!r}')
+        else:
+            report = upload(client, bucket, jobs) or {}
+            failed = {f['key'] for f in report.get('failed', [])}
+    if plan['delete']:
+        delete_keys(client, bucket, plan['delete'])
+    plan['failed'] = sorted(failed)
+
+    remote = list_bucket_index(client, bucket, prefix) if plan['upload'] else remote
+    # keys outside this sync's `files` (another `path`, another prefix) keep their entries
+    state = {
+        key: info for key, info in state.items()
+        if key not in plan['delete'] and (not key.startswith(prefix) or key in remote)
+    }
+    state.update({
+        key: {**{k: v for k, v in info.items() if k != 'path'},
+              'etag': remote.get(key, {}).get('etag')}
+        for key, info in local.items() if key not in failed
+    })
+    save_sync_state(state, state_path)
+    if len(plan['upload']) > len(failed) or plan['delete'] or not version_published(client, bucket):
+        plan['version'] = publish_dataset_version(client, bucket, state)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(plan['upload'])} uploads failed: {plan['failed'][:10]}")
+    return plan
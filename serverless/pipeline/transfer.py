@@ -0,0 +1,104 @@
+"""Concurrent bulk uploads to S3."""
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+from boto3.s3.transfer import TransferConfig
+
+from serverless import settings, tracing
+
+
+CONTENT_TYPES = {
+    '.geojson': 'application/json',
+    '.json': 'application/json',
+    '.parquet': 'application/vnd.apache.parquet',
+    '.csv': 'text/csv',
+    '.txt': 'text/plain',
+    '.mvt': 'application/vnd.mapbox-vector-tile',
+}
+
+CONTENT_ENCODINGS = {
+    '.gz': 'gzip',
+    '.br': 'br',
+}
+
+
+def transfer_config(**overrides) -> TransferConfig:
+    """TransferConfig built from `settings.s3`, with keyword overrides."""
+    options = {
+        'multipart_threshold': settings.s3.multipart_threshold,
+        'multipart_chunksize': settings.s3.multipart_chunksize,
+        'max_concurrency': settings.s3.max_concurrency,
+        'use_threads': True,
+    }
+    options.update(overrides)
+    return TransferConfig(**options)
+
+
+def content_headers(path) -> Dict[str, str]:
+    """ExtraArgs with Content-Type, and Content-Encoding for .gz/.br files."""
+    suffixes = Path(path).suffixes
+    extra = {}
+    if suffixes and suffixes[-1] in CONTENT_ENCODINGS:
+        extra['ContentEncoding'] = CONTENT_ENCODINGS[suffixes[-1]]
+        suffixes = suffixes[:-1]
+    suffix = suffixes[-1] if suffixes else ''
+    content_type = CONTENT_TYPES.get(suffix) or mimetypes.guess_type(f'file{suffix}')[0]
+    extra['ContentType'] = content_type or 'application/octet-stream'
+    return extra
+
+
+def _upload_one(client, bucket, file, key, config):
+    start = time.perf_counter()
+    client.upload_file(str(file), bucket, key, ExtraArgs=content_headers(file), Config=config)
+    return {'key': key, 'bytes': os.path.getsize(file), 'seconds': time.perf_counter() - start}
+
+
+def upload_files(client, bucket: str, jobs: Iterable[Tuple[str, str]],
+                 max_workers: int=None, config: TransferConfig=None) -> Dict:
+    """
+    Upload `(local_path, key)` pairs on a bounded thread pool.
+
+    All threads share `client` (boto3 clients are thread-safe; give it a
+    `max_pool_connections` of at least `max_workers * max_concurrency`).
+    Large files are split into multipart uploads according to `config`.
+    Returns per-file timings, failures and aggregate throughput.
+    """
+    jobs = list(jobs)
+    max_workers = max_workers or settings.s3.max_workers
+    config = config or transfer_config()
+
+    start = time.perf_counter()
+    files, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_upload_one, client, bucket, file, key, config): key
+            for file, key in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                files.append(future.result())
+            except Exception as e:
+                failed.append({'key': futures[future], 'error': repr(e)})
+                print(f'FAILED UPLOAD: {futures[future]}: {e!r}')
+
+    seconds = time.perf_counter() - start
+    total = sum(f['bytes'] for f in files)
+    tracing.count('bytes_uploaded', total)
+    tracing.count('files_uploaded', len(files))
+    report = {
+        'files': sorted(files, key=lambda f: f['seconds'], reverse=True),
+        'failed': failed,
+        'bytes': total,
+        'seconds': seconds,
+        'mb_per_s': total / 1e6 / seconds if seconds else 0.0,
+    }
+
+    print(f"UPLOADED {len(files)} files ({len(failed)} failed), {total / 1e6:.1f} MB "
+          f"in {seconds:.1f}s ({report['mb_per_s']:.1f} MB/s)")
+    for f in report['files'][:10]:
+        print(f"  {f['seconds']:8.2f}s {f['bytes'] / 1e6:10.2f} MB  {f['key']}")
+    return report
@@ -0,0 +1,350 @@
+"""
+Timed spans, memory and I/O counters for the pipeline, exported as a
+Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+
+Tracing is off unless `settings.tracing.enabled` is set (or
+`SERVERLESS_TRACING__ENABLED=true`) or `enable()` is called; spans are then
+free apart from a flag check.
+
+    from serverless import tracing
+
+    @tracing.traced()
+    def step(): ...
+
+    with tracing.span('partition', layer='tract'):
+        ...
+        tracing.count('rows', len(df))
+
+Each span records its wall time, the process RSS at its start and end, the
+process peak RSS, the tracemalloc peak (with `tracemalloc: true`) and the
+counters (`rows`, `bytes_read`, `bytes_written`, `bytes_uploaded`, ...)
+added while it was open, which also roll up into enclosing spans. A span
+named like `settings.tracing.profile` is run under cProfile (or pyinstrument
+with `profiler: pyinstrument`) and the profile is saved next to the trace.
+
+Worker processes send their events back with `collect()`, and the parent
+adds them, and their counters, to the open span with `merge()`. `report()` writes the trace and prints a
+per-span summary.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from serverless import settings
+
+
+_config = {}
+_events = []
+_events_lock = threading.Lock()
+_local = threading.local()
+
+
+def _load():
+    if not _config:
+        tracing = settings.get('tracing') or {}
+        _config.update({
+            'enabled': bool(tracing.get('enabled', False)),
+            'tracemalloc': bool(tracing.get('tracemalloc', False)),
+            'profile': tracing.get('profile'),
+            'profiler': tracing.get('profiler') or 'cprofile',
+        })
+        if _config['enabled'] and _config['tracemalloc'] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    return _config
+
+
+def enable(memory: bool=None, profile: str=None, profiler: str=None):
+    """Turn tracing on; `memory` turns on tracemalloc, `profile` names a span to profile."""
+    config = _load()
+    config['enabled'] = True
+    if memory is not None:
+        config['tracemalloc'] = memory
+    if profile is not None:
+        config['profile'] = profile
+    if profiler is not None:
+        config['profiler'] = profiler
+    if config['tracemalloc'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    _load()['enabled'] = False
+
+
+def enabled() -> bool:
+    return _load()['enabled']
+
+
+def config() -> Dict:
+    """Current configuration, as keyword arguments for `enable()` in a worker."""
+    c = _load()
+    return {'memory': c['tracemalloc'], 'profile': c['profile'], 'profiler': c['profiler']}
+
+
+def trace_dir() -> Path:
+    return settings.root_path/(settings.get('tracing', {}).get('trace_path') or 'data/db/traces')
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes, or 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes, or 0 if unknown."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def _stack() -> List[Dict]:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _now_us() -> float:
+    # wall clock, so events from worker processes line up with the parent's
+    return time.time_ns() / 1000
+
+
+def _add_event(event: Dict):
+    with _events_lock:
+        _events.append(event)
+
+
+def count(name: str, value=1):
+    """Add `value` to counter `name` of the innermost open span on this thread."""
+    if not _load()['enabled']:
+        return
+    stack = _stack()
+    if stack:
+        # enclosing spans get it when this one closes
+        stack[-1]['counters'][name] += value
+
+
+@contextmanager
+def _profiled(name: str):
+    config = _load()
+    if config['profile'] != name or getattr(_local, 'profiling', False):
+        yield
+        return
+
+    to_dir = trace_dir()
+    to_dir.mkdir(parents=True, exist_ok=True)
+    stem = f'{name}-{os.getpid()}-{time.strftime("%Y%m%dT%H%M%S")}'
+    _local.profiling = True
+    try:
+        if config['profiler'] == 'pyinstrument':
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                to_file = to_dir/f'{stem}.html'
+                to_file.write_text(profiler.output_html())
+        else:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                to_file = to_dir/f'{stem}.prof'
+                profiler.dump_stats(to_file)
+        print(f'PROFILE: {name} written to {to_file}')
+    finally:
+        _local.profiling = False
+
+
+def _reset_tracemalloc_peak():
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # python 3.8: restarting is the only way to reset the peak
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+@contextmanager
+def span(name: str, **args):
+    """Time the enclosed block as a trace event named `name` with `args`."""
+    config = _load()
+    if not config['enabled']:
+        yield
+        return
+
+    stack = _stack()
+    frame = {'counters': defaultdict(int)}
+    if config['tracemalloc'] and tracemalloc.is_tracing() and not stack:
+        _reset_tracemalloc_peak()
+    stack.append(frame)
+    rss_start = current_rss()
+    ts = _now_us()
+    start = time.perf_counter()
+    try:
+        with _profiled(name):
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        for parent in stack:
+            for key, value in frame['counters'].items():
+                parent['counters'][key] += value
+
+        # span args are labels; only counters and memory are numeric
+        event_args = {k: str(v) for k, v in args.items()}
+        event_args.update(frame['counters'])
+        event_args.update({'rss_start': rss_start, 'rss_end': current_rss(), 'peak_rss': peak_rss()})
+        if config['tracemalloc'] and tracemalloc.is_tracing():
+            event_args['tracemalloc_peak'] = tracemalloc.get_traced_memory()[1]
+
+        pid, tid = os.getpid(), threading.get_ident()
+        _add_event({'name': name, 'ph': 'X', 'ts': ts, 'dur': seconds * 1e6,
+                    'pid': pid, 'tid': tid, 'args': event_args})
+        _add_event({'name': 'rss', 'ph': 'C', 'ts': ts + seconds * 1e6, 'pid': pid,
+                    'args': {'MB': event_args['rss_end'] / 1e6}})
+
+
+def traced(name: str=None):
+    """Decorator running the function in a `span` (named after the function by default)."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _load()['enabled']:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect() -> List[Dict]:
+    """Remove and return this process's events, e.g. to send them from a worker."""
+    pid = os.getpid()
+    with _events_lock:
+        mine = [e for e in _events if e['pid'] == pid]
+        _events[:] = [e for e in _events if e['pid'] != pid]
+    return mine
+
+
+def _outermost_spans(events: List[Dict]):
+    """The span events not enclosed by another span of the same process and thread."""
+    spans = sorted((e for e in events if e['ph'] == 'X'), key=lambda e: (e['pid'], e['tid'], e['ts'], -e['dur']))
+    ends = {}
+    for e in spans:
+        key = (e['pid'], e['tid'])
+        if key not in ends or e['ts'] >= ends[key]:
+            ends[key] = e['ts'] + e['dur']
+            yield e
+
+
+def merge(events: List[Dict]):
+    """
+    Add events collected in another process.
+
+    The counters of the worker's outermost spans (which already include
+    their children's) are added to the innermost open span on this thread,
+    so they roll up like counters of spans run in-process.
+    """
+    events = events or []
+    with _events_lock:
+        _events.extend(events)
+    for e in _outermost_spans(events):
+        for key, value in e['args'].items():
+            if key not in MEMORY_ARGS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                count(key, value)
+
+
+def events() -> List[Dict]:
+    with _events_lock:
+        return list(_events)
+
+
+def clear():
+    with _events_lock:
+        _events.clear()
+
+
+def write_trace(to_file=None) -> Path:
+    """Write all events as Chrome trace JSON; returns the file."""
+    to_file = Path(to_file or trace_dir()/f'trace-{time.strftime("%Y%m%dT%H%M%S")}.json')
+    to_file.parent.mkdir(parents=True, exist_ok=True)
+    trace = events()
+    metadata = [
+        {'name': 'process_name', 'ph': 'M', 'pid': pid,
+         'args': {'name': 'pipeline' if pid == os.getpid() else f'worker {pid}'}}
+        for pid in sorted({e['pid'] for e in trace})
+    ]
+    with open(to_file, 'w') as file:
+        json.dump({'traceEvents': metadata + trace, 'displayTimeUnit': 'ms'}, file, default=str)
+    return to_file
+
+
+MEMORY_ARGS = {'rss_start', 'rss_end', 'peak_rss', 'tracemalloc_peak'}
+
+
+def summary() -> List[Dict]:
+    """Calls, total seconds, peak memory and counters per span name, slowest first."""
+    rows = {}
+    for e in events():
+        if e['ph'] != 'X':
+            continue
+        row = rows.setdefault(e['name'], {'name': e['name'], 'calls': 0, 'seconds': 0.0, 'peak_rss': 0,
+                                          'tracemalloc_peak': None, 'counters': defaultdict(int)})
+        args = e['args']
+        row['calls'] += 1
+        row['seconds'] += e['dur'] / 1e6
+        row['peak_rss'] = max(row['peak_rss'], args.get('peak_rss', 0))
+        if args.get('tracemalloc_peak') is not None:
+            row['tracemalloc_peak'] = max(row['tracemalloc_peak'] or 0, args['tracemalloc_peak'])
+        for key, value in args.items():
+            if key not in MEMORY_ARGS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                row['counters'][key] += value
+    return sorted(rows.values(), key=lambda r: r['seconds'], reverse=True)
+
+
+def print_summary(rows: List[Dict]=None):
+    rows = summary() if rows is None else rows
+    counters = sorted({key for r in rows for key in r['counters']})
+    header = f"  {'span':<32} {'calls':>6} {'seconds':>9} {'peak rss MB':>12} {'py peak MB':>11}"
+    print(f'TRACE: {len(rows)} spans')
+    print(header + ''.join(f' {c:>15}' for c in counters))
+    for r in rows:
+        py_peak = f"{r['tracemalloc_peak'] / 1e6:.1f}" if r['tracemalloc_peak'] is not None else '-'
+        line = f"  {r['name'][:32]:<32} {r['calls']:>6} {r['seconds']:>9.2f} {r['peak_rss'] / 1e6:>12.1f} {py_peak:>11}"
+        line += ''.join(f" {r['counters'].get(c, 0):>15,}" for c in counters)
+        print(line)
+
+
+def report(to_file=None) -> Path:
+    """Write the trace and print the summary."""
+    to_file = write_trace(to_file)
+    print_summary()
+    print(f'TRACE: written to {to_file}')
+    return to_file
@@ -1,19 +1,183 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
 import requests
 
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+ETAG_SUFFIX = '.etag'
+
+_local = threading.local()
+
+
 def get_project_root() -> Path:
     return Path(__file__).parent.parent
 
-def download_url(url, save_path, chunk_size=128):
+
+def file_md5(path, chunk_size=DEFAULT_CHUNK_SIZE) -> str:
+    """Hex md5 of a file, read `chunk_size` bytes at a time."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _session() -> requests.Session:
+    """One pooled session per thread; `requests.Session` is not thread-safe."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def _total_size(response, offset: int):
+    """Total size of the remote file from Content-Range/Content-Length, if known."""
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    if length is None:
+        return None
+    return int(length) + (offset if response.status_code == 206 else 0)
+
+
+def download_url(url, save_path, chunk_size=DEFAULT_CHUNK_SIZE, retries=3,
+                 timeout=60, session=None) -> Dict:
+    """
+    Download `url` to `save_path`.
+
+    Bytes are streamed into `<save_path>.part` and the file is only renamed to
+    `save_path` once its size matches what the server advertised, so an
+    interrupted download never looks finished. A later call resumes the
+    `.part` file with an HTTP Range request when the partial download has a
+    strong ETag, sent as `If-Range`: if the remote file changed in the
+    meantime the server answers with the full body and the download restarts
+    from zero. So does a resumed response whose ETag differs (a server that
+    ignores `If-Range`) and a partial download with a weak or no ETag, which
+    can't prove the bytes belong to the same file. Requests ask for
+    `Accept-Encoding: identity` and the raw bytes are streamed undecoded, so
+    sizes and Range offsets always count the bytes the server stores.
+
+    Returns a dict with the url, path, bytes transferred, seconds and MB/s.
+    """
     save_path = Path(save_path)
-    save_path_parent = save_path.parent
-    save_path_parent.mkdir(parents=True, exist_ok=True)
-    file = save_path.name
-    r = requests.get(url, stream=True)
-    with open(str(save_path_parent/file), 'wb') as fd:
-        for chunk in r.iter_content(chunk_size=chunk_size):
-            fd.write(chunk)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = save_path.with_name(save_path.name + PART_SUFFIX)
+    etag_path = save_path.with_name(save_path.name + PART_SUFFIX + ETAG_SUFFIX)
+    session = session or _session()
+
+    start = time.perf_counter()
+    transferred = 0
+    total = None
+    etag = None
+
+    for attempt in range(retries + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        saved_etag = etag_path.read_text() if etag_path.exists() else None
+        headers = {'Accept-Encoding': 'identity'}
+        if offset and saved_etag and not saved_etag.startswith('W/'):
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = saved_etag
+        else:
+            offset = 0
+        try:
+            with session.get(url, stream=True, headers=headers, timeout=timeout) as r:
+                if r.status_code == 416:
+                    # nothing left to fetch, the .part file is already complete
+                    total = _total_size(r, offset) or offset
+                    etag = saved_etag
+                    break
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    # server ignored the Range or the ETag no longer matches
+                    offset = 0
+                etag = r.headers.get('ETag')
+                if offset and etag != saved_etag:
+                    # the tail of a different file: start over
+                    part_path.unlink()
+                    etag_path.unlink()
+                    continue
+                total = _total_size(r, offset)
+                if etag:
+                    etag_path.write_text(etag)
+                elif etag_path.exists():
+                    etag_path.unlink()
+                with open(part_path, 'ab' if offset else 'wb') as fd:
+                    for chunk in r.raw.stream(chunk_size, decode_content=False):
+                        fd.write(chunk)
+                        transferred += len(chunk)
+            break
+        except (requests.RequestException, IOError):
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+    else:
+        raise IOError(f'{url} kept changing while resuming the download')
+
+    size = part_path.stat().st_size
+    if total is not None and size != total:
+        raise IOError(f'incomplete download of {url}: got {size} of {total} bytes')
+
+    os.replace(part_path, save_path)
+    if etag_path.exists():
+        etag_path.unlink()
+
+    seconds = time.perf_counter() - start
+    return {
+        'url': url,
+        'path': str(save_path),
+        'bytes': transferred,
+        'size': size,
+        'etag': etag,
+        'seconds': seconds,
+        'mb_per_s': transferred / 1e6 / seconds if seconds else 0.0,
+    }
+
+
+def download_many(jobs: Iterable[Tuple[str, Path]], max_workers: int=8, **kwargs) -> List[Dict]:
+    """
+    Download many `(url, save_path)` pairs on a bounded thread pool.
+
+    Every job gets a result dict; failed jobs carry an `error` key instead of
+    raising so one bad file doesn't abort the rest. Extra keyword arguments
+    are passed to `download_url`.
+    """
+    jobs = list(jobs)
+    results = []
+    if not jobs:
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(download_url, url, save_path, **kwargs): (url, save_path)
+            for url, save_path in jobs
+        }
+        for future in as_completed(futures):
+            url, save_path = futures[future]
+            try:
+                result = future.result()
+                print(f"DOWNLOADED: {url} ({result['bytes'] / 1e6:.1f} MB "
+                      f"in {result['seconds']:.1f}s, {result['mb_per_s']:.1f} MB/s)")
+            except Exception as e:
+                result = {'url': url, 'path': str(save_path), 'error': repr(e)}
+                print(f'FAILED DOWNLOAD: {url}: {e!r}')
+            results.append(result)
+
+    seconds = time.perf_counter() - start
+    total = sum(r.get('bytes', 0) for r in results)
+    print(f'DOWNLOADED {len(results)} files, {total / 1e6:.1f} MB in {seconds:.1f}s '
+          f'({total / 1e6 / seconds if seconds else 0.0:.1f} MB/s)')
+    return results
+
 
 def make_archive(source: str='../src/aws/lambda.py'):
     source = Path(source)
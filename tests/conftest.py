@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# boto3 clients are created at import time by several modules
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+# the Lambda app imports its modules flat, as it does in the container
+LAMBDA_APP = Path(__file__).parent.parent/'serverless'/'lambda_app'/'app'
+sys.path.insert(0, str(LAMBDA_APP))
@@ -0,0 +1,38 @@
+import importlib
+
+import pytest
+from botocore.exceptions import ClientError
+
+from athena_query import QueryError, start_query
+
+
+class StubAthena:
+    def __init__(self, code=None):
+        self.code = code
+
+    def start_query_execution(self, **kwargs):
+        if self.code:
+            raise ClientError({'Error': {'Code': self.code, 'Message': f'{self.code}!'}}, 'StartQueryExecution')
+        return {'QueryExecutionId': 'qid'}
+
+
+def test_start_query():
+    assert start_query(StubAthena(), QueryString='SELECT 1') == 'qid'
+
+
+@pytest.mark.parametrize('code, status', [
+    ('InvalidRequestException', 400), ('TooManyRequestsException', 429), ('InternalServerException', 502),
+])
+def test_start_query_errors(code, status):
+    with pytest.raises(QueryError) as info:
+        start_query(StubAthena(code), QueryString='SELECT 1')
+    assert info.value.status_code == status
+    assert info.value.message == f'{code}!'
+
+
+def test_rejected_query_is_not_a_500(monkeypatch):
+    app = importlib.import_module('lambda')
+    monkeypatch.setattr(app, 'ath', StubAthena('InvalidRequestException'))
+    monkeypatch.setattr(app.cache, 'dataset_version', lambda: 'v1')
+    response = app.lambda_handler({'queryStringParameters': {'cache': '0'}}, None)
+    assert response['statusCode'] == 400
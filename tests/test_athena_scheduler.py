@@ -0,0 +1,100 @@
+import pytest
+
+from serverless.pipeline.athena import AthenaScheduler, statement
+
+
+class StubAthena:
+    """Queries finish on the poll after they start; SQL in `fail` fails, SQL in `reject` can't start."""
+
+    def __init__(self, fail=(), reject=()):
+        self.fail, self.reject = set(fail), set(reject)
+        self.queries = {}
+        self.finished = []
+        self.started = []
+        self.max_running = 0
+
+    def start_query_execution(self, QueryString, **kwargs):
+        if QueryString in self.reject:
+            raise RuntimeError('rejected')
+        qid = f'q{len(self.queries)}'
+        self.queries[qid] = QueryString
+        self.started.append((QueryString, list(self.finished)))
+        running = len(self.queries) - len(self.finished)
+        self.max_running = max(self.max_running, running)
+        return {'QueryExecutionId': qid}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        executions = []
+        for qid in QueryExecutionIds:
+            sql = self.queries[qid]
+            state = 'FAILED' if sql in self.fail else 'SUCCEEDED'
+            self.finished.append(sql)
+            executions.append({'QueryExecutionId': qid, 'Status': {'State': state, 'StateChangeReason': f'{sql} {state}'}})
+        return {'QueryExecutions': executions}
+
+
+STATEMENTS = [
+    statement('database', 'db'),
+    statement('tract', 'tract', depends_on=['database']),
+    statement('county', 'county', depends_on=['database']),
+    statement('tract:partitions', 'tract partitions', depends_on=['tract']),
+    statement('county:partitions', 'county partitions', depends_on=['county']),
+    statement('county:check', 'county check', depends_on=['county:partitions']),
+]
+
+
+def scheduler(client, **kwargs):
+    return AthenaScheduler(client, 's3://bucket/queries', poll_interval=0.001, max_poll_interval=0.002,
+                           timeout=10, **kwargs)
+
+
+def test_runs_in_dependency_order():
+    client = StubAthena()
+    results = scheduler(client).run(STATEMENTS)
+
+    assert all(r['state'] == 'SUCCEEDED' for r in results.values())
+    depends_on = {s['sql']: [d['sql'] for d in STATEMENTS if d['name'] in s['depends_on']] for s in STATEMENTS}
+    for sql, finished_before in client.started:
+        assert set(depends_on[sql]) <= set(finished_before)
+    # independent tables run side by side
+    assert [sql for sql, _ in client.started[1:3]] == ['tract', 'county']
+    assert client.max_running == 2
+
+
+def test_failure_skips_dependents_only():
+    client = StubAthena(fail={'county'})
+    results = scheduler(client).run(STATEMENTS)
+
+    assert results['county']['state'] == 'FAILED'
+    assert results['county']['reason'] == 'county FAILED'
+    assert results['county:partitions']['state'] == 'SKIPPED'
+    assert results['county:check']['state'] == 'SKIPPED'
+    assert results['tract:partitions']['state'] == 'SUCCEEDED'
+    assert 'county partitions' not in client.queries.values()
+
+
+def test_rejected_start_fails_and_skips_dependents():
+    results = scheduler(StubAthena(reject={'tract'})).run(STATEMENTS)
+    assert results['tract']['state'] == 'FAILED'
+    assert 'rejected' in results['tract']['reason']
+    assert results['tract:partitions']['state'] == 'SKIPPED'
+    assert results['county:check']['state'] == 'SUCCEEDED'
+
+
+def test_max_concurrency():
+    client = StubAthena()
+    tables = [statement(f't{i}', f't{i}') for i in range(5)]
+    results = scheduler(client, max_concurrency=2).run(tables)
+    assert all(r['state'] == 'SUCCEEDED' for r in results.values())
+    assert client.max_running == 2
+
+
+def test_cycle_and_unknown_dependencies():
+    results = scheduler(StubAthena()).run([
+        statement('a', 'a', depends_on=['b']), statement('b', 'b', depends_on=['a'])
+    ])
+    assert {r['state'] for r in results.values()} == {'SKIPPED'}
+    assert results['a']['reason'] == 'dependency cycle'
+
+    with pytest.raises(ValueError):
+        scheduler(StubAthena()).run([statement('a', 'a', depends_on=['missing'])])
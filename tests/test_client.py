@@ -0,0 +1,38 @@
+import json
+
+import pytest
+import requests
+
+from serverless.client import query
+
+
+class StubSession:
+    """Records each GET and answers with a JSON body."""
+
+    def __init__(self, records):
+        self.records = records
+        self.requests = []
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append(params)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(self.records).encode()
+        return response
+
+
+def test_named_query_sends_name_and_params():
+    session = StubSession([{'namelsad': 'Census Tract 195'}])
+    df = query('https://api', 'tracts_in_county', {'statefp': '47', 'countyfp': '037'},
+               fmt='json', session=session, limit=10)
+    assert session.requests == [{'query': 'tracts_in_county', 'statefp': '47', 'countyfp': '037', 'limit': 10}]
+    assert df.to_dict(orient='records') == [{'namelsad': 'Census Tract 195'}]
+
+
+def test_raw_sql_is_keyword_only_opt_in():
+    session = StubSession([])
+    query('https://api', sql='SELECT 1', fmt='json', session=session)
+    assert session.requests == [{'sql': 'SELECT 1'}]
+    with pytest.raises(ValueError):
+        query('https://api', 'large_counties', sql='SELECT 1', session=session)
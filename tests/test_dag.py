@@ -0,0 +1,74 @@
+from serverless.pipeline.dag import StepRunner, step
+
+
+def test_step_with_fetched_inputs_is_cached_on_the_next_run(tmp_path):
+    raw, out = tmp_path/'raw.csv', tmp_path/'out.csv'
+    calls = []
+
+    def download_and_process():
+        calls.append(1)
+        if not raw.exists():
+            raw.write_text('a,b\n')
+        out.write_text(raw.read_text())
+
+    steps = [step('etl', download_and_process, inputs=[raw], outputs=[out])]
+    state_path = tmp_path/'state.json'
+    assert StepRunner(1, state_path).run(steps)['etl']['status'] == 'ok'
+    assert StepRunner(1, state_path).run(steps)['etl']['status'] == 'cached'
+
+    raw.write_text('a,b\n1,2\n')
+    assert StepRunner(1, state_path).run(steps)['etl']['status'] == 'ok'
+    assert len(calls) == 2
+
+
+def test_failed_step_blocks_dependents(tmp_path):
+    def fail():
+        raise ValueError('boom')
+
+    results = StepRunner(2, tmp_path/'state.json').run([
+        step('a', fail), step('b', lambda: 1, depends_on=['a']), step('c', lambda: 2),
+    ])
+    assert [results[s]['status'] for s in 'abc'] == ['failed', 'blocked', 'ok']
+
+
+class StubApiGateway:
+    def __init__(self, names):
+        self.pages = [{'items': [{'id': f'id-{name}', 'name': name}]} for name in names]
+
+    def get_paginator(self, operation):
+        assert operation == 'get_rest_apis'
+        return self
+
+    def paginate(self):
+        return iter(self.pages)
+
+    def create_rest_api(self, **kwargs):
+        raise AssertionError('a new REST API was created')
+
+
+def test_create_api_reuses_api_by_name(monkeypatch):
+    from serverless.pipeline import pipeline
+
+    monkeypatch.setattr(pipeline, 'api_client', StubApiGateway(['other', 'serverlessprez_lambda']))
+    p = pipeline.Pipeline(None)
+    p.create_api(name='serverlessprez_lambda')
+    assert p.rest_api_id == 'id-serverlessprez_lambda'
+
+
+def test_run_pipeline_raises_on_failed_steps(tmp_path, monkeypatch):
+    import pytest
+
+    from serverless import settings
+    from serverless.pipeline import pipeline
+    from serverless.pipeline.data import census_population
+
+    def fail(**kwargs):
+        raise ValueError('boom')
+
+    monkeypatch.setattr(settings, 'root_path', tmp_path)
+    monkeypatch.setattr(census_population, 'main', fail)
+    skip = ['census_businesspatterns', 'tiger', 'upload_spatial', 'upload_tiles', 'workgroup']
+    with pytest.raises(RuntimeError) as e:
+        pipeline.Pipeline.run_pipeline(skip=skip, max_workers=1)
+    assert "census_population failed: ValueError('boom')" in str(e.value)
+    assert 'to_s3 blocked' in str(e.value)
@@ -0,0 +1,104 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from serverless.utils import download_url
+
+
+BODY = bytes(range(256)) * 64
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves `server.body` with `server.etag` and `server.encoding`, honouring Range and If-Range."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        body, start = server.body, 0
+        byte_range = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if byte_range and (server.ignore_if_range or if_range is None or if_range == server.etag):
+            start = int(byte_range.split('=')[1].rstrip('-'))
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('Content-Length', str(len(body) - start))
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        if server.encoding:
+            self.send_header('Content-Encoding', server.encoding)
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.body, httpd.etag, httpd.encoding, httpd.ignore_if_range, httpd.requests = BODY, '"v1"', None, False, []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/file.bin'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def partial(tmp_path, content, etag):
+    save_path = tmp_path/'file.bin'
+    (tmp_path/'file.bin.part').write_bytes(content)
+    (tmp_path/'file.bin.part.etag').write_text(etag)
+    return save_path
+
+
+def test_download(server, tmp_path):
+    result = download_url(server.url, tmp_path/'file.bin', chunk_size=1000)
+    assert (tmp_path/'file.bin').read_bytes() == BODY
+    assert result['bytes'] == len(BODY) and result['etag'] == '"v1"'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['file.bin']
+
+
+def test_resume_with_matching_etag(server, tmp_path):
+    save_path = partial(tmp_path, BODY[:5000], '"v1"')
+    result = download_url(server.url, save_path)
+    assert server.requests[0]['Range'] == 'bytes=5000-'
+    assert result['bytes'] == len(BODY) - 5000
+    assert save_path.read_bytes() == BODY
+
+
+def test_changed_file_restarts(server, tmp_path):
+    save_path = partial(tmp_path, b'x' * 5000, '"v0"')
+    result = download_url(server.url, save_path)
+    assert result['bytes'] == len(BODY)
+    assert save_path.read_bytes() == BODY
+
+
+def test_server_ignoring_if_range_restarts(server, tmp_path):
+    server.ignore_if_range = True
+    save_path = partial(tmp_path, b'x' * 5000, '"v0"')
+    result = download_url(server.url, save_path)
+    assert [r.get('Range') for r in server.requests] == ['bytes=5000-', None]
+    assert result['bytes'] == len(BODY)
+    assert save_path.read_bytes() == BODY
+
+
+def test_weak_etag_is_not_resumed(server, tmp_path):
+    server.etag = 'W/"v1"'
+    save_path = partial(tmp_path, b'x' * 5000, 'W/"v1"')
+    download_url(server.url, save_path)
+    assert 'Range' not in server.requests[0] and 'If-Range' not in server.requests[0]
+    assert save_path.read_bytes() == BODY
+
+
+def test_gzip_encoded_response_is_saved_as_sent(server, tmp_path):
+    # a server that compresses even though the client asked for identity
+    server.body, server.encoding = gzip.compress(BODY), 'gzip'
+    save_path = partial(tmp_path, server.body[:100], '"v1"')
+    result = download_url(server.url, save_path, retries=0)
+    assert server.requests[0]['Accept-Encoding'] == 'identity'
+    assert result['bytes'] == len(server.body) - 100
+    assert gzip.decompress(save_path.read_bytes()) == BODY
@@ -0,0 +1,34 @@
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import encoding
+from encoding import ResponseTooLarge, encode_records
+
+
+def decode(payload, fmt):
+    if fmt == 'arrow':
+        return pa.ipc.open_stream(payload).read_all()
+    return pq.read_table(io.BytesIO(payload))
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_column_null_in_first_batch(fmt):
+    records = [{'zip': '37013', 'note': None}] * encoding.BATCH_ROWS + [{'zip': '37064', 'note': 'po box'}]
+    table = decode(encode_records(iter(records), fmt), fmt)
+    assert table.schema.field('note').type == pa.string()
+    assert table.to_pylist() == records
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_null_and_empty_results(fmt):
+    table = decode(encode_records(iter([{'zip': '37013', 'note': None}]), fmt), fmt)
+    assert table.to_pylist() == [{'zip': '37013', 'note': None}]
+    assert decode(encode_records(iter([]), fmt), fmt).num_rows == 0
+
+
+def test_too_large():
+    with pytest.raises(ResponseTooLarge):
+        encode_records(iter([{'zip': str(i)} for i in range(100)]), 'json', max_bytes=100)
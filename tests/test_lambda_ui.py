@@ -0,0 +1,87 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import lambda_ui
+
+
+class StubAthena:
+    """Answers every query with one page of `rows` under `columns`."""
+
+    def __init__(self, columns, rows):
+        self.columns, self.rows = columns, rows
+        self.started = []
+
+    def start_query_execution(self, **kwargs):
+        self.started.append(kwargs)
+        return {'QueryExecutionId': 'qid'}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'}, 'Statistics': {}}}
+
+    def get_query_results(self, QueryExecutionId, MaxResults, NextToken=None):
+        if NextToken == 'tampered':
+            raise ClientError({'Error': {'Code': 'InvalidRequestException', 'Message': 'invalid token'}},
+                              'GetQueryResults')
+        header = {'Data': [{'VarCharValue': c} for c, _ in self.columns]}
+        data = [{'Data': [{'VarCharValue': v} for v in row]} for row in self.rows]
+        return {'ResultSet': {
+            'ResultSetMetadata': {'ColumnInfo': [{'Label': c, 'Type': t} for c, t in self.columns]},
+            'Rows': [header] + data,
+        }}
+
+
+@pytest.fixture
+def athena(monkeypatch):
+    athena = StubAthena([('county', 'varchar'), ('population_2020', 'integer')], [['Davidson', '715884']])
+    monkeypatch.setattr(lambda_ui, 'ath', athena)
+    return athena
+
+
+def handle(**params):
+    return lambda_ui.lambda_handler({'queryStringParameters': params}, None)
+
+
+def test_default_query_runs_prepared_statement_in_work_group(athena):
+    response = handle()
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == [{'county': 'Davidson', 'population_2020': 715884}]
+    started = athena.started[0]
+    assert started['QueryString'] == 'EXECUTE serverlessprez_large_counties'
+    assert started['ExecutionParameters'] == ['200000']
+    assert started['WorkGroup'] == lambda_ui.WORK_GROUP
+
+
+def test_named_query_parameters_are_validated(athena):
+    assert handle(query='population_by_state', statefp='47')['statusCode'] == 200
+    assert athena.started[0]['ExecutionParameters'] == ["'47'"]
+    assert handle(query='population_by_state', statefp="47' OR 1=1")['statusCode'] == 400
+
+
+def test_raw_sql_is_disabled(athena):
+    assert handle(sql='SELECT 1')['statusCode'] == 400
+    assert athena.started == []
+
+
+@pytest.mark.parametrize('limit', ['ten', '0', '-5'])
+def test_bad_limit(athena, limit):
+    assert handle(limit=limit)['statusCode'] == 400
+    assert athena.started == []
+
+
+def test_decimals_stay_exact(monkeypatch):
+    athena = StubAthena([('county', 'varchar'), ('share', 'decimal'), ('rate', 'double')],
+                        [['Davidson', '0.12345678901234567890', '0.5'], ['Shelby', None, None]])
+    monkeypatch.setattr(lambda_ui, 'ath', athena)
+    assert json.loads(handle()['body']) == [
+        {'county': 'Davidson', 'share': '0.12345678901234567890', 'rate': 0.5},
+        {'county': 'Shelby', 'share': None, 'rate': None},
+    ]
+
+
+@pytest.mark.parametrize('cursor', [lambda_ui.encode_cursor('qid', 'tampered'), 'not a cursor', 'e30='])
+def test_bad_cursor(athena, cursor):
+    response = handle(cursor=cursor)
+    assert response['statusCode'] == 400
+    assert athena.started == []
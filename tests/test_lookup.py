@@ -0,0 +1,63 @@
+import importlib
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lookup import LookupTable, write_lookup
+
+
+@pytest.fixture
+def table(tmp_path):
+    path = tmp_path/'county.lkp'
+    write_lookup(path, [(k, json.dumps([{'GEOID': k}]).encode()) for k in ['01001', '47001', '47003']],
+                 key_width=5, name='county')
+    return LookupTable(path)
+
+
+def test_get(table):
+    assert table.get('47001') == [{'GEOID': '47001'}]
+    assert table.get('47002') is None
+
+
+@pytest.mark.parametrize('key', ['470019', '47001 ', 'ü'])
+def test_keys_that_cannot_be_stored_miss(table, key):
+    assert table.get(key, []) == []
+
+
+def test_range(table):
+    assert [k for k, _ in table.range('47', '47999')] == ['47001', '47003']
+    assert [k for k, _ in table.range('01001', '47001', limit=1)] == ['01001']
+    # bounds longer than the keys
+    assert [k for k, _ in table.range('010010', '470030')] == ['47001', '47003']
+    assert list(table.range('ü', 'z')) == []
+
+
+@pytest.fixture
+def app(table, monkeypatch):
+    app = importlib.import_module('lambda')
+
+    def get(key, version):
+        if key != 'lookup/county_population.lkp':
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return table
+
+    monkeypatch.setattr(app.lookups, 'get', get)
+    monkeypatch.setattr(app.cache, 'dataset_version', lambda: 'v1')
+    return app
+
+
+def test_lookup_response(app):
+    response = app.lookup_response({'lookup': 'county_population', 'lo': '47', 'hi': '48', 'limit': '1'})
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == [{'GEOID': '47001'}]
+    assert app.lookup_response({'lookup': 'county_population', 'key': '470011'})['statusCode'] == 404
+
+
+def test_lookup_bad_limit(app):
+    response = app.lookup_response({'lookup': 'county_population', 'lo': '47', 'hi': '48', 'limit': 'ten'})
+    assert response['statusCode'] == 400
+
+
+def test_lookup_missing_artifact(app):
+    assert app.lookup_response({'lookup': 'zip_county', 'key': '37013'})['statusCode'] == 404
@@ -0,0 +1,61 @@
+import json
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from serverless import settings
+from serverless.pipeline.data.tiger import partition_geo_data
+from serverless.pipeline.partitions import iter_partitions, read_manifests, partition_projection_properties
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'root_path', tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def counties():
+    return gpd.GeoDataFrame({
+        'STATEFP': pd.Series(['47', '47', '01'], dtype='string'),
+        'GEOID': pd.Series(['47001', '47003', '01001'], dtype='string'),
+    }, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)], crs=4269)
+
+
+def test_partition_frame_without_path(root, counties):
+    processed_path = root/settings.data.processed_path/'tiger'/'county'
+    entries = partition_geo_data(None, [], processed_path, input_df=counties, max_workers=1)
+    assert [e['path'] for e in entries] == [f'{settings.data.processed_path}/tiger/county/county.geojson']
+    manifest = root/settings.data.manifest_path/'tiger'/'county'/'county.json'
+    assert json.loads(manifest.read_text())['source'] == 'county'
+
+
+def test_partition_by_state(root, counties):
+    processed_path = root/settings.data.processed_path/'tiger'/'county'
+    entries = partition_geo_data('tl_2021_us_county.zip', ['STATEFP'], processed_path,
+                                 input_df=counties, max_workers=1)
+    assert sorted((e['partition']['STATEFP'], e['rows']) for e in entries) == [('01', 1), ('47', 2)]
+    assert read_manifests('tiger/county') == entries
+
+
+def test_partitions_keep_only_their_categories():
+    df = pd.DataFrame({'statefp': ['47', '01', '47'], 'city': pd.Categorical(['nashville', 'autauga', 'memphis'])})
+    parts = {values: part for values, part in iter_partitions(df, ['statefp'])}
+    assert list(parts[('01',)]['city'].cat.categories) == ['autauga']
+    assert list(parts[('47',)]['city'].cat.categories) == ['memphis', 'nashville']
+
+
+def test_projection_injects_high_cardinality_keys():
+    entries = [{'partition': {'STATEFP20': state, 'COUNTYFP20': f'{county:03}', 'TRACTCE20': f'{tract:06}'}}
+               for state in ('01', '47') for county in range(1, 40, 2) for tract in range(50)]
+    properties = partition_projection_properties('s3://bucket/tiger/block/', ['STATEFP20', 'COUNTYFP20', 'TRACTCE20'],
+                                                  entries, max_enum_partitions=100)
+    assert properties['projection.statefp20.type'] == 'enum'
+    assert properties['projection.statefp20.values'] == '01,47'
+    assert properties['projection.countyfp20.type'] == 'enum'
+    assert properties['projection.tractce20.type'] == 'injected'
+    assert 'projection.tractce20.values' not in properties
+    assert properties['storage.location.template'] == \
+        's3://bucket/tiger/block/statefp20=${statefp20}/countyfp20=${countyfp20}/tractce20=${tractce20}/'
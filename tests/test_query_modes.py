@@ -0,0 +1,56 @@
+import importlib
+import io
+import json
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from moto import mock_aws
+
+BUCKET = 'serverlessprez'
+
+
+@pytest.fixture
+def app(monkeypatch):
+    with mock_aws():
+        app = importlib.import_module('lambda')
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(app, 's3_client', s3)
+        monkeypatch.setattr(app.cache, 'dataset_version', lambda: 'v1')
+        yield app
+
+
+def handle(app, **params):
+    return app.lambda_handler({'queryStringParameters': {'cache': '0', **params}}, None)
+
+
+def test_unknown_mode(app):
+    assert handle(app, mode='sqlite')['statusCode'] == 400
+
+
+def test_pandas_mode_unknown_column(app, monkeypatch):
+    frame = pd.DataFrame({'zip': ['37013'], 'county': ['47037']})
+    monkeypatch.setattr(app.QueryAthena, 'execute_query', lambda self, sql, **kwargs: frame)
+    assert json.loads(handle(app, mode='pandas', columns='zip')['body']) == [{'zip': '37013'}]
+    response = handle(app, mode='pandas', columns='zip,state')
+    assert response['statusCode'] == 400
+    assert 'state' in json.loads(response['body'])['error']
+
+
+def test_unload_mode_reads_columns_and_cleans_up(app, monkeypatch):
+    def start(self, sql, **kwargs):
+        # what Athena's UNLOAD would write
+        prefix = sql.split(f's3://{BUCKET}/')[1].split("'")[0]
+        buffer = io.BytesIO()
+        pq.write_table(pa.table({'zip': ['37013'], 'county': ['47037']}), buffer)
+        app.s3_client.put_object(Bucket=BUCKET, Key=f'{prefix}part-0.parquet', Body=buffer.getvalue())
+        return 'qid'
+
+    monkeypatch.setattr(app.QueryAthena, 'start', start)
+    response = handle(app, mode='unload', columns='county')
+    assert json.loads(response['body']) == [{'county': '47037'}]
+    assert handle(app, mode='unload', columns='state')['statusCode'] == 400
+    assert 'Contents' not in app.s3_client.list_objects_v2(Bucket=BUCKET, Prefix='database/queries/unload/')
@@ -0,0 +1,58 @@
+import io
+import json
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from result_cache import VERSION_KEY, ResultCache
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class StubS3:
+    """Objects in a dict; `errors` maps an operation to the error code it raises."""
+
+    def __init__(self, objects=None, errors=None):
+        self.objects = dict(objects or {})
+        self.errors = errors or {}
+
+    def get_object(self, Bucket, Key):
+        if 'get_object' in self.errors:
+            raise client_error(self.errors['get_object'], 'GetObject')
+        if Key not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]), 'LastModified': datetime.now(timezone.utc)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if 'put_object' in self.errors:
+            raise client_error(self.errors['put_object'], 'PutObject')
+        self.objects[Key] = Body
+
+
+def test_hits_in_both_tiers():
+    s3 = StubS3({VERSION_KEY: json.dumps({'version': 'v1'}).encode()})
+    ResultCache(s3, 'bucket').put('SELECT 1', 'body')
+    assert ResultCache(s3, 'bucket').get('select 1;') == ('body', 's3')
+
+
+def test_access_denied_and_throttling_are_misses():
+    for code in ('AccessDenied', 'SlowDown'):
+        cache = ResultCache(StubS3(errors={'get_object': code}), 'bucket')
+        assert cache.dataset_version() == '0'
+        assert cache.get('SELECT 1') == (None, None)
+
+
+def test_failed_put_keeps_the_body_in_memory():
+    cache = ResultCache(StubS3(errors={'put_object': 'AccessDenied'}), 'bucket')
+    cache.put('SELECT 1', 'body')
+    assert cache.get('SELECT 1') == ('body', 'memory')
+
+
+def test_version_errors_keep_the_last_version():
+    s3 = StubS3({VERSION_KEY: json.dumps({'version': 'v1'}).encode()})
+    cache = ResultCache(s3, 'bucket', version_ttl=-1)
+    assert cache.dataset_version() == 'v1'
+    s3.errors['get_object'] = 'SlowDown'
+    assert cache.dataset_version() == 'v1'
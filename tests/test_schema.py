@@ -0,0 +1,63 @@
+import json
+
+from serverless.pipeline.schema import create_table_sql, esri_json_columns, table_matches
+
+
+COLUMNS = [('GEOID', 'STRING'), ('ALAND', 'BIGINT'), ('AWATER', 'DECIMAL(12, 2)'), ('STATEFP', 'STRING')]
+
+
+def metadata(columns=COLUMNS, parameters=None):
+    return {
+        'Name': 'tiger_county',
+        'Columns': [{'Name': n.lower(), 'Type': t.lower().replace(' ', '')} for n, t in columns if n != 'STATEFP'],
+        'PartitionKeys': [{'Name': 'statefp', 'Type': 'string'}],
+        'Parameters': {'EXTERNAL': 'TRUE', 'parquet.compression': 'SNAPPY', **(parameters or {})},
+    }
+
+
+def test_unchanged_table_matches():
+    assert table_matches(metadata(), COLUMNS, ['STATEFP'], {'parquet.compression': 'SNAPPY'})
+
+
+def test_changed_columns_or_keys_do_not_match():
+    assert not table_matches(metadata(), COLUMNS + [('NAME', 'STRING')], ['STATEFP'])
+    assert not table_matches(metadata(), [('GEOID', 'STRING'), ('ALAND', 'DOUBLE'), ('AWATER', 'DECIMAL(12,2)')],
+                             ['STATEFP'])
+    assert not table_matches(metadata(), COLUMNS, ['STATEFP', 'GEOID'])
+
+
+def test_changed_properties_do_not_match():
+    assert not table_matches(metadata(), COLUMNS, ['STATEFP'], {'parquet.compression': 'ZSTD'})
+    projected = metadata(parameters={'projection.enabled': 'true'})
+    assert not table_matches(projected, COLUMNS, ['STATEFP'], {'parquet.compression': 'SNAPPY'})
+
+
+def test_create_table_sql_skips_partition_columns():
+    sql = create_table_sql('serverlessprez.tiger_county', COLUMNS, ['STATEFP'])
+    assert '`STATEFP`' not in sql
+    assert sql.endswith('PARTITIONED BY (STATEFP STRING)')
+
+
+def write_esri(path, attributes, fields=None):
+    header = {'displayFieldName': '', 'fieldAliases': {k: k for k in attributes[0]}}
+    if fields:
+        header['fields'] = [{'name': k, 'type': t, 'alias': k} for k, t in fields.items()]
+    features = [{'attributes': a, 'geometry': {'rings': [[[0, 0], [1, 0], [0, 1], [0, 0]]]}} for a in attributes]
+    path.write_text(json.dumps({**header, 'features': features}))
+    return path
+
+
+def test_esri_columns_widen_mixed_numbers(tmp_path):
+    path = write_esri(tmp_path/'a.geojson', [
+        {'GEOID': '47001', 'ALAND': 1, 'RATE': None, 'FLAG': True},
+        {'GEOID': '47003', 'ALAND': 2.5, 'RATE': 3, 'FLAG': 'x'},
+    ])
+    assert esri_json_columns(path) == [
+        ('GEOID', 'STRING'), ('ALAND', 'DOUBLE'), ('RATE', 'BIGINT'), ('FLAG', 'STRING'), ('geometry', 'BINARY')
+    ]
+
+
+def test_esri_columns_use_declared_fields(tmp_path):
+    path = write_esri(tmp_path/'a.geojson', [{'GEOID': '47001', 'ALAND': 1}],
+                      fields={'GEOID': 'esriFieldTypeString', 'ALAND': 'esriFieldTypeDouble'})
+    assert esri_json_columns(path) == [('GEOID', 'STRING'), ('ALAND', 'DOUBLE'), ('geometry', 'BINARY')]
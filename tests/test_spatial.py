@@ -0,0 +1,65 @@
+import importlib
+import json
+
+import numpy as np
+import pytest
+
+from serverless.pipeline.spatial_index import str_order, write_index
+from spatial import SpatialIndex
+
+
+def write_squares(path, squares):
+    """An index of axis-aligned squares given as `(minx, miny, maxx, maxy, attributes)`."""
+    boxes = np.array([s[:4] for s in squares], dtype='f8')
+    order = str_order(boxes)
+    rings = [
+        [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+        for x0, y0, x1, y1 in boxes[order]
+    ]
+    write_index(
+        path, boxes[order], np.array([c for ring in rings for c in ring], dtype='f8'),
+        np.arange(len(rings) + 1) * 5, np.arange(len(rings) + 1),
+        [json.dumps(squares[i][4]).encode() for i in order],
+    )
+    return SpatialIndex(path)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    app = importlib.import_module('lambda')
+    indexes = {
+        # two counties in Tennessee and one in Alabama
+        'spatial/county/all.sidx': write_squares(tmp_path/'county.sidx', [
+            (0, 0, 1, 1, {'GEOID': '47001', 'STATEFP': '47'}),
+            (1, 0, 2, 1, {'GEOID': '47003', 'STATEFP': '47'}),
+            (2, 0, 3, 1, {'GEOID': '01001', 'STATEFP': '01'}),
+        ]),
+        'spatial/tract/47.sidx': write_squares(tmp_path/'tract47.sidx', [
+            (0, 0, 1, 1, {'GEOID': '47001000100'}),
+            (1, 0, 2, 1, {'GEOID': '47003000100'}),
+        ]),
+        'spatial/tract/01.sidx': write_squares(tmp_path/'tract01.sidx', [
+            (2, 0, 3, 1, {'GEOID': '01001000100'}),
+        ]),
+    }
+    monkeypatch.setattr(app.spatial_indexes, 'get', lambda key, version: indexes[key])
+    return app
+
+
+def test_query_points(tmp_path):
+    index = write_squares(tmp_path/'squares.sidx', [
+        (0, 0, 1, 1, {'id': 'a'}),
+        (1, 0, 2, 1, {'id': 'b'}),
+    ])
+    found = index.query_points([0.5, 1.5, 5.0], [0.5, 0.5, 5.0])
+    assert [index.attributes_of(f)['id'] if f >= 0 else None for f in found] == ['a', 'b', None]
+
+
+def test_locate_points_two_counties_one_state(app):
+    results = app.locate_points('tract', [0.5, 1.5], [0.5, 0.5], 'v1')
+    assert [r['GEOID'] for r in results] == ['47001000100', '47003000100']
+
+
+def test_locate_points_across_states_and_outside(app):
+    results = app.locate_points('tract', [2.5, 0.5, 9.0, 1.5], [0.5, 0.5, 9.0, 0.5], 'v1')
+    assert [r and r['GEOID'] for r in results] == ['01001000100', '47001000100', None, '47003000100']
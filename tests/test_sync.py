@@ -0,0 +1,151 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from serverless.pipeline.sync import VERSION_KEY, load_sync_state, plan_sync, sync_to_s3
+
+BUCKET = 'serverlessprez'
+PREFIX = 'data/processed/'
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def write_files(root, contents):
+    files = {}
+    for key, text in contents.items():
+        path = root/key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+        files[key] = path
+    return files
+
+
+def keys(client):
+    return sorted(o['Key'] for o in client.list_objects_v2(Bucket=BUCKET).get('Contents', []))
+
+
+def test_plan_sync():
+    local = {
+        'new': {'size': 1, 'md5': 'n'},
+        'same': {'size': 1, 'md5': 's'},
+        'multipart': {'size': 1, 'md5': 'm'},
+        'changed': {'size': 1, 'md5': 'c2'},
+        'resized': {'size': 2, 'md5': 'r'},
+    }
+    remote = {
+        'same': {'size': 1, 'etag': 's'},
+        'multipart': {'size': 1, 'etag': 'm-2'},
+        'changed': {'size': 1, 'etag': 'c1'},
+        'resized': {'size': 1, 'etag': 'r'},
+        'data/processed/county/gone.csv': {'size': 1, 'etag': 'g'},
+        'data/processed/tract/gone.csv': {'size': 1, 'etag': 'g'},
+    }
+    state = {'multipart': {'md5': 'm', 'etag': 'm-2'}, 'changed': {'md5': 'c1', 'etag': 'c1'}}
+    plan = plan_sync(local, remote, state)
+    assert plan == {'upload': ['changed', 'new', 'resized'], 'unchanged': ['multipart', 'same'], 'delete': []}
+    plan = plan_sync(local, remote, state, delete=True, path='^data/processed/county/')
+    assert plan['delete'] == ['data/processed/county/gone.csv']
+
+
+def test_sync_uploads_changes_and_publishes_version(client, tmp_path):
+    state_path = tmp_path/'s3_sync.json'
+    files = write_files(tmp_path, {PREFIX + 'county/a.csv': 'a', PREFIX + 'county/b.csv': 'b'})
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+    assert plan['upload'] == [PREFIX + 'county/a.csv', PREFIX + 'county/b.csv']
+    assert keys(client) == [PREFIX + 'county/a.csv', PREFIX + 'county/b.csv', VERSION_KEY]
+    first = plan['version']
+
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+    assert plan['upload'] == [] and 'version' not in plan
+
+    files[PREFIX + 'county/a.csv'].write_text('a2')
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+    assert plan['upload'] == [PREFIX + 'county/a.csv']
+    assert plan['version'] != first
+
+
+def test_missing_version_is_published_without_changes(client, tmp_path):
+    state_path = tmp_path/'s3_sync.json'
+    files = write_files(tmp_path, {PREFIX + 'county/a.csv': 'a'})
+    first = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)['version']
+    client.delete_object(Bucket=BUCKET, Key=VERSION_KEY)
+
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+    assert plan['upload'] == [] and plan['version'] == first
+    assert VERSION_KEY in keys(client)
+
+
+def test_dry_run_touches_nothing(client, tmp_path):
+    state_path = tmp_path/'s3_sync.json'
+    files = write_files(tmp_path, {PREFIX + 'county/a.csv': 'a'})
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, dry_run=True, state_path=state_path)
+    assert plan['upload'] == [PREFIX + 'county/a.csv']
+    assert keys(client) == []
+    assert not state_path.exists()
+
+
+def test_filtered_sync_merges_state_and_deletes_by_key(client, tmp_path):
+    state_path = tmp_path/'s3_sync.json'
+    files = write_files(tmp_path, {
+        PREFIX + 'county/a.csv': 'a', PREFIX + 'county/b.csv': 'b', PREFIX + 'tract/c.csv': 'c',
+    })
+    sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+
+    # a county-only sync after b.csv was removed locally
+    county = {k: v for k, v in files.items() if '/county/' in k and not k.endswith('b.csv')}
+    plan = sync_to_s3(client, BUCKET, county, PREFIX, delete=True, path='^data/processed/county/',
+                      state_path=state_path)
+    assert plan['delete'] == [PREFIX + 'county/b.csv']
+    assert keys(client) == [PREFIX + 'county/a.csv', PREFIX + 'tract/c.csv', VERSION_KEY]
+    # the tract entry survives, so the next full sync has nothing to upload
+    assert sorted(load_sync_state(state_path)) == [PREFIX + 'county/a.csv', PREFIX + 'tract/c.csv']
+    del files[PREFIX + 'county/b.csv']
+    assert sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)['upload'] == []
+
+
+def test_failed_uploads_are_not_recorded(client, tmp_path):
+    state_path = tmp_path/'s3_sync.json'
+    files = write_files(tmp_path, {PREFIX + 'county/a.csv': 'a', PREFIX + 'county/b.csv': 'b'})
+    sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+
+    files[PREFIX + 'county/a.csv'].write_text('a2')
+    files[PREFIX + 'county/b.csv'].write_text('b2')
+
+    def upload(client, bucket, jobs):
+        for file, key in jobs:
+            if key.endswith('a.csv'):
+                client.upload_file(file, bucket, key)
+        return {'failed': [{'key': key, 'error': 'boom'} for _, key in jobs if key.endswith('b.csv')]}
+
+    with pytest.raises(RuntimeError, match='1 of 2 uploads failed'):
+        sync_to_s3(client, BUCKET, files, PREFIX, upload=upload, state_path=state_path)
+
+    state = load_sync_state(state_path)
+    assert state[PREFIX + 'county/b.csv']['size'] == 1
+    assert state[PREFIX + 'county/a.csv']['size'] == 2
+    # the next sync retries only the failed upload
+    plan = sync_to_s3(client, BUCKET, files, PREFIX, state_path=state_path)
+    assert plan['upload'] == [PREFIX + 'county/b.csv']
+    assert plan['failed'] == []
+    assert client.get_object(Bucket=BUCKET, Key=PREFIX + 'county/b.csv')['Body'].read() == b'b2'
+
+
+def test_upload_artifacts_deletes_stale_tiles(client, tmp_path, monkeypatch):
+    from serverless import settings
+    from serverless.pipeline import pipeline
+
+    monkeypatch.setattr(settings, 'root_path', tmp_path)
+    monkeypatch.setattr(pipeline, 's3_client', client)
+    tiles = tmp_path/'tiles'
+    write_files(tiles, {'county/2/0/1.mvt': 'a', 'county/2/1/1.mvt': 'b'})
+    pipeline.Pipeline(None).upload_artifacts(local_dir=tiles, prefix='tiles', delete=True)
+
+    (tiles/'county/2/0/1.mvt').unlink()
+    pipeline.Pipeline(None).upload_artifacts(local_dir=tiles, prefix='tiles', delete=True)
+    assert keys(client) == [VERSION_KEY, 'tiles/county/2/1/1.mvt']
@@ -0,0 +1,50 @@
+import shutil
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from serverless import settings
+from serverless.pipeline.data.tiger import process_tiger_unit
+from serverless.pipeline.partitions import manifest_path, read_manifests
+
+FILE = 'tl_2021_us_county.zip'
+
+
+@pytest.fixture
+def county(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'root_path', tmp_path)
+    layer = settings.etl.tiger.county
+    paths = {name: tmp_path/getattr(settings.data, name)/layer.file_path
+             for name in ('raw_path', 'interim_path', 'processed_path')}
+    for path in paths.values():
+        path.mkdir(parents=True)
+    return paths
+
+
+def write_raw_zip(raw_path, tmp_path):
+    shp_dir = tmp_path/'shp'
+    shp_dir.mkdir()
+    gpd.GeoDataFrame({
+        'GEOID': ['47001', '01001'], 'STATEFP': ['47', '01'], 'COUNTYFP': ['001', '001'],
+        'NAME': ['Anderson', 'Autauga'],
+    }, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)], crs=4269).to_file(shp_dir/'tl_2021_us_county.shp')
+    shutil.make_archive(str(raw_path/'tl_2021_us_county'), 'zip', shp_dir)
+
+
+def test_missing_raw_file_fails(county):
+    result = process_tiger_unit('county', FILE)
+    assert result['status'] == 'failed'
+    assert 'FileNotFoundError' in result['error']
+
+
+def test_unfinished_unit_is_processed_then_skipped(county, tmp_path):
+    write_raw_zip(county['raw_path'], tmp_path)
+    # a raw file from an earlier run without a manifest: processing never finished
+    assert process_tiger_unit('county', FILE)['status'] == 'ok'
+    assert manifest_path(county['processed_path'], FILE).is_file()
+    assert sorted(e['partition']['STATEFP'] for e in read_manifests('tiger/county')) == ['01', '47']
+
+    assert process_tiger_unit('county', FILE)['status'] == 'skipped'
+    assert process_tiger_unit('county', FILE, downloaded=True)['status'] == 'ok'
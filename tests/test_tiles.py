@@ -0,0 +1,70 @@
+import importlib
+
+import pytest
+from botocore.exceptions import ClientError
+
+from serverless import settings
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = importlib.import_module('lambda')
+    keys = []
+
+    def get_object(**kwargs):
+        keys.append(kwargs['Key'])
+        raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+    monkeypatch.setattr(app.s3_client, 'get_object', get_object)
+    monkeypatch.setattr(app.cache, 'dataset_version', lambda: 'v1')
+    app.requested_keys = keys
+    return app
+
+
+def tile(app, path):
+    return app.tile_response(app.TILE_PATH.search(path), {})
+
+
+def test_tile_zooms_match_settings():
+    for layer, zooms in importlib.import_module('lambda').TILE_ZOOMS.items():
+        assert zooms == set(settings.etl.tiger[layer].tiles.zooms)
+
+
+def test_missing_tile_in_pyramid_is_empty(app):
+    assert tile(app, 'tiles/county/2/1/3.mvt')['statusCode'] == 204
+    assert app.requested_keys == ['tiles/county/2/1/3.mvt']
+
+
+@pytest.mark.parametrize('path', ['tiles/county/3/1/1.mvt', 'tiles/tract/4/1/1', 'tiles/county/2/4/0.mvt'])
+def test_tile_outside_pyramid_is_not_found(app, path):
+    assert tile(app, path)['statusCode'] == 404
+    assert app.requested_keys == []
+
+
+def test_unknown_tile_layer(app):
+    assert tile(app, 'tiles/state/2/1/1.mvt')['statusCode'] == 400
+
+
+def test_rebuilt_tiles_drop_stale_ones(tmp_path, monkeypatch):
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    from serverless.pipeline import pipeline
+    from serverless.pipeline.data.tiles import build_tiles, simplified_path, simplify_geo_data, tiles_path
+
+    monkeypatch.setattr(settings, 'root_path', tmp_path)
+    nashville = box(-87, 36, -86.5, 36.5)
+    anchorage = box(-150, 61, -149.5, 61.5)
+
+    def build(geometry):
+        gdf = gpd.GeoDataFrame({'GEOID': [str(i) for i in range(len(geometry))]}, geometry=geometry, crs=4269)
+        simplify_geo_data(gdf, 'county', 'tl_2021_us_county', [2])
+        build_tiles('county', [2])
+        return sorted(p.relative_to(tiles_path('county')).as_posix() for p in tiles_path('county').rglob('*.mvt'))
+
+    assert build([nashville, anchorage]) == ['2/0/1.mvt', '2/1/1.mvt']
+    assert build([nashville]) == ['2/1/1.mvt']
+
+    # the simplified copies sit beside the partitions but aren't a table
+    assert simplified_path('county').parent == tmp_path/settings.data.processed_path/'tiger'/'county'
+    assert pipeline.Pipeline(None)._get_dirs() == {}
@@ -0,0 +1,66 @@
+import os
+import tracemalloc
+
+import pytest
+
+from serverless import tracing
+
+
+@pytest.fixture
+def traced():
+    tracing.clear()
+    tracing.enable(memory=False)
+    yield tracing
+    tracing.disable()
+    tracing.clear()
+
+
+def spans(name):
+    return [e for e in tracing.events() if e['ph'] == 'X' and e['name'] == name]
+
+
+def worker_events(rows):
+    """Events as a worker process would return them from `collect()`."""
+    with tracing.span('process_tiger_unit'):
+        with tracing.span('partition'):
+            tracing.count('rows', rows)
+        tracing.count('bytes_written', 10)
+    events = tracing.collect()
+    for e in events:
+        e['pid'] = os.getpid() + 1
+    return events
+
+
+def test_counters_roll_up(traced):
+    with tracing.span('outer'):
+        with tracing.span('inner'):
+            tracing.count('rows', 3)
+        tracing.count('rows', 2)
+    assert spans('inner')[0]['args']['rows'] == 3
+    assert spans('outer')[0]['args']['rows'] == 5
+
+
+def test_merged_worker_counters_reach_enclosing_spans(traced):
+    first, second = worker_events(100), worker_events(50)
+    with tracing.span('step:tiger'):
+        with tracing.span('tiger'):
+            tracing.merge(first)
+            tracing.merge(second)
+    for name in ('tiger', 'step:tiger'):
+        args = spans(name)[0]['args']
+        assert args['rows'] == 150
+        assert args['bytes_written'] == 20
+    assert len(spans('process_tiger_unit')) == 2
+
+
+def test_tracemalloc_peak_reset_without_reset_peak(traced, monkeypatch):
+    tracing.enable(memory=True)
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    try:
+        with tracing.span('outer'):
+            pass
+        assert tracemalloc.is_tracing()
+        assert spans('outer')[0]['args']['tracemalloc_peak'] >= 0
+    finally:
+        tracing.enable(memory=False)
+        tracemalloc.stop()